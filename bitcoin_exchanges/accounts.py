@@ -0,0 +1,141 @@
+"""
+Running many accounts on one exchange from one process.
+
+An AccountGroup holds a client for each of an exchange's accounts (see exchange_util.get_client). The clients share
+the exchange's pooled connections, DNS cache, retry budget and circuit breakers, while each keeps its own nonces and
+rate limit. Public market data is the same for every account, so it is fetched once and shared through a short-lived
+MarketDataCache. Calls made on every account, such as getting balances or cancelling all orders, run concurrently.
+"""
+import importlib
+import threading
+import time
+
+from requests.exceptions import ConnectionError, Timeout
+
+from bitcoin_exchanges.exchange_util import ExchangeError, exchange_config, fan_out, get_client
+
+MARKET_DATA_TTL = 1  # seconds
+ACCOUNT_WORKERS = 32  # accounts called at once
+
+
+class MarketDataCache(object):
+    """
+    Public market data, kept for ttl seconds. When several threads ask for the same data at once, only the first
+    fetches it, and the rest wait for its result.
+    """
+
+    def __init__(self, ttl=MARKET_DATA_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, fetch, *key):
+        """
+        :param fetch: called with no arguments to get the data if it is not cached
+        :param key: what identifies the data, e.g. the exchange, method name and pair
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.time():
+            return entry[1]
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                return entry[1]
+            value = fetch()
+            self._entries[key] = (time.time() + self.ttl, value)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_market_data = MarketDataCache()
+
+
+def get_market_data_cache():
+    """:return: the MarketDataCache shared by every AccountGroup by default"""
+    return _market_data
+
+
+class AccountGroup(object):
+    """Several accounts on one exchange, called together."""
+
+    def __init__(self, exchange, accounts=None, workers=ACCOUNT_WORKERS, cache=None):
+        """
+        :param str exchange: the exchange name
+        :param list accounts: account names, where None is the exchange's api_creds. Defaults to the api_creds and
+                              every one of the exchange's 'accounts' in exchange_config.
+        :param int workers: the most accounts to call at once
+        :param MarketDataCache cache: where to share public data. Defaults to the process wide cache.
+        """
+        self.exchange = exchange
+        self._accounts = accounts
+        self.workers = workers
+        self.cache = cache if cache is not None else _market_data
+        self.eclass = importlib.import_module('bitcoin_exchanges.%s' % exchange).eclass
+        self.errors = {}
+
+    @property
+    def accounts(self):
+        """The account names, read from the current config unless they were given."""
+        if self._accounts is not None:
+            return list(self._accounts)
+        return [None] + sorted(exchange_config[self.exchange].get('accounts') or {})
+
+    def client(self, account=None):
+        """:rtype: ExchangeABC"""
+        return get_client(self.exchange, account)
+
+    def each(self, method, *args, **kwargs):
+        """
+        Call a client method on every account concurrently. Accounts that fail are left out, and their errors kept
+        in self.errors.
+
+        :param str method: the ExchangeABC method name, e.g. 'get_balance'
+        :return: each account's result, by account name
+        :rtype: dict
+        """
+        self.errors = {}
+
+        def call(account):
+            try:
+                return getattr(self.client(account), method)(*args, **kwargs)
+            except (ExchangeError, ConnectionError, Timeout) as e:
+                self.errors[account] = e
+                return None
+
+        accounts = self.accounts
+        results = fan_out(call, accounts, workers=self.workers)
+        return dict((account, result) for account, result in zip(accounts, results) if account not in self.errors)
+
+    def get_balances(self, btype='total'):
+        """:rtype: dict"""
+        return self.each('get_balance', btype=btype)
+
+    def get_open_orders(self):
+        """:rtype: dict"""
+        return self.each('get_open_orders')
+
+    def cancel_all(self):
+        """
+        Cancel every open order on every account.
+
+        :return: whether each account's orders were cancelled
+        :rtype: dict
+        """
+        return self.each('cancel_orders')
+
+    def get_ticker(self, pair=None):
+        """The exchange's ticker, fetched once for all accounts."""
+        args = (pair,) if pair is not None else ()
+        return self.cache.get(lambda: self.eclass.get_ticker(*args), self.exchange, 'ticker', pair)
+
+    def get_order_book(self, pair=None, depth=None):
+        """The exchange's order book, fetched once for all accounts."""
+        args = (pair,) if pair is not None else ()
+        return self.cache.get(lambda: self.eclass.get_order_book(*args, depth=depth),
+                              self.exchange, 'book', pair, depth)
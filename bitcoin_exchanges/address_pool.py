@@ -0,0 +1,150 @@
+"""
+A pool of deposit addresses for every exchange, fetched ahead of time.
+
+Most exchanges look up a deposit address with a private call, and Kraken's addresses expire. An AddressPool fetches
+each exchange's addresses in the background, asking for new ones where the exchange can make them, until it holds
+size usable addresses. An address is usable until margin seconds before it expires. get hands out an exchange's
+usable addresses in turn, from memory, so callers never wait on the exchange once the pool is filled. A pool holds
+addresses for one currency.
+"""
+import threading
+import time
+
+from bitcoin_exchanges.exchange_util import ExchangeError, fan_out, get_live_exchange_workers
+
+POOL_SIZE = 3  # usable addresses to keep per exchange, where it can make new ones
+EXPIRY_MARGIN = 3600  # seconds before expiry that an address stops being handed out
+REFRESH_INTERVAL = 600  # seconds
+
+
+class AddressPool(object):
+    """Deposit addresses by exchange, refreshed and rotated."""
+
+    def __init__(self, exchanges=None, size=POOL_SIZE, margin=EXPIRY_MARGIN, interval=REFRESH_INTERVAL,
+                 currency='BTC'):
+        """
+        :param dict exchanges: exchange clients by name. Defaults to all of the live exchanges which take deposits of
+                               currency.
+        :param int size: the usable addresses to keep per exchange
+        :param int margin: seconds before expiry to stop handing out an address
+        :param int interval: seconds between background refreshes
+        :param str currency: the currency to hold addresses for
+        """
+        if exchanges is None:
+            exchanges = dict((name, mod.exchange) for name, mod in get_live_exchange_workers().iteritems()
+                             if currency in mod.eclass.deposit_currencies)
+        self.exchanges = exchanges
+        self.currency = currency
+        self.size = size
+        self.margin = margin
+        self.interval = interval
+        self.addresses = dict((name, []) for name in exchanges)  # DepositAddresses, next to hand out first
+        self.fetched = {}  # name: time of the last refresh
+        self.errors = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def usable(self, name, now=None):
+        """
+        :return: an exchange's addresses which are not about to expire, next to hand out first
+        :rtype: list
+        """
+        cutoff = (now or time.time()) + self.margin
+        with self._lock:
+            return [a for a in self.addresses[name] if a.expires is None or a.expires > cutoff]
+
+    def refresh(self, name):
+        """
+        Fetch an exchange's addresses, and ask for new ones until it has size usable addresses or it stops giving
+        new ones. On failure the addresses already held are kept, and the error kept in self.errors.
+
+        :return: whether the addresses were fetched
+        :rtype: bool
+        """
+        client = self.exchanges[name]
+        try:
+            fetched = client.get_deposit_addresses(currency=self.currency)
+            known = set(a.address for a in fetched)
+            now = time.time()
+            usable = [a for a in fetched if a.expires is None or a.expires > now + self.margin]
+            while len(usable) < self.size:
+                new = [a for a in client.get_deposit_addresses(new=True, currency=self.currency)
+                       if a.address not in known]
+                if not new:
+                    break  # the exchange has one address, or will make no more
+                known.update(a.address for a in new)
+                fetched.extend(new)
+                usable.extend(new)
+        except ExchangeError as e:
+            self.errors[name] = e
+            return False
+        with self._lock:
+            # keep the rotation order of the addresses already held, with any new ones last
+            current = dict((a.address, a) for a in fetched)
+            order = [a.address for a in self.addresses[name] if a.address in current]
+            order.extend(a.address for a in fetched if a.address not in order)
+            self.addresses[name] = [current[address] for address in order]
+            self.fetched[name] = time.time()
+        self.errors.pop(name, None)
+        return True
+
+    def prefetch(self):
+        """Fill every exchange's addresses concurrently, waiting for them all."""
+        fan_out(self.refresh, list(self.exchanges))
+
+    def get(self, name, block=True, currency='BTC'):
+        """
+        Hand out an exchange's next usable address, and move it to the back of the rotation.
+
+        :param bool block: if the pool has no usable address for the exchange, fetch one now. Otherwise return None.
+        :param str currency: the currency to be deposited, which must be the pool's
+        :rtype: str
+        """
+        if currency != self.currency:
+            raise ExchangeError(name, 'the address pool holds %s addresses, not %s' % (self.currency, currency))
+        usable = self.usable(name)
+        if not usable and block:
+            if not self.refresh(name):
+                raise self.errors[name]
+            usable = self.usable(name)
+        if not usable:
+            if block:
+                raise ExchangeError(name, 'no usable deposit address')
+            return None
+        address = usable[0]
+        with self._lock:
+            addresses = self.addresses[name]
+            if address in addresses:
+                addresses.remove(address)
+                addresses.append(address)
+        return address.address
+
+    def start(self):
+        """Prefetch every exchange's addresses, then refresh them every interval, in the background."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='address-pool')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        self.prefetch()
+        while not self._stop.wait(self._next_wait()):
+            self.prefetch()
+
+    def _next_wait(self):
+        """Seconds until the next refresh: the interval, or sooner when an address is about to stop being usable."""
+        now = time.time()
+        wait = self.interval
+        with self._lock:
+            for addresses in self.addresses.itervalues():
+                for a in addresses:
+                    if a.expires is not None and a.expires - self.margin > now:
+                        wait = min(wait, a.expires - self.margin - now)
+        return max(wait, 1)
@@ -0,0 +1,180 @@
+"""
+Balances across every exchange, by asset and in one reporting currency.
+
+A BalanceAggregator keeps the last total and available balance fetched from each exchange, with the time it was
+fetched. Each exchange is refreshed by its own thread, so a slow or failing exchange only makes its own balance
+stale, and a report is made at once from whatever balances are held, listing those which are stale.
+
+Amounts are valued in the reporting currency through an FX provider, which is any object with a
+rate(currency, report_currency) method. TickerFX, the default, prices every currency in BTC from a reference
+exchange's ticker, and caches the prices for a minute.
+"""
+from collections import namedtuple
+from decimal import Decimal
+import importlib
+import threading
+import time
+
+from bitcoin_exchanges.accounts import MarketDataCache
+from bitcoin_exchanges.exchange_util import ExchangeError, fan_out, get_live_exchange_workers
+from bitcoin_exchanges.symbols import SYMBOLS
+
+FX_TTL = 60  # seconds to cache prices for
+REFRESH_INTERVAL = 30  # seconds between balance fetches, per exchange
+MAX_AGE = 90  # seconds before a balance is stale
+
+# every currency an exchange trades, which are the ones read from each balance
+ASSETS = tuple(sorted(set(currency for symbols in SYMBOLS.itervalues() for symbol in symbols
+                          for currency in symbol[0].split('/'))))
+
+# the exchange and pair to price each currency in BTC with
+REFERENCE_PAIRS = {
+    'USD': ('bitstamp', 'BTC/USD'),
+    'EUR': ('kraken', 'BTC/EUR'),
+    'CNY': ('huobi', 'BTC/CNY'),
+    'LTC': ('btce', 'LTC/BTC'),
+    'ETH': ('bitfinex', 'ETH/BTC'),
+}
+
+# total and available are Decimals in the asset, and value and available_value in the reporting currency. The
+# values are None when the asset could not be priced.
+AssetExposure = namedtuple('AssetExposure', ['asset', 'total', 'available', 'value', 'available_value'])
+
+# assets is a dict of AssetExposures, and total and available are the sums of the values which could be priced.
+# updated is the time each exchange's balance was fetched, and stale the exchanges without a balance that is fresh.
+BalanceReport = namedtuple('BalanceReport', ['currency', 'assets', 'total', 'available', 'updated', 'stale'])
+
+
+class TickerFX(object):
+    """Exchange rates implied by the last prices of each currency against BTC."""
+
+    def __init__(self, pairs=None, ttl=FX_TTL):
+        """
+        :param dict pairs: the (exchange, pair) to price each currency with. Defaults to REFERENCE_PAIRS.
+        :param int ttl: seconds to reuse a price for
+        """
+        self.pairs = pairs if pairs is not None else REFERENCE_PAIRS
+        self.cache = MarketDataCache(ttl)
+
+    def in_btc(self, currency):
+        """
+        :return: the BTC one unit of currency is worth
+        :rtype: Decimal
+        """
+        if currency == 'BTC':
+            return Decimal(1)
+        if currency not in self.pairs:
+            raise ExchangeError(None, 'no reference pair for %s' % currency)
+        exchange, pair = self.pairs[currency]
+        eclass = importlib.import_module('bitcoin_exchanges.%s' % exchange).eclass
+        last = self.cache.get(lambda: eclass.get_ticker(pair), exchange, pair).last.amount
+        return last if pair.startswith(currency + '/') else 1 / last
+
+    def rate(self, currency, report_currency):
+        """
+        :return: the report_currency one unit of currency is worth
+        :rtype: Decimal
+        """
+        if currency == report_currency:
+            return Decimal(1)
+        return self.in_btc(currency) / self.in_btc(report_currency)
+
+
+class BalanceAggregator(object):
+    """The balances of every live exchange, refreshed independently."""
+
+    def __init__(self, exchanges=None, currency='USD', fx=None, interval=REFRESH_INTERVAL, max_age=MAX_AGE):
+        """
+        :param dict exchanges: exchange clients by name. Defaults to all of the live exchanges.
+        :param str currency: the currency to report values in
+        :param fx: what to get exchange rates from. Defaults to a TickerFX.
+        :param int interval: seconds between fetches of each exchange's balance
+        :param int max_age: seconds before a balance is reported as stale
+        """
+        if exchanges is None:
+            exchanges = dict((name, mod.exchange) for name, mod in get_live_exchange_workers().iteritems())
+        self.exchanges = exchanges
+        self.currency = currency
+        self.fx = fx if fx is not None else TickerFX()
+        self.interval = interval
+        self.max_age = max_age
+        self.balances = {}  # name: (total, available, time fetched)
+        self.errors = {}
+        self._stop = threading.Event()
+        self._threads = []
+
+    def refresh(self, name):
+        """
+        Fetch one exchange's balance. On failure the last balance is kept, and the error kept in self.errors.
+
+        :return: whether the balance was fetched
+        :rtype: bool
+        """
+        try:
+            total, available = self.exchanges[name].get_balance(btype='all')
+        except ExchangeError as e:
+            self.errors[name] = e
+            return False
+        self.balances[name] = (total, available, time.time())
+        self.errors.pop(name, None)
+        return True
+
+    def refresh_all(self):
+        """Fetch every exchange's balance concurrently, waiting for them all."""
+        fan_out(self.refresh, list(self.exchanges))
+
+    def exposure(self):
+        """
+        :return: the total and available amount of each asset, summed across exchanges
+        :rtype: dict
+        """
+        totals = dict((asset, [Decimal(0), Decimal(0)]) for asset in ASSETS)
+        for total, available, fetched in self.balances.values():
+            for asset in ASSETS:
+                totals[asset][0] += total.getMoneys(asset).amount
+                totals[asset][1] += available.getMoneys(asset).amount
+        return dict((asset, amounts) for asset, amounts in totals.iteritems() if amounts[0] or amounts[1])
+
+    def report(self, currency=None):
+        """
+        :param str currency: the currency to report values in. Defaults to the aggregator's.
+        :rtype: BalanceReport
+        """
+        currency = currency or self.currency
+        now = time.time()
+        assets = {}
+        value_total = value_available = Decimal(0)
+        for asset, (total, available) in sorted(self.exposure().iteritems()):
+            try:
+                rate = self.fx.rate(asset, currency)
+            except ExchangeError as e:
+                self.errors[asset] = e
+                assets[asset] = AssetExposure(asset, total, available, None, None)
+                continue
+            self.errors.pop(asset, None)
+            assets[asset] = AssetExposure(asset, total, available, total * rate, available * rate)
+            value_total += total * rate
+            value_available += available * rate
+        updated = dict((name, balance[2]) for name, balance in self.balances.items())
+        stale = sorted(name for name in self.exchanges if now - updated.get(name, 0) > self.max_age)
+        return BalanceReport(currency, assets, value_total, value_available, updated, stale)
+
+    def start(self):
+        """Refresh each exchange's balance every interval, in a thread of its own."""
+        self._stop.clear()
+        for name in self.exchanges:
+            thread = threading.Thread(target=self._run, args=(name,), name='balances-%s' % name)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _run(self, name):
+        self.refresh(name)
+        while not self._stop.wait(self.interval):
+            self.refresh(name)
@@ -1,58 +1,116 @@
-import hmac
 import json
 import time
-import requests
 from requests.exceptions import Timeout, ConnectionError
 from hashlib import sha384
 from base64 import b64encode
 
 from moneyed.classes import Money, MultiMoney
 
-from exchange_util import ExchangeABC, create_ticker, ExchangeError, exchange_config, BLOCK_ORDERS, MyOrder
+from exchange_util import ExchangeABC, DefaultClient, create_ticker, ExchangeError, exchange_config, BLOCK_ORDERS, \
+    MyOrder, Fill, HmacSigner, OrderTemplate, Trade, DepositAddress
+from bitcoin_exchanges import transport
+from bitcoin_exchanges.order_rules import get_order_rules
+from bitcoin_exchanges.symbols import get_symbol
 
 
 BASE_URL = 'https://api.bitfinex.com'
 REQ_TIMEOUT = 10  # seconds
+FILL_PAGE_SIZE = 1000
+PUBLIC_TRADES_PAGE = 500
+
+
+class BitfinexOrderTemplate(OrderTemplate):
+    def __init__(self, exchange, otype, typ='exchange limit', bfxexch='all', pair='BTC/USD'):
+        super(BitfinexOrderTemplate, self).__init__(exchange, otype, typ=typ, bfxexch=bfxexch, pair=pair)
+        if otype == 'bid':
+            side = 'buy'
+        elif otype == 'ask':
+            side = 'sell'
+        else:
+            raise Exception('unknown side %r' % otype)
+        self.params = {
+            'request': '/v1/order/new',
+            'side': side,
+            'symbol': get_symbol('bitfinex', pair).native,
+            'exchange': bfxexch,
+            'type': typ
+        }
+        self.rules = get_order_rules('bitfinex', pair)
+        # the payload's json object, left open for the amount, price and nonce
+        self.payload_head = json.dumps(self.params, separators=(',', ':'))[:-1]
+
+    def submit(self, amount, price):
+        amount, price = self.rules.format(amount, price, self.otype)
+        if BLOCK_ORDERS:
+            return "order blocked"
+
+        def sign():
+            payload = b64encode('%s,"amount":"%s","price":"%s","nonce":"%d"}' % (self.payload_head, amount, price,
+                                                                                 self.exchange.time_nonce(1e6)))
+            return {
+                'X-BFX-APIKEY': self.exchange.key,
+                'X-BFX-PAYLOAD': payload,
+                'X-BFX-SIGNATURE': self.exchange.signer.hexdigest(payload)
+            }
+
+        params = dict(self.params, amount=amount, price=price)
+        try:
+            order = transport.decode(self.exchange.bitfinex_post(params, sign, idempotent=False))
+        except ValueError as e:
+            raise ExchangeError('bitfinex', '%s %s while sending to bitfinex %r' % (type(e), str(e), params))
+
+        if 'is_live' in order and order['is_live']:
+            return str(order['order_id'])
+        raise ExchangeError('bitfinex', 'unable to create order %r response was %r' % (params, order))
 
 
 class Bitfinex(ExchangeABC):
     name = 'bitfinex'
     fiatcurrency = 'USD'
+    hosts = ('api.bitfinex.com',)
+    order_template = BitfinexOrderTemplate
 
     def __init__(self, key, secret):
         super(Bitfinex, self).__init__()
         self.key = key
         self.secret = secret
+        self.signer = HmacSigner(secret, sha384)
 
     def bitfinex_encode(self, msg):
-        msg['nonce'] = str(int(time.time() * 1e6))
-        msg = b64encode(json.dumps(msg))
-        signature = hmac.new(self.secret, msg, sha384).hexdigest()
+        msg['nonce'] = str(self.time_nonce(1e6))
+        msg = b64encode(json.dumps(msg, separators=(',', ':')))
+        signature = self.signer.hexdigest(msg)
         return {
             'X-BFX-APIKEY': self.key,
             'X-BFX-PAYLOAD': msg,
             'X-BFX-SIGNATURE': signature
         }
 
+    def bitfinex_post(self, params, sign, idempotent=True):
+        """
+        Send a signed request to the endpoint in params['request'].
+
+        :param sign: returns freshly signed headers, called again for each retry
+        :param bool idempotent: False if the request is not safe to repeat, like an order
+        """
+        try:
+            return transport.request('bitfinex', 'post', BASE_URL + params['request'],
+                                     private=True, idempotent=idempotent, account_id=self.account_id,
+                                     sign=lambda: {'headers': sign()},
+                                     retry_if=lambda r: "Nonce is too small." in r.text,
+                                     timeout=REQ_TIMEOUT)
+        except (ConnectionError, Timeout) as e:
+            raise ExchangeError('bitfinex', '%s %s while sending to bitfinex %r' % (type(e), str(e), params))
+
     def bitfinex_request(self, endpoint, params=None):
         params = params or {}
         params['request'] = endpoint
-        response = None
-        while response is None:
-            try:
-                response = requests.post(url=BASE_URL + params['request'],
-                                         headers=self.bitfinex_encode(params),
-                                         timeout=REQ_TIMEOUT)
-                if "Nonce is too small." in response:
-                    response = None
-            except (ConnectionError, Timeout) as e:
-                raise ExchangeError('bitfinex', '%s %s while sending to bitfinex %r' % (type(e), str(e), params))
-        return response
+        return self.bitfinex_post(params, lambda: self.bitfinex_encode(params))
 
     def cancel_order(self, order_id):
         params = {'order_id': int(order_id)}
         try:
-            resp = self.bitfinex_request('/v1/order/cancel', params).json()
+            resp = transport.decode(self.bitfinex_request('/v1/order/cancel', params))
         except ValueError as e:
             raise ExchangeError('bitfinex', '%s %s while sending to bitfinex %r' % (type(e), str(e), params))
         if resp and 'id' in resp and resp['id'] == params['order_id']:
@@ -69,32 +127,11 @@ class Bitfinex(ExchangeABC):
         else:
             return False
 
-    def create_order(self, amount, price, otype, typ='exchange limit', bfxexch='all'):
+    def create_order(self, amount, price, otype, typ='exchange limit', bfxexch='all', pair='BTC/USD'):
         if BLOCK_ORDERS:
             return "order blocked"
-        if otype == 'bid':
-            otype = 'buy'
-        elif otype == 'ask':
-            otype = 'sell'
-        else:
-            raise Exception('unknown side %r' % otype)
-
-        params = {
-            'side': otype,
-            'symbol': 'btcusd',
-            'amount': "{:0.3f}".format(amount),
-            'price': "{:0.3f}".format(price),
-            'exchange': bfxexch,
-            'type': typ
-        }
-        try:
-            order = self.bitfinex_request('/v1/order/new', params).json()
-        except ValueError as e:
-            raise ExchangeError('bitfinex', '%s %s while sending to bitfinex %r' % (type(e), str(e), params))
-
-        if 'is_live' in order and order['is_live']:
-            return str(order['order_id'])
-        raise ExchangeError('bitfinex', 'unable to create order %r response was %r' % (params, order))
+        return self.prepare_order(otype, typ=typ, bfxexch=bfxexch,
+                                  pair=get_symbol(self.name, pair).pair).submit(amount, price)
 
     @classmethod
     def format_book_item(cls, item):
@@ -106,7 +143,7 @@ class Bitfinex(ExchangeABC):
 
     def get_balance(self, btype='total'):
         try:
-            data = self.bitfinex_request('/v1/balances').json()
+            data = transport.decode(self.bitfinex_request('/v1/balances'))
         except ValueError as e:
             raise ExchangeError('bitfinex', '%s %s while sending to bitfinex get_open_orders' % (type(e), str(e)))
         if 'message' in data:
@@ -126,7 +163,7 @@ class Bitfinex(ExchangeABC):
 
     def get_open_orders(self):
         try:
-            rawos = self.bitfinex_request('/v1/orders').json()
+            rawos = transport.decode(self.bitfinex_request('/v1/orders'))
         except ValueError as e:
             raise ExchangeError('bitfinex', '%s %s while sending to bitfinex get_open_orders' % (type(e), str(e)))
         orders = []
@@ -137,49 +174,99 @@ class Bitfinex(ExchangeABC):
         return orders
 
     @classmethod
-    def get_order_book(cls, pair='btcusd', **kwargs):
+    def book_request(cls, symbol, depth=None):
+        params = {'limit_bids': depth, 'limit_asks': depth} if depth is not None else {}
+        return '%s/v1/book/%s' % (BASE_URL, symbol.url), params, ()
+
+    @classmethod
+    def get_order_book(cls, pair='BTC/USD', depth=None, group=None, **kwargs):
+        url, params, path = cls.book_request(get_symbol(cls.name, pair), depth if group is None else None)
         try:
-            return requests.get('%s/v1/book/%s' % (BASE_URL, pair),
-                                timeout=REQ_TIMEOUT).json()
-        except ValueError as e:
+            book = transport.decode(transport.request('bitfinex', 'get', url, params=params, timeout=REQ_TIMEOUT))
+        except (ConnectionError, Timeout, ValueError) as e:
             raise ExchangeError('bitfinex', '%s %s while sending to bitfinex get_order_book' % (type(e), str(e)))
+        return cls.limit_book(book, depth, group)
 
     @classmethod
-    def get_ticker(cls, pair='btcusd'):
+    def get_ticker(cls, pair='BTC/USD'):
+        symbol = get_symbol(cls.name, pair)
         try:
-            rawtick = requests.get(BASE_URL + '/v1/pubticker/%s' % pair, timeout=REQ_TIMEOUT).json()
+            rawtick = transport.decode(transport.request('bitfinex', 'get', BASE_URL + '/v1/pubticker/%s' % symbol.url,
+                                                         timeout=REQ_TIMEOUT))
         except (ConnectionError, Timeout, ValueError) as e:
             raise ExchangeError('bitfinex', '%s %s while sending get_ticker to bitfinex' % (type(e), str(e)))
 
         return create_ticker(bid=rawtick['bid'], ask=rawtick['ask'], high=rawtick['high'], low=rawtick['low'],
                              volume=rawtick['volume'], last=rawtick['last_price'], timestamp=rawtick['timestamp'],
-                             currency='USD')
+                             currency=symbol.quote, base=symbol.base)
 
-    def get_transactions(self, limit=None):
-        params = {'symbol': 'BTCUSD'}
+    @classmethod
+    def get_public_trades(cls, pair='BTC/USD', since=None):
+        symbol = get_symbol(cls.name, pair)
+        params = {'limit_trades': PUBLIC_TRADES_PAGE}
+        if since is not None:
+            params['timestamp'] = int(since.timestamp)
         try:
-            return self.bitfinex_request('/v1/mytrades', params).json()
+            resp = transport.decode(transport.request('bitfinex', 'get', '%s/v1/trades/%s' % (BASE_URL, symbol.url),
+                                                      params=params, timeout=REQ_TIMEOUT))
+        except (ConnectionError, Timeout, ValueError) as e:
+            raise ExchangeError('bitfinex', '%s %s while sending get_public_trades' % (type(e), str(e)))
+        if not isinstance(resp, list):
+            raise ExchangeError('bitfinex', 'unable to get trades: %r' % resp)
+        # newest first
+        return [Trade(cls.name, str(t['tid']), 'bid' if t['type'] == 'buy' else 'ask', Money(t['price'], symbol.quote),
+                      Money(t['amount'], symbol.base), float(t['timestamp'])) for t in reversed(resp)]
+
+    def get_transactions(self, limit=None, pair='BTC/USD'):
+        params = {'symbol': get_symbol(self.name, pair).native.upper()}
+        try:
+            return transport.decode(self.bitfinex_request('/v1/mytrades', params))
         except ValueError as e:
             raise ExchangeError('bitfinex', '%s %s while sending to bitfinex get_transactions' % (type(e), str(e)))
 
+    def get_fills(self, since=None, pair='BTC/USD'):
+        symbol = get_symbol(self.name, pair)
+        params = {'symbol': symbol.native.upper(), 'limit_trades': FILL_PAGE_SIZE, 'reverse': 1,
+                  'timestamp': str(since.timestamp) if since is not None else '0'}
+        fills = []
+        while True:
+            try:
+                page = transport.decode(self.bitfinex_request('/v1/mytrades', dict(params)))
+            except ValueError as e:
+                raise ExchangeError('bitfinex', '%s %s while sending to bitfinex get_fills' % (type(e), str(e)))
+            if 'message' in page:
+                raise ExchangeError('bitfinex', page['message'])
+            for t in page:
+                side = 'bid' if t['type'] == 'Buy' else 'ask'
+                fills.append(Fill(self.name, str(t['tid']), str(t['order_id']), side,
+                                  Money(t['price'], symbol.quote), Money(t['amount'], symbol.base),
+                                  Money(abs(float(t['fee_amount'])), t['fee_currency'].upper()),
+                                  float(t['timestamp'])))
+            # the timestamp cursor is inclusive, so a full page is followed from its last timestamp
+            if len(page) < FILL_PAGE_SIZE or page[-1]['timestamp'] == params['timestamp']:
+                break
+            params['timestamp'] = page[-1]['timestamp']
+        return fills
+
     def get_active_positions(self):
         try:
-            return self.bitfinex_request('/v1/positions').json()
+            return transport.decode(self.bitfinex_request('/v1/positions'))
         except ValueError as e:
             raise ExchangeError('bitfinex', '%s %s while sending to bitfinex get_active_positions' % (type(e), str(e)))
 
     def get_order_status(self, order_id):
         params = {'order_id': int(order_id)}
         try:
-            return self.bitfinex_request('/v1/order/status', params).json()
+            return transport.decode(self.bitfinex_request('/v1/order/status', params))
         except ValueError as e:
             raise ExchangeError('bitfinex', '%s %s while sending to bitfinex get_order_status for %s' % (
                 type(e), str(e), str(order_id)))
 
-    def get_deposit_address(self):
+    def get_deposit_address(self, currency='BTC'):
+        self.check_deposit_currency(currency)
         try:
-            result = self.bitfinex_request('/v1/deposit/new', {'currency': 'BTC', 'method': 'bitcoin',
-                                                             'wallet_name': 'exchange'}).json()
+            result = transport.decode(self.bitfinex_request('/v1/deposit/new', {'currency': 'BTC', 'method': 'bitcoin',
+                                                                              'wallet_name': 'exchange'}))
             if result['result'] == 'success' and 'address' in result:
                 return str(result['address'])
             else:
@@ -187,14 +274,26 @@ class Bitfinex(ExchangeABC):
         except ValueError as e:
             raise ExchangeError('bitfinex', '%s %s while sending get_deposit_address' % (type(e), str(e)))
 
+    def get_deposit_addresses(self, new=False, currency='BTC'):
+        self.check_deposit_currency(currency)
+        if not new:
+            return [DepositAddress(self.name, self.get_deposit_address(currency), None)]
+        params = {'currency': 'BTC', 'method': 'bitcoin', 'wallet_name': 'exchange', 'renew': 1}
+        try:
+            result = transport.decode(self.bitfinex_request('/v1/deposit/new', params))
+        except ValueError as e:
+            raise ExchangeError('bitfinex', '%s %s while sending get_deposit_addresses' % (type(e), str(e)))
+        if result.get('result') != 'success' or 'address' not in result:
+            raise ExchangeError('bitfinex', result)
+        return [DepositAddress(self.name, str(result['address']), None)]
+
     def account_info(self):
         try:
-            data = self.bitfinex_request('/v1/account_infos').json()
+            data = transport.decode(self.bitfinex_request('/v1/account_infos'))
         except ValueError as e:
             raise ExchangeError('bitfinex', '%s %s while sending to bitfinex get_open_orders' % (type(e), str(e)))
         return data
 
 
 eclass = Bitfinex
-exchange = Bitfinex(exchange_config['bitfinex']['api_creds']['key'],
-                    exchange_config['bitfinex']['api_creds']['secret'])
+exchange = DefaultClient('bitfinex')
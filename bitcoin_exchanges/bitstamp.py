@@ -1,29 +1,78 @@
+import calendar
 import hashlib
-import hmac
-import json
 import time
 import requests
 from requests.exceptions import Timeout, ConnectionError
 from moneyed.classes import Money, MultiMoney
 
-from bitcoin_exchanges.exchange_util import ExchangeABC, ExchangeError, exchange_config, create_ticker, BLOCK_ORDERS, \
-    MyOrder
+from bitcoin_exchanges.exchange_util import ExchangeABC, DefaultClient, ExchangeError, exchange_config, create_ticker, \
+    BLOCK_ORDERS, MyOrder, Fill, HmacSigner, OrderTemplate, Trade
+from bitcoin_exchanges import transport
+from bitcoin_exchanges.order_rules import get_order_rules
+from bitcoin_exchanges.symbols import get_symbol
 
 
 baseUrl = "https://www.bitstamp.net/api/"
+INVALID_NONCE = '{"error": "Invalid nonce"}'
 REQ_TIMEOUT = 10  # seconds
+FILL_PAGE_SIZE = 1000  # bitstamp's maximum
+
+
+class BitstampOrderTemplate(OrderTemplate):
+    headers = {'Content-type': 'application/x-www-form-urlencoded',
+               'User-Agent': 'newcpt'}
+
+    def __init__(self, exchange, otype):
+        super(BitstampOrderTemplate, self).__init__(exchange, otype)
+        if otype == 'ask':
+            otype = 'sell'
+        elif otype == 'bid':
+            otype = 'buy'
+        if otype != 'buy' and otype != 'sell':
+            raise ExchangeError(exchange='bitstamp',
+                                message="Only 'buy' and 'sell' are acceptable order types.")
+        self.url = baseUrl + otype + '/'
+        self.rules = get_order_rules('bitstamp')
+
+    def submit(self, amount, price):
+        amount, price = self.rules.format(amount, price, self.otype)
+        if BLOCK_ORDERS:
+            return "order blocked"
+        data = {'amount': amount, 'price': price}
+        response = transport.request('bitstamp', 'post', self.url, private=True, idempotent=False,
+                                     account_id=self.exchange.account_id,
+                                     sign=lambda: {'data': self.exchange.bitstamp_encode(dict(data))},
+                                     retry_if=lambda r: r.content == INVALID_NONCE,
+                                     headers=self.headers, verify=False, timeout=REQ_TIMEOUT).content
+        if 'error' in response:
+            raise ExchangeError('bitstamp', message=response)
+        response = transport.decode(response)
+        if 'id' in response:
+            return str(response['id'])
+        raise ExchangeError('bitstamp', 'unable to create order %r' % data)
 
 
 class Bitstamp(ExchangeABC):
     name = 'bitstamp'
+    hosts = ('www.bitstamp.net',)
+    order_template = BitstampOrderTemplate
+    credential_fields = ('key', 'secret', 'clientid')
 
     def __init__(self, key, secret, clientid):
         super(Bitstamp, self).__init__()
         self.key = key
         self.secret = secret
         self.clientid = clientid
+        self.signer = HmacSigner(secret, hashlib.sha256)
+
+    def bitstamp_encode(self, params):
+        """Add the key, nonce and signature to a private request's params."""
+        params['key'] = self.key
+        params['nonce'] = self.time_nonce(100000)
+        params['signature'] = self.signer.hexdigest(str(params['nonce']), self.clientid, self.key).upper()
+        return params
 
-    def submit_request(self, path, params=None, private=False, timedelta=86400, retry=0):
+    def submit_request(self, path, params=None, private=False, timedelta=86400):
         """
         Send request to BitStamp.
 
@@ -38,25 +87,20 @@ class Bitstamp(ExchangeABC):
         if timedelta != 86400:
             url += '?timedelta=' + str(timedelta)
 
-        if private:
-            params['key'] = self.key
-            params['nonce'] = int(time.time() * 100000)
-            mess = str(params['nonce']) + self.clientid + self.key
-            params['signature'] = hmac.new(self.secret, msg=mess,
-                                           digestmod=hashlib.sha256).hexdigest().upper()
-
         headers = {'Content-type': 'application/x-www-form-urlencoded',
                    'User-Agent': 'newcpt'}
 
         if private:
-            request = requests.post(url, data=params, headers=headers, verify=False,
-                                    timeout=REQ_TIMEOUT)
+            request = transport.request('bitstamp', 'post', url, private=True, account_id=self.account_id,
+                                        sign=lambda: {'data': self.bitstamp_encode(params)},
+                                        retry_if=lambda r: r.content == INVALID_NONCE,
+                                        headers=headers, verify=False, timeout=REQ_TIMEOUT)
         else:
-            request = requests.post(url, headers=headers, verify=False,
-                                    timeout=REQ_TIMEOUT)
+            request = transport.request('bitstamp', 'post', url, headers=headers, verify=False,
+                                        timeout=REQ_TIMEOUT)
         response = None
         try:
-            response = request.text
+            response = request.content
         except request.exceptions.HTTPError as e:
             print e
             if request.status:
@@ -64,12 +108,7 @@ class Bitstamp(ExchangeABC):
             if response:
                 print response
             return None
-        if response == '{"error": "Invalid nonce"}' and retry < 10:
-            tosleep = round(1 - float(10 - retry) / 10, 2)
-            time.sleep(tosleep)
-            self.submit_request(path, params=params, private=private,
-                                timedelta=timedelta, retry=retry + 1)
-        elif 'error' in response:
+        if 'error' in response:
             raise ExchangeError('bitstamp', message=response)
         return response
 
@@ -80,8 +119,8 @@ class Bitstamp(ExchangeABC):
                    'Accept': 'application/json',
                    'User-Agent': 'bitcoin_exchanges'}
         try:
-            req = requests.get(url, headers=headers, timeout=REQ_TIMEOUT)
-            response = req.text
+            req = transport.request('bitstamp', 'get', url, headers=headers, timeout=REQ_TIMEOUT)
+            response = req.content
         except requests.exceptions.HTTPError as e:
             print e
             return None
@@ -91,7 +130,7 @@ class Bitstamp(ExchangeABC):
         """
         Returns 'true' if order has been found and canceled.
         """
-        if json.loads(self.submit_request('cancel_order', {'id': str(oid)}, True)):
+        if transport.decode(self.submit_request('cancel_order', {'id': str(oid)}, True)):
             return True
         return False
 
@@ -108,26 +147,14 @@ class Bitstamp(ExchangeABC):
     def create_order(self, amount, price, otype):
         if BLOCK_ORDERS:
             return "order blocked"
-        if otype == 'ask':
-            otype = 'sell'
-        elif otype == 'bid':
-            otype = 'buy'
-        if otype != 'buy' and otype != 'sell':
-            raise ExchangeError(exchange='bitstamp',
-                                message="Only 'buy' and 'sell' are acceptable order types.")
-        data = {'amount': round(float(amount), 2),
-                'price': round(price, 2)}
-        response = json.loads(self.submit_request(otype, data, True))
-        if 'id' in response:
-            return str(response['id'])
-        raise ExchangeError('bitstamp', 'unable to create order %r' % data)
+        return self.prepare_order(otype).submit(amount, price)
 
     def get_balance(self, btype='total'):
         """
         :param str btype: The balance types to include
         """
         try:
-            stampbal = json.loads(self.submit_request('balance', {}, True))
+            stampbal = transport.decode(self.submit_request('balance', {}, True))
             if 'btc_balance' not in stampbal or 'usd_balance' not in stampbal:
                 raise ExchangeError(exchange='bitstamp',
                                     message="Bitstamp balance information unavailable")
@@ -148,7 +175,7 @@ class Bitstamp(ExchangeABC):
 
     def get_open_orders(self):
         rawos = self.submit_request('open_orders', {}, True)
-        jos = json.loads(rawos)
+        jos = transport.decode(rawos)
         orders = []
         for o in jos:
             side = 'ask' if o['type'] == 1 else 'bid'
@@ -156,23 +183,29 @@ class Bitstamp(ExchangeABC):
         return orders
 
     @classmethod
-    def get_order_book(cls, pair='ignored'):
+    def book_request(cls, symbol, depth=None):
+        return baseUrl + 'order_book/', {}, ()
+
+    @classmethod
+    def get_order_book(cls, pair='BTC/USD', depth=None, group=None):
+        get_symbol(cls.name, pair)  # bitstamp only trades one pair, but do not silently ignore another
         opath = 'order_book'
         try:
             jresp = cls.api_get(opath)
-            response = json.loads(jresp)
+            response = transport.decode(jresp)
         except (TypeError, ValueError):
             return None
         if response and 'bids' in response:
-            return response
+            return cls.limit_book(response, depth, group)
         elif response and 'error' in response:
             raise ExchangeError(exchange='bitstamp', message=response['error'])
         return None
 
     @classmethod
-    def get_ticker(cls, pair='ignored'):
+    def get_ticker(cls, pair='BTC/USD'):
+        get_symbol(cls.name, pair)
         try:
-            rawtick = json.loads(cls.api_get('ticker'))
+            rawtick = transport.decode(cls.api_get('ticker'))
         except (ConnectionError, Timeout, ValueError) as e:
             raise ExchangeError('bitfinex', '%s %s while sending get_ticker to bitfinex' % (type(e), str(e)))
 
@@ -180,6 +213,18 @@ class Bitstamp(ExchangeABC):
                              volume=rawtick['volume'], last=rawtick['last'], timestamp=rawtick['timestamp'],
                              currency='USD')
 
+    @classmethod
+    def get_public_trades(cls, pair='BTC/USD', since=None):
+        symbol = get_symbol(cls.name, pair)
+        try:
+            resp = transport.decode(cls.api_get('transactions'))  # the last hour, newest first
+        except (TypeError, ValueError) as e:
+            raise ExchangeError('bitstamp', '%s %s while sending get_public_trades' % (type(e), str(e)))
+        last_id = int(since.trade_id) if since is not None else 0
+        return [Trade(cls.name, str(t['tid']), 'bid' if int(t['type']) == 0 else 'ask', Money(t['price'], symbol.quote),
+                      Money(t['amount'], symbol.base), float(t['date']))
+                for t in reversed(resp) if int(t['tid']) >= last_id]
+
     def get_transactions(self, timedelta):
         """
         Returns descending JSON list of transactions.
@@ -192,13 +237,37 @@ class Bitstamp(ExchangeABC):
             btc - BTC amount
             fee - transaction fee
         """
-        return json.loads(self.submit_request('user_transactions', {}, True, timedelta))
+        return transport.decode(self.submit_request('user_transactions', {}, True, timedelta))
+
+    def get_fills(self, since=None):
+        last_id = int(since.fill_id) if since is not None else 0
+        fills = []
+        offset = 0
+        while True:
+            page = transport.decode(self.submit_request('user_transactions', {'offset': offset, 'sort': 'desc',
+                                                                              'limit': FILL_PAGE_SIZE}, True))
+            for t in page:
+                if int(t['id']) <= last_id:
+                    break
+                if int(t['type']) != 2:  # market trade
+                    continue
+                side = 'bid' if float(t['btc']) > 0 else 'ask'
+                timestamp = calendar.timegm(time.strptime(t['datetime'][:19], '%Y-%m-%d %H:%M:%S'))
+                fills.append(Fill(self.name, str(t['id']), str(t['order_id']), side,
+                                  Money(t['btc_usd'], self.fiatcurrency), Money(abs(float(t['btc']))),
+                                  Money(t['fee'], self.fiatcurrency), float(timestamp)))
+            else:
+                if len(page) == FILL_PAGE_SIZE:
+                    offset += FILL_PAGE_SIZE
+                    continue
+            break
+        fills.reverse()
+        return fills
 
-    def get_deposit_address(self):
-        return str(json.loads(self.submit_request('bitcoin_deposit_address', {}, True)))
+    def get_deposit_address(self, currency='BTC'):
+        self.check_deposit_currency(currency)
+        return str(transport.decode(self.submit_request('bitcoin_deposit_address', {}, True)))
 
 
 eclass = Bitstamp
-exchange = Bitstamp(exchange_config['bitstamp']['api_creds']['key'],
-                    exchange_config['bitstamp']['api_creds']['secret'],
-                    exchange_config['bitstamp']['api_creds']['clientid'])
+exchange = DefaultClient('bitstamp')
@@ -0,0 +1,191 @@
+"""
+Turn polled order book snapshots into level deltas.
+
+Consecutive snapshots of a book mostly share the same levels, in the same order. BookDiffer walks the old and new
+sides together in a sorted merge, comparing the raw items as the exchange sent them, so only the levels which
+changed are converted to Decimal and passed on. A DeltaPublisher polls the books and hands subscribers just the
+deltas.
+"""
+from collections import namedtuple
+from decimal import Decimal
+import threading
+
+from bitcoin_exchanges.exchange_util import ExchangeError, fan_out, get_live_exchange_workers
+from bitcoin_exchanges.symbols import get_symbol
+
+POLL_INTERVAL = 1  # seconds
+POLL_DEPTH = 50  # levels polled per side
+
+# action is 'add', 'update' or 'remove'. amount is the level's new total, or 0 for a removal.
+BookDelta = namedtuple('BookDelta', ['exchange', 'pair', 'side', 'action', 'price', 'amount'])
+
+
+def raw_level(item):
+    """
+    :return: the raw price and amount of a book item, in either the [price, amount, ...] or the
+             bitfinex {'price': ..., 'amount': ...} form
+    :rtype: tuple
+    """
+    if isinstance(item, dict):
+        return item['price'], item['amount']
+    return item[0], item[1]
+
+
+def _decimal(value):
+    return value if isinstance(value, Decimal) else Decimal(str(value))
+
+
+def _ascending(items):
+    """Whether a side is listed lowest price first. Exchanges differ, e.g. okcoin lists asks from the top."""
+    if len(items) < 2:
+        return None
+    return _decimal(raw_level(items[0])[0]) < _decimal(raw_level(items[-1])[0])
+
+
+def diff_side(old, new, ascending):
+    """
+    Compare two listings of one side of a book, both sorted in the same direction.
+
+    :param list old: the previous raw items
+    :param list new: the current raw items
+    :param bool ascending: whether both are listed lowest price first
+    :return: (action, price, amount) for each changed level, in book order
+    :rtype: list
+    """
+    changes = []
+    i = j = 0
+    while i < len(old) and j < len(new):
+        old_price, old_amount = raw_level(old[i])
+        new_price, new_amount = raw_level(new[j])
+        if old_price != new_price:
+            # the raw forms differ, so compare them as numbers
+            old_price, new_price = _decimal(old_price), _decimal(new_price)
+        if old_price == new_price:
+            if old_amount != new_amount and _decimal(old_amount) != _decimal(new_amount):
+                changes.append(('update', _decimal(new_price), _decimal(new_amount)))
+            i += 1
+            j += 1
+        elif (old_price < new_price) == ascending:
+            changes.append(('remove', _decimal(old_price), Decimal(0)))
+            i += 1
+        else:
+            changes.append(('add', _decimal(new_price), _decimal(new_amount)))
+            j += 1
+    for item in old[i:]:
+        changes.append(('remove', _decimal(raw_level(item)[0]), Decimal(0)))
+    for item in new[j:]:
+        price, amount = raw_level(item)
+        changes.append(('add', _decimal(price), _decimal(amount)))
+    return changes
+
+
+class BookDiffer(object):
+    """Keep the last snapshot of each book, and diff each new snapshot against it."""
+
+    def __init__(self):
+        self.books = {}
+        self._lock = threading.Lock()
+
+    def diff(self, exchange, pair, book):
+        """
+        :param dict book: a raw order book, with 'bids' and 'asks', as returned by get_order_book
+        :return: BookDeltas from the last snapshot of this book. The first snapshot is all adds.
+        :rtype: list
+        """
+        with self._lock:
+            last = self.books.get((exchange, pair)) or {}
+            self.books[(exchange, pair)] = book
+        deltas = []
+        for side, default_ascending in (('bids', False), ('asks', True)):
+            old, new = last.get(side) or [], book.get(side) or []
+            ascending = _ascending(new)
+            if ascending is None:
+                ascending = _ascending(old)
+            if ascending is None:
+                ascending = default_ascending
+            if _ascending(old) not in (None, ascending):
+                old = old[::-1]
+            for action, price, amount in diff_side(old, new, ascending):
+                deltas.append(BookDelta(exchange, pair, side[:-1], action, price, amount))
+        return deltas
+
+    def reset(self, exchange=None, pair=None):
+        """Forget the last snapshots, of one book or all of them, so the next diff is a full snapshot."""
+        with self._lock:
+            if exchange is None:
+                self.books.clear()
+            else:
+                self.books.pop((exchange, pair), None)
+
+
+class DeltaPublisher(object):
+    """
+    Poll the order books of the live exchanges, and send subscribers only the levels which changed.
+    Each subscriber is called with the exchange name, the pair and a list of BookDeltas.
+    """
+
+    def __init__(self, exchanges=None, pairs=None, depth=POLL_DEPTH, interval=POLL_INTERVAL):
+        """
+        :param dict exchanges: exchange classes by name. Defaults to all of the live exchanges.
+        :param dict pairs: the pair to poll on each exchange. Defaults to each exchange's main pair.
+        :param int depth: the levels to poll on each side
+        :param int interval: seconds between polls
+        """
+        if exchanges is None:
+            exchanges = dict((name, mod.eclass) for name, mod in get_live_exchange_workers().iteritems())
+        self.exchanges = exchanges
+        self.pairs = dict((name, get_symbol(name, (pairs or {}).get(name)).pair) for name in exchanges)
+        self.depth = depth
+        self.interval = interval
+        self.differ = BookDiffer()
+        self.subscribers = []
+        self.errors = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def publish(self, exchange, pair, book):
+        """
+        Diff a snapshot and send any changes to the subscribers.
+
+        :return: the deltas
+        :rtype: list
+        """
+        deltas = self.differ.diff(exchange, pair, book)
+        if deltas:
+            for callback in self.subscribers:
+                callback(exchange, pair, deltas)
+        return deltas
+
+    def poll(self):
+        """Poll every book once, concurrently. Exchanges that fail keep their errors in self.errors."""
+        def poll_one(name):
+            try:
+                book = self.exchanges[name].get_order_book(self.pairs[name], depth=self.depth)
+            except ExchangeError as e:
+                self.errors[name] = e
+                return
+            if book:
+                self.errors.pop(name, None)
+                self.publish(name, self.pairs[name], book)
+
+        fan_out(poll_one, list(self.exchanges))
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='book-deltas')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        self.poll()
+        while not self._stop.wait(self.interval):
+            self.poll()
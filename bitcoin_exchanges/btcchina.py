@@ -1,16 +1,24 @@
 from moneyed.classes import Money, MultiMoney
-from exchange_util import exchange_config, ExchangeABC, ExchangeError, create_ticker, BLOCK_ORDERS, MyOrder
+from exchange_util import exchange_config, ExchangeABC, DefaultClient, LazyClient, ExchangeError, create_ticker, \
+    BLOCK_ORDERS, MyOrder, Fill
+from bitcoin_exchanges.order_rules import format_order
+from bitcoin_exchanges.symbols import get_symbol
 
 from old import btcchina
 
 fee = 0
-btcny = btcchina.BTCChina(access=exchange_config['btcchina']['api_creds']['key'],
-                          secret=exchange_config['btcchina']['api_creds']['secret'])
+FILL_PAGE_SIZE = 1000
+btcny = LazyClient(lambda: btcchina.BTCChina(access=exchange_config['btcchina']['api_creds']['key'],
+                                             secret=exchange_config['btcchina']['api_creds']['secret']))
 
 
 class BTCChina(ExchangeABC):
     name = 'btcchina'
     fiatcurrency = 'CNY'
+    hosts = ('api.btcchina.com', 'data.btcchina.com')
+    credential_fields = None  # the shared btcny client holds the credentials
+    withdrawal_currencies = ('BTC', 'LTC')
+    deposit_currencies = ('BTC', 'LTC')
 
     def __init__(self):
         super(BTCChina, self).__init__()
@@ -26,25 +34,15 @@ class BTCChina(ExchangeABC):
         return True
 
     def create_order(self, amount, price=0, otype='bid'):
+        side = 'ask' if otype in ('ask', 'sell') else 'bid'
+        # the strings are sent as they are, as a float could be signed in exponent form
+        amount, price = format_order(self.name, amount, price, side)
         if BLOCK_ORDERS:
             return "order blocked"
-        if isinstance(amount, Money):
-            famount = round(float(amount.amount), 2)
-        else:
-            famount = float(amount)
-        if int(famount) == famount:
-            famount = float(famount) - 0.0001
-
-        if isinstance(price, Money):
-            fprice = round(float(price.amount), 2)
-        else:
-            fprice = float(price)
-        if int(fprice) == fprice:
-            fprice = float(fprice) - 0.01
         if otype in ('ask', 'sell'):
-            order = btcny.sell(fprice, famount)
+            order = btcny.sell(price, amount)
         else:
-            order = btcny.buy(fprice, famount)
+            order = btcny.buy(price, amount)
         if order and isinstance(order, bool):
             return "stupid btcchina does not return ids"
         else:
@@ -85,8 +83,10 @@ class BTCChina(ExchangeABC):
             return total, available
 
     @classmethod
-    def get_order_book(cls, pair='ignored'):
-        return btcny.get_market_depth()
+    def get_order_book(cls, pair='BTC/CNY', depth=None, group=None):
+        limit = depth if group is None else None
+        book = btcny.get_market_depth(market=get_symbol(cls.name, pair).url, limit=limit)
+        return cls.limit_book(book, depth, group)
 
     def get_open_orders(self):
         data = btcny.get_orders()
@@ -99,26 +99,64 @@ class BTCChina(ExchangeABC):
         return orders
 
     @classmethod
-    def get_ticker(cls, **kwargs):
-        rawticker = btcny.get_ticker()
+    def get_ticker(cls, pair='BTC/CNY', **kwargs):
+        symbol = get_symbol(cls.name, pair)
+        rawticker = btcny.get_ticker(market=symbol.url)
         if 'ticker' in rawticker:
             ticker = rawticker['ticker']
             return create_ticker(bid=ticker['buy'], ask=ticker['sell'], high=ticker['high'], low=ticker['low'],
                                  volume=ticker['vol'], last=ticker['last'], timestamp=ticker['date'],
-                                 currency='CNY')
+                                 currency=symbol.quote, base=symbol.base)
         raise ExchangeError('btcchina', 'unable to get ticker')
 
     def get_transactions(self, limit=None):
         return btcny.get_transactions(limit=limit)
 
+    def get_fills(self, since=None):
+        since_id = int(since.fill_id) if since is not None else 0
+        fills = []
+        while True:
+            page = btcny.get_transactions(limit=FILL_PAGE_SIZE, ttype='all', since=since_id + 1, sincetype='id')
+            transactions = page['transaction'] if page and 'transaction' in page else []
+            for t in transactions:
+                if t['type'] not in ('buybtc', 'sellbtc'):
+                    continue
+                side = 'bid' if t['type'] == 'buybtc' else 'ask'
+                amount = abs(float(t['btc_amount']))
+                price = abs(float(t['cny_amount'])) / amount if amount else 0
+                fills.append(Fill(self.name, str(t['id']), None, side, Money(price, self.fiatcurrency),
+                                  Money(amount), Money(0, self.fiatcurrency), float(t['date'])))
+            if len(transactions) < FILL_PAGE_SIZE:
+                break
+            since_id = max(int(t['id']) for t in transactions)
+        fills.sort(key=lambda f: int(f.fill_id))
+        return fills
+
     @classmethod
     def get_usd_ticker(cls):
         return btcny.getUSDTicker()
 
-    def get_deposit_address(self):
+    def get_deposit_address(self, currency='BTC'):
+        self.check_deposit_currency(currency)
         ainfo = self.account_info()
-        return str(ainfo['profile']['btc_deposit_address'])
+        return str(ainfo['profile']['%s_deposit_address' % currency.lower()])
+
+    def withdraw(self, amount, address):
+        """
+        BTCChina only withdraws to the address registered with the account, which must be set as
+        'withdrawal_address' in exchange_config.
+        """
+        currency = str(amount.currency)
+        if currency not in self.withdrawal_currencies:
+            raise ExchangeError('btcchina', 'withdrawals of %s are not supported' % currency)
+        registered = exchange_config['btcchina'].get('withdrawal_address')
+        if address != registered:
+            raise ExchangeError('btcchina', 'can only withdraw to the registered address %s, not %s' % (registered,
+                                                                                                      address))
+        if BLOCK_ORDERS:
+            return "withdrawal blocked"
+        return btcny.request_withdrawal(currency, str(amount.amount))
 
 
 eclass = BTCChina
-exchange = BTCChina()
+exchange = DefaultClient('btcchina')
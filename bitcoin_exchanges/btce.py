@@ -1,41 +1,94 @@
 import hashlib
-import hmac
-import json
 import time
 from decimal import Decimal
-import requests
 import urllib
 from requests.exceptions import Timeout, ConnectionError
 from moneyed.classes import Money, MultiMoney
-from bitcoin_exchanges.exchange_util import ExchangeError, ExchangeABC, create_ticker, exchange_config, nonceDB,\
-    BLOCK_ORDERS, MyOrder
+from bitcoin_exchanges.exchange_util import ExchangeError, ExchangeABC, DefaultClient, create_ticker, exchange_config, \
+    nonceDB, BLOCK_ORDERS, MyOrder, Fill, HmacSigner, OrderTemplate, Trade
+from bitcoin_exchanges import transport
+from bitcoin_exchanges.order_rules import get_order_rules
+from bitcoin_exchanges.symbols import get_symbol
 
 
-publicUrl = 'https://btc-e.com/api/2/btc_usd/'
+publicUrl = 'https://btc-e.com/api/2/%s/'
+publicUrlV3 = 'https://btc-e.com/api/3/%s/%s'  # method, then hyphen separated pairs
 tradeUrl = 'https://btc-e.com/tapi/'
 REQ_TIMEOUT = 10  # seconds
+FILL_PAGE_SIZE = 1000
+PUBLIC_TRADES_PAGE = 2000  # the most the v3 api returns
+
+
+class BTCEOrderTemplate(OrderTemplate):
+    def __init__(self, exchange, otype, pair='BTC/USD'):
+        super(BTCEOrderTemplate, self).__init__(exchange, otype, pair=pair)
+        if otype == 'bid':
+            self.side = 'buy'
+        elif otype == 'ask':
+            self.side = 'sell'
+        else:
+            raise ExchangeError(exchange='btce',
+                                message="Unknown order type %r" % otype)
+        self.data_head = urllib.urlencode((('method', 'Trade'), ('pair', get_symbol('btce', pair).native),
+                                           ('type', self.side)))
+        self.headers = {"Content-type": "application/x-www-form-urlencoded",
+                        "Key": exchange.key}
+        self.rules = get_order_rules('btce', pair)
+
+    def submit(self, amount, price):
+        amount, price = self.rules.format(amount, price, self.otype)
+        if BLOCK_ORDERS:
+            return "order blocked"
+        params = {'rate': price, 'amount': amount}
+
+        def sign():
+            params['nonce'] = self.exchange.next_nonce()
+            post_string = '%s&rate=%s&amount=%s&nonce=%d' % (self.data_head, params['rate'], params['amount'],
+                                                             params['nonce'])
+            return post_string, dict(self.headers, Sign=self.exchange.signer.hexdigest(post_string))
+
+        resp = self.exchange._handle_response(self.exchange.btce_post(sign, params, idempotent=False))
+        if 'order_id' in resp:
+            return str(resp['order_id'])
+        raise ExchangeError('btce', 'unable to create %s %r at %r order' % (self.side, amount, price))
 
 
 class BTCE(ExchangeABC):
     name = 'btce'
     fiatcurrency = 'USD'
+    hosts = ('btc-e.com',)
+    order_template = BTCEOrderTemplate
 
     def __init__(self, key, secret):
         super(BTCE, self).__init__()
+        self.nonceDB = nonceDB  # the account's sequence is started by next_nonce, once get_client has set account
+        self.key = key
+        self.secret = secret
+        self.signer = HmacSigner(secret, hashlib.sha512)
+
+    def initial_nonce(self):
         # btc-e nonce is capped at 4294967294
         # This only leaves room for seconds, on the traditional epoch timescale.
         # To get around this, we use tenths of a second, but drop the first digit.
         # This would break on Mon, 20 Apr 2015 02:25:29 GMT, without further adjustment,
         # so we subtract 3000000000. This gives us until Mon, 21 Oct 2024 07:45:29 GMT
-        self.nonceDB = nonceDB
-        self.create_nonce(int(time.time() * 10) - 13000000000)
         # XXX Or we can start at nonce 1 and increment from there?
         # If we do that this year (2014) then we should be fine until
         # 2150, unless btc-e changes its API before that :)
-        self.key = key
-        self.secret = secret
+        return int(time.time() * 10) - 13000000000
 
-    def send_btce(self, params=None, sign=True, retry=0):
+    def btce_encode(self, params):
+        """
+        :return: the urlencoded request body and its headers
+        """
+        params['nonce'] = self.next_nonce()
+        post_string = urllib.urlencode(params)
+        headers = {"Content-type": "application/x-www-form-urlencoded",
+                   "Key": self.key,
+                   "Sign": self.signer.hexdigest(post_string)}
+        return post_string, headers
+
+    def send_btce(self, params=None, sign=True):
         """
         Send request to BTCE.
 
@@ -46,42 +99,42 @@ class BTCE(ExchangeABC):
         """
         if not params:
             params = {}
-        url = tradeUrl
-
-        params['nonce'] = self.next_nonce()
-        post_string = urllib.urlencode(params)
+        return self.btce_post(lambda: self.btce_encode(params), params)
 
-        # Hash the params string to produce the Sign header value
-        hash_parm = hmac.new(self.secret, digestmod=hashlib.sha512)
-        hash_parm.update(post_string)
-        headers = {"Content-type": "application/x-www-form-urlencoded",
-                   "Key": self.key,
-                   "Sign": hash_parm.hexdigest()}
+    def btce_post(self, sign, params, idempotent=True):
+        """
+        :param sign: returns a freshly signed request body and its headers, called again for each retry
+        :param dict params: the request params, for error messages
+        :param bool idempotent: False if the request is not safe to repeat, like an order
+        """
+        def sign_kwargs():
+            post_string, headers = sign()
+            return {'data': post_string, 'headers': headers}
 
         try:
-            response = requests.post(url=url, data=params, headers=headers, timeout=REQ_TIMEOUT).text
-            if "invalid nonce parameter" in response and retry < 3:
-                return self.send_btce(params=params, sign=sign, retry=retry + 1)
+            return transport.request('btce', 'post', tradeUrl, private=True, idempotent=idempotent,
+                                     account_id=self.account_id,
+                                     sign=sign_kwargs, retry_if=lambda r: "invalid nonce parameter" in r.content,
+                                     timeout=REQ_TIMEOUT).content
         except (ConnectionError, Timeout) as e:
             raise ExchangeError('btce', '%s %s while sending to btce %r' % (type(e), str(e), params))
-        return response
 
     @classmethod
-    def papi(cls, method):
+    def papi(cls, method, pair='BTC/USD'):
         """
         BTC-E public api interface
         """
-        url = publicUrl + method + '/'
+        url = publicUrl % get_symbol(cls.name, pair).url + method + '/'
         headers = {'Content-type': 'application/x-www-form-urlencoded'}
         try:
-            response = requests.get(url, headers=headers, timeout=REQ_TIMEOUT)
+            response = transport.request('btce', 'get', url, headers=headers, timeout=REQ_TIMEOUT)
         except (ConnectionError, Timeout) as e:
             raise ExchangeError('btce', '%s %s while sending %r to %s' % (type(e), e, method, url))
-        return response.text
+        return response.content
 
     def _handle_response(self, resp):
         try:
-            response = json.loads(resp)
+            response = transport.decode(resp)
         except (TypeError, ValueError):
             raise ExchangeError(exchange='btce',
                                 message="response was not valid json: %s" % str(resp))
@@ -120,7 +173,7 @@ class BTCE(ExchangeABC):
                 success = False
         return success
 
-    def create_order(self, amount, price, otype='buy'):
+    def create_order(self, amount, price, otype='buy', pair='BTC/USD'):
         """
         It returns the transactions history.
             parameter     description                                   it takes up the values
@@ -131,20 +184,7 @@ class BTCE(ExchangeABC):
         """
         if BLOCK_ORDERS:
             return "order blocked"
-        if otype == 'bid':
-            otype = 'buy'
-        elif otype == 'ask':
-            otype = 'sell'
-        else:
-            raise ExchangeError(exchange='btce',
-                                message="Unknown order type %r" % otype)
-        params = {"method": "Trade", 'pair': 'btc_usd', 'type': otype,
-                  'rate': float(price),
-                  'amount': round(float(amount), 2)}
-        resp = self._handle_response(self.send_btce(params))
-        if 'order_id' in resp:
-            return str(resp['order_id'])
-        raise ExchangeError('btce', 'unable to create %s %r at %r order' % (otype, amount, price))
+        return self.prepare_order(otype, pair=get_symbol(self.name, pair).pair).submit(amount, price)
 
     def get_balance(self, btype='total'):
         available = self.get_total_balance()
@@ -182,9 +222,45 @@ class BTCE(ExchangeABC):
         return bal
 
     @classmethod
-    def get_order_book(cls, pair='ignored'):
-        response = cls.papi('depth')
-        return json.loads(response)
+    def book_request(cls, symbol, depth=None):
+        # the v3 api, which can limit the depth, keys the book by pair
+        return publicUrlV3 % ('depth', symbol.url), {'limit': depth} if depth is not None else {}, (symbol.url,)
+
+    @classmethod
+    def get_order_book(cls, pair='BTC/USD', depth=None, group=None):
+        if depth is None or group is not None:
+            try:
+                book = transport.decode(cls.papi('depth', pair))
+            except ValueError as e:
+                raise ExchangeError('btce', '%s %s while getting the depth' % (type(e), e))
+            return cls.limit_book(book, depth, group)
+        url, params, path = cls.book_request(get_symbol(cls.name, pair), depth)
+        try:
+            response = transport.decode(transport.request('btce', 'get', url, params=params, timeout=REQ_TIMEOUT))
+        except (ConnectionError, Timeout, ValueError) as e:
+            raise ExchangeError('btce', '%s %s while sending to %s' % (type(e), e, url))
+        if 'error' in response:
+            raise ExchangeError('btce', 'unable to get order book from %s: %r' % (url, response['error']))
+        for key in path:
+            response = response[key]
+        return response
+
+    @classmethod
+    def get_public_trades(cls, pair='BTC/USD', since=None):
+        symbol = get_symbol(cls.name, pair)
+        url = publicUrlV3 % ('trades', symbol.url)
+        try:
+            resp = transport.decode(transport.request('btce', 'get', url, params={'limit': PUBLIC_TRADES_PAGE},
+                                                      timeout=REQ_TIMEOUT))
+        except (ConnectionError, Timeout, ValueError) as e:
+            raise ExchangeError('btce', '%s %s while sending to %s' % (type(e), e, url))
+        if 'error' in resp:
+            raise ExchangeError('btce', 'unable to get trades from %s: %r' % (url, resp['error']))
+        last_id = int(since.trade_id) if since is not None else 0
+        # newest first
+        return [Trade(cls.name, str(t['tid']), t['type'], Money(t['price'], symbol.quote),
+                      Money(t['amount'], symbol.base), float(t['timestamp']))
+                for t in reversed(resp[symbol.url]) if int(t['tid']) >= last_id]
 
     def get_info(self):
         """
@@ -211,15 +287,26 @@ class BTCE(ExchangeABC):
         return orders
 
     @classmethod
-    def get_ticker(cls, pair='ignored'):
-        response = cls.papi('ticker')
-        ticker = json.loads(response)['ticker']
-        ask = ticker.pop('buy')
-        bid = ticker.pop('sell')
-        timestamp = int(ticker.pop('updated'))
-        volume = ticker.pop('vol_cur')
-        del ticker['vol'], ticker['avg'], ticker['server_time']
-        return create_ticker(ask=ask, bid=bid, timestamp=timestamp, volume=volume, **ticker)
+    def get_ticker(cls, pair='BTC/USD'):
+        return cls.get_tickers([pair])[pair]
+
+    @classmethod
+    def get_tickers(cls, pairs):
+        symbols = dict((pair, get_symbol(cls.name, pair)) for pair in pairs)
+        url = publicUrlV3 % ('ticker', '-'.join(sorted(set(symbol.url for symbol in symbols.values()))))
+        try:
+            response = transport.decode(transport.request('btce', 'get', url, timeout=REQ_TIMEOUT))
+        except (ConnectionError, Timeout, ValueError) as e:
+            raise ExchangeError('btce', '%s %s while sending to %s' % (type(e), e, url))
+        if 'error' in response:
+            raise ExchangeError('btce', 'unable to get tickers from %s: %r' % (url, response['error']))
+        tickers = {}
+        for pair, symbol in symbols.iteritems():
+            ticker = response[symbol.url]
+            tickers[pair] = create_ticker(ask=ticker['buy'], bid=ticker['sell'], timestamp=int(ticker['updated']),
+                                          volume=ticker['vol_cur'], high=ticker['high'], low=ticker['low'],
+                                          last=ticker['last'], currency=symbol.quote, base=symbol.base)
+        return tickers
 
     def get_trades(self, since=None):
         # It returns your open orders/the orders history.
@@ -228,6 +315,29 @@ class BTCE(ExchangeABC):
             params['since'] = since
         return self._handle_response(self.send_btce(params))
 
+    def get_fills(self, since=None, pair='BTC/USD'):
+        symbol = get_symbol(self.name, pair)
+        from_id = int(since.fill_id) + 1 if since is not None else 0
+        fills = []
+        while True:
+            params = {"method": "TradeHistory", 'from_id': from_id, 'count': FILL_PAGE_SIZE, 'order': 'ASC',
+                      'pair': symbol.native}
+            try:
+                page = self._handle_response(self.send_btce(params))
+            except ExchangeError as ee:
+                if ee.error == "no trades":
+                    break
+                raise ee
+            for tid in sorted(page, key=int):
+                t = page[tid]
+                side = 'bid' if t['type'] == 'buy' else 'ask'
+                fills.append(Fill(self.name, str(tid), str(t['order_id']), side, Money(t['rate'], symbol.quote),
+                                  Money(t['amount'], symbol.base), Money(0, symbol.quote), float(t['timestamp'])))
+            if len(page) < FILL_PAGE_SIZE:
+                break
+            from_id = int(fills[-1].fill_id) + 1
+        return fills
+
     def get_transactions(self, **kwargs):
         """Return the transactions history.
         :param **kwargs:
@@ -249,9 +359,10 @@ class BTCE(ExchangeABC):
         params = {"method": "TradeHistory", 'count': 999999999999999}
         return self._handle_response(self.send_btce(params))
 
-    def get_deposit_address(self):
+    def get_deposit_address(self, currency='BTC'):
+        self.check_deposit_currency(currency)
         return exchange_config['btce']['address']
 
 
 eclass = BTCE
-exchange = BTCE(key=exchange_config['btce']['api_creds']['key'], secret=exchange_config['btce']['api_creds']['secret'])
+exchange = DefaultClient('btce')
@@ -0,0 +1,293 @@
+"""
+OHLCV candles built incrementally from trades and ticker polls.
+
+A CandleBuilder keeps a CandleSeries for each exchange, pair and resolution. Each trade updates the current bar of
+every resolution in place, so nothing is re-aggregated when candles are read. Ticker polls move the prices but add no
+volume, so exchanges without a trade tape still get bars.
+
+A series stores its bars as columns of fixed-point integers (see parse_pool), and holds at most max_bars of them in
+memory. Older bars are appended to a file of fixed size records, which range queries read with a binary search, so
+history is bounded only by disk. Bars are only spilled once they are old, so a late trade for a spilled bar is
+dropped.
+"""
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+import os
+import struct
+import threading
+import time
+
+from bitcoin_exchanges.exchange_util import ExchangeError, fan_out, get_live_exchange_workers
+from bitcoin_exchanges.parse_pool import TYPECODE, from_fixed, to_fixed
+from bitcoin_exchanges.symbols import get_symbol
+
+RESOLUTIONS = (1, 60, 300, 900, 3600, 14400, 86400)  # seconds
+MAX_BARS = 5000  # bars kept in memory per series
+SPILL_BARS = 1000  # bars written to disk at a time, once a series is full
+POLL_INTERVAL = 5  # seconds between ticker polls
+
+RECORD = struct.Struct('<7q')  # start, open, high, low, close, volume, count
+
+# prices and volume are Decimals. A period without trades has a flat bar at the last close, with no volume.
+Candle = namedtuple('Candle', ['start', 'open', 'high', 'low', 'close', 'volume', 'count'])
+
+
+def _candle(row):
+    start, o, h, l, c, volume, count = row
+    return Candle(start, from_fixed(o), from_fixed(h), from_fixed(l), from_fixed(c), from_fixed(volume), count)
+
+
+class CandleSeries(object):
+    """The bars of one exchange, pair and resolution, oldest first."""
+
+    def __init__(self, resolution, path=None, max_bars=MAX_BARS):
+        """
+        :param int resolution: the bar length in seconds
+        :param str path: the file to spill old bars to. Without one, old bars are dropped.
+        :param int max_bars: the most bars to keep in memory
+        """
+        self.resolution = resolution
+        self.path = path
+        self.max_bars = max_bars
+        # start, open, high, low, close, volume, count
+        self.columns = [array(TYPECODE) for _ in range(7)]
+        self.spilled_until = None  # bars starting before this are on disk, and final
+        if path is not None and os.path.exists(path) and os.path.getsize(path) >= RECORD.size:
+            with open(path, 'rb') as f:
+                f.seek(-RECORD.size, os.SEEK_END)
+                self.spilled_until = RECORD.unpack(f.read(RECORD.size))[0] + resolution
+
+    def add(self, timestamp, price, amount=0):
+        """
+        :param float timestamp: the time of the trade or price
+        :param int price: the price, in fixed-point
+        :param int amount: the amount traded, in fixed-point. 0 for a ticker price.
+        """
+        start = int(timestamp) - int(timestamp) % self.resolution
+        starts = self.columns[0]
+        if starts and start <= starts[-1]:
+            i = len(starts) - 1 if start == starts[-1] else bisect_left(starts, start)
+        else:
+            i = len(starts)
+        if i == len(starts) or starts[i] != start:
+            if self.spilled_until is not None and start < self.spilled_until:
+                return  # the bar is already on disk
+            self._insert(i, (start, price, price, price, price, 0, 0))
+        o, h, l, c, volume, count = (self.columns[j] for j in range(1, 7))
+        if price > h[i]:
+            h[i] = price
+        if price < l[i]:
+            l[i] = price
+        if i == len(starts) - 1:
+            c[i] = price  # out of order trades inside an older bar leave its close alone
+        if amount:
+            volume[i] += amount
+            count[i] += 1
+        if len(starts) > self.max_bars:
+            self._spill()
+
+    def _insert(self, i, row):
+        for column, value in zip(self.columns, row):
+            column.insert(i, value)
+
+    def _spill(self):
+        n = min(SPILL_BARS, len(self.columns[0]) - 1)
+        if self.path is not None:
+            with open(self.path, 'ab') as f:
+                for i in range(n):
+                    f.write(RECORD.pack(*[column[i] for column in self.columns]))
+        self.spilled_until = self.columns[0][n - 1] + self.resolution
+        for column in self.columns:
+            del column[:n]
+
+    def _disk_rows(self, start, end):
+        if self.path is None or not os.path.exists(self.path):
+            return []
+        with open(self.path, 'rb') as f:
+            count = os.path.getsize(self.path) // RECORD.size
+            lo, hi = 0, count
+            while lo < hi:  # the first record starting at or after start
+                mid = (lo + hi) // 2
+                f.seek(mid * RECORD.size)
+                if RECORD.unpack(f.read(RECORD.size))[0] < start:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            f.seek(lo * RECORD.size)
+            rows = []
+            for _ in range(lo, count):
+                row = RECORD.unpack(f.read(RECORD.size))
+                if row[0] >= end:
+                    break
+                rows.append(row)
+        return rows
+
+    def _last_before(self, start):
+        """The last row starting before start, for the close to fill a leading gap with."""
+        i = bisect_left(self.columns[0], start)
+        if i > 0:
+            return [column[i - 1] for column in self.columns]
+        rows = self._disk_rows(start - self.resolution * SPILL_BARS, start)
+        return rows[-1] if rows else None
+
+    def rows(self, start, end):
+        """
+        :return: the stored bars starting in [start, end), as rows of fixed-point integers
+        :rtype: list
+        """
+        rows = []
+        if self.spilled_until is not None and start < self.spilled_until:
+            rows = self._disk_rows(start, end)
+        starts = self.columns[0]
+        for i in range(bisect_left(starts, start), len(starts)):
+            if starts[i] >= end:
+                break
+            rows.append([column[i] for column in self.columns])
+        return rows
+
+    def candles(self, start, end, fill=True):
+        """
+        :param start: the earliest bar start, in seconds
+        :param end: the time to stop before, in seconds
+        :param bool fill: give a flat bar for each period without one, so every series of this resolution lines up
+        :return: the bars starting in [start, end), oldest first
+        :rtype: list
+        """
+        start = int(start) - int(start) % self.resolution
+        rows = self.rows(start, end)
+        if not fill:
+            return [_candle(row) for row in rows]
+        candles = []
+        previous = self._last_before(start)
+        rows = iter(rows)
+        row = next(rows, None)
+        for period in range(start, int(end), self.resolution):
+            if row is not None and row[0] == period:
+                previous = row
+                candles.append(_candle(row))
+                row = next(rows, None)
+            elif previous is not None:
+                close = previous[4]
+                candles.append(_candle((period, close, close, close, close, 0, 0)))
+        return candles
+
+
+class CandleBuilder(object):
+    """Candles at several resolutions for every exchange and pair fed to it."""
+
+    def __init__(self, resolutions=RESOLUTIONS, directory=None, max_bars=MAX_BARS, exchanges=None,
+                 interval=POLL_INTERVAL):
+        """
+        :param tuple resolutions: bar lengths in seconds
+        :param str directory: where to spill old bars. Without one, bars beyond max_bars are dropped.
+        :param int max_bars: the most bars to keep in memory per series
+        :param dict exchanges: exchange classes by name, for ticker polls. Defaults to all of the live exchanges.
+        :param int interval: seconds between ticker polls
+        """
+        self.resolutions = tuple(resolutions)
+        self.directory = directory
+        self.max_bars = max_bars
+        self._exchanges = exchanges
+        self.interval = interval
+        self.series = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def get_series(self, exchange, pair, resolution):
+        """:rtype: CandleSeries"""
+        key = (exchange, pair, resolution)
+        series = self.series.get(key)
+        if series is None:
+            path = None
+            if self.directory is not None:
+                path = os.path.join(self.directory, '%s_%s_%d.bars' % (exchange, pair.replace('/', ''), resolution))
+            series = self.series[key] = CandleSeries(resolution, path, self.max_bars)
+        return series
+
+    def add(self, exchange, pair, timestamp, price, amount=0):
+        """
+        Add a trade, or a price without volume, to every resolution's bar.
+
+        :param price: the price as a Decimal, number or string
+        :param amount: the amount traded
+        """
+        pair = get_symbol(exchange, pair).pair
+        price, amount = to_fixed(str(price)), to_fixed(str(amount))
+        with self._lock:
+            for resolution in self.resolutions:
+                self.get_series(exchange, pair, resolution).add(timestamp, price, amount)
+
+    def add_trades(self, exchange, trades, pair=None):
+        """
+        Add Trades. Its signature fits TapeReader.subscribe.
+
+        :param str pair: the trades' pair. Defaults to the exchange's main pair.
+        """
+        for trade in trades:
+            self.add(exchange, pair, trade.timestamp, trade.price.amount, trade.amount.amount)
+
+    def add_ticker(self, exchange, ticker, pair=None):
+        """Add a Ticker's last price, at its timestamp."""
+        self.add(exchange, pair, float(ticker.timestamp), ticker.last.amount)
+
+    def candles(self, exchange, pair, resolution, start, end=None, fill=True):
+        """
+        :param str pair: the pair by any of its names, or None for the exchange's main pair
+        :param int resolution: one of the builder's resolutions
+        :param end: defaults to now
+        :rtype: list
+        """
+        pair = get_symbol(exchange, pair).pair
+        with self._lock:
+            return self.get_series(exchange, pair, resolution).candles(start, end or time.time(), fill)
+
+    def candles_across(self, resolution, start, end=None, pairs=None):
+        """
+        The same range of bars from every exchange, aligned to the same period starts.
+
+        :param dict pairs: the pair by exchange name. Defaults to every exchange with candles, at its main pair.
+        :return: a list of Candles by exchange name
+        :rtype: dict
+        """
+        if pairs is None:
+            pairs = dict((exchange, None) for exchange, pair, res in self.series.keys())
+        return dict((exchange, self.candles(exchange, pair, resolution, start, end)) for exchange, pair in
+                    pairs.iteritems())
+
+    def poll_tickers(self):
+        """Add the last price of every exchange's ticker, concurrently."""
+        exchanges = self._exchanges
+        if exchanges is None:
+            exchanges = dict((name, mod.eclass) for name, mod in get_live_exchange_workers().iteritems())
+
+        def poll_one(name):
+            try:
+                ticker = exchanges[name].get_ticker()
+            except ExchangeError as e:
+                self.errors[name] = e
+                return
+            self.errors.pop(name, None)
+            self.add_ticker(name, ticker)
+
+        fan_out(poll_one, list(exchanges))
+
+    def start(self):
+        """Start polling tickers."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='candles')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        self.poll_tickers()
+        while not self._stop.wait(self.interval):
+            self.poll_tickers()
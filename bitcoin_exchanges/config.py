@@ -0,0 +1,255 @@
+"""
+Loading the exchange configuration: exchange_config, nonceDB and BLOCK_ORDERS.
+
+The settings come from a provider, and are loaded the first time one of them is used, not when the package is
+imported. By default they are read from the exchange_config.py file in BITCOIN_EXCHANGE_CONFIG_DIR, without adding
+that directory to sys.path. Another provider can be set with set_provider, and reload_config loads the settings
+again, in place, so code holding exchange_config, nonceDB or BLOCK_ORDERS sees the new values without re-importing
+anything.
+
+Besides its default api_creds, each exchange may list further accounts by name:
+
+    'bitfinex': {
+        'live': True,
+        'api_creds': {'key': '', 'secret': ''},
+        'accounts': {'hedging': {'key': '', 'secret': ''}},
+    },
+
+See exchange_util.get_client for using them.
+"""
+from collections import Mapping
+import copy
+import importlib
+import json
+import os
+import threading
+
+CONFIG_DIR_VAR = 'BITCOIN_EXCHANGE_CONFIG_DIR'
+CONFIG_VAR = 'BITCOIN_EXCHANGE_CONFIG'  # settings as JSON, for EnvProvider
+ENV_PREFIX = 'BITCOIN_EXCHANGE_'  # e.g. BITCOIN_EXCHANGE_KRAKEN_SECRET, for EnvProvider
+CONFIG_FILE = 'exchange_config.py'
+
+
+def _settings(source):
+    """
+    :param dict source: a config module's namespace, or any dict with the same names
+    :return: the settings this package uses, with their defaults
+    :rtype: dict
+    """
+    return {'exchange_config': source.get('exchange_config') or {},
+            'nonceDB': source.get('nonceDB'),
+            'BLOCK_ORDERS': bool(source.get('BLOCK_ORDERS', False))}
+
+
+class FileProvider(object):
+    """Settings from a python config file, like exchange_config.py, or a JSON file of the same names."""
+
+    def __init__(self, path):
+        self.path = path
+        self._mtime = None
+
+    def load(self):
+        self._mtime = os.path.getmtime(self.path)
+        if self.path.endswith('.json'):
+            with open(self.path) as f:
+                return _settings(json.load(f))
+        namespace = {'__file__': self.path}
+        execfile(self.path, namespace)
+        return _settings(namespace)
+
+    def changed(self):
+        """Whether the file has been modified since it was loaded."""
+        return self._mtime is None or os.path.getmtime(self.path) != self._mtime
+
+
+class ModuleProvider(object):
+    """Settings from an importable module, by name. The module is imported once, and its names read on each load."""
+
+    def __init__(self, name='exchange_config'):
+        self.name = name
+
+    def load(self):
+        return _settings(vars(importlib.import_module(self.name)))
+
+
+class CallableProvider(object):
+    """Settings from a function, e.g. one reading a secrets store. It returns a dict of the settings by name."""
+
+    def __init__(self, func):
+        self.func = func
+
+    def load(self):
+        return _settings(self.func())
+
+
+class EnvProvider(object):
+    """
+    Settings from the environment. The CONFIG_VAR variable may hold the settings as JSON, or just the exchange_config
+    dict, and variables named like BITCOIN_EXCHANGE_<EXCHANGE>_<FIELD> set fields of an exchange's api_creds, so
+    that secrets can be kept out of files. BITCOIN_EXCHANGE_BLOCK_ORDERS sets BLOCK_ORDERS.
+    """
+
+    def __init__(self, base=None, var=CONFIG_VAR, prefix=ENV_PREFIX, environ=None):
+        """
+        :param base: a provider of the settings to start from, instead of the CONFIG_VAR variable
+        """
+        self.base = base
+        self.var = var
+        self.prefix = prefix
+        self.environ = environ if environ is not None else os.environ
+
+    def load(self):
+        if self.base is not None:
+            settings = self.base.load()
+        else:
+            source = json.loads(self.environ.get(self.var, '{}'))
+            settings = _settings(source if 'exchange_config' in source else {'exchange_config': source})
+        exchanges = settings['exchange_config'] = copy.deepcopy(settings['exchange_config'])
+        for var, value in self.environ.items():
+            if not var.startswith(self.prefix) or var == self.var:
+                continue
+            rest = var[len(self.prefix):].lower()
+            if rest == 'block_orders':
+                settings['BLOCK_ORDERS'] = value.lower() in ('1', 'true', 'yes')
+                continue
+            for name in exchanges:
+                if rest.startswith(name + '_'):
+                    exchanges[name].setdefault('api_creds', {})[rest[len(name) + 1:]] = value
+                    break
+        return settings
+
+
+def default_provider():
+    """
+    :return: a FileProvider for the exchange_config.py in BITCOIN_EXCHANGE_CONFIG_DIR (or the current directory),
+             or if there is none there, a ModuleProvider importing exchange_config from the existing sys.path
+    """
+    location = os.environ.get(CONFIG_DIR_VAR, '.')
+    path = location if os.path.isfile(location) else os.path.join(location, CONFIG_FILE)
+    if os.path.isfile(path):
+        return FileProvider(path)
+    return ModuleProvider()
+
+
+class Config(object):
+    """The loaded settings, and the provider they come from."""
+
+    def __init__(self, provider=None):
+        self._provider = provider
+        self._settings = None
+        self._lock = threading.Lock()
+        self.version = 0  # incremented on each load, so caches of derived values can tell they are stale
+
+    @property
+    def settings(self):
+        settings = self._settings
+        if settings is None:
+            with self._lock:
+                if self._settings is None:
+                    self._load()
+                settings = self._settings
+        return settings
+
+    def _load(self):
+        if self._provider is None:
+            self._provider = default_provider()
+        self._settings = self._provider.load()
+        self.version += 1
+
+    def get(self, name):
+        return self.settings[name]
+
+    def set_provider(self, provider):
+        """Use another provider. Its settings are loaded the next time one is used."""
+        with self._lock:
+            self._provider = provider
+            self._settings = None
+
+    def reload(self):
+        """Load the settings again from the provider, replacing the old ones at once."""
+        with self._lock:
+            self._load()
+
+    def reload_if_changed(self):
+        """
+        Reload if the provider can tell that its settings changed, as a FileProvider can.
+
+        :return: True if the settings were reloaded
+        :rtype: bool
+        """
+        changed = getattr(self._provider, 'changed', None)
+        if self._settings is not None and changed is not None and changed():
+            self.reload()
+            return True
+        return False
+
+
+config = Config()
+
+
+def set_provider(provider):
+    config.set_provider(provider)
+
+
+def reload_config():
+    config.reload()
+
+
+def reload_if_changed():
+    return config.reload_if_changed()
+
+
+class ExchangeConfig(Mapping):
+    """The exchange_config dict of the current settings, read through on every lookup."""
+
+    def __getitem__(self, name):
+        return config.get('exchange_config')[name]
+
+    def __iter__(self):
+        return iter(config.get('exchange_config'))
+
+    def __len__(self):
+        return len(config.get('exchange_config'))
+
+    def __repr__(self):
+        return repr(config.get('exchange_config'))
+
+
+class Flag(object):
+    """A boolean setting, read on every truth test, so `if BLOCK_ORDERS:` follows reloads."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __nonzero__(self):
+        return bool(config.get(self.name))
+
+    def __eq__(self, other):
+        return bool(self) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(bool(self))
+
+
+class SettingProxy(object):
+    """Forwards attribute lookups to an object setting, e.g. the nonceDB collection."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(config.get(self.name), attr)
+
+    def __nonzero__(self):
+        return config.get(self.name) is not None
+
+    def __repr__(self):
+        return repr(config.get(self.name))
+
+
+exchange_config = ExchangeConfig()
+nonceDB = SettingProxy('nonceDB')
+BLOCK_ORDERS = Flag('BLOCK_ORDERS')
@@ -1,22 +1,65 @@
-from collections import namedtuple
-from decimal import Decimal
+from collections import namedtuple, deque
+from contextlib import contextmanager
+from decimal import Decimal, ROUND_CEILING, ROUND_FLOOR
+from multiprocessing.pool import ThreadPool
+import Queue
 import abc
+import hmac
 import importlib
-import os
-import sys
+import random
+import threading
+import time
 
 from moneyed import Money
 from pymongo.errors import DuplicateKeyError
+from requests.exceptions import ConnectionError, ConnectTimeout, Timeout
 
-
-config_dir = os.path.dirname(os.environ.get('BITCOIN_EXCHANGE_CONFIG_DIR', '.'))
-if config_dir not in sys.path:
-    sys.path.append(config_dir)
-from exchange_config import exchange_config, nonceDB, BLOCK_ORDERS
+from bitcoin_exchanges.config import config, exchange_config, nonceDB, BLOCK_ORDERS
 
 OrderbookItem = namedtuple('OrderbookItem', 'price amount')
 MyOrder = namedtuple('Order', ['price', 'amount', 'side', 'exchange', 'order_id'])
 Ticker = namedtuple('Ticker', ['bid', 'ask', 'high', 'low', 'volume', 'last', 'timestamp'])
+Fill = namedtuple('Fill', ['exchange', 'fill_id', 'order_id', 'side', 'price', 'amount', 'fee', 'timestamp'])
+# a public trade. side is that of the taker.
+Trade = namedtuple('Trade', ['exchange', 'trade_id', 'side', 'price', 'amount', 'timestamp'])
+# expires is the unix time the exchange stops crediting deposits to the address, or None if it never does
+DepositAddress = namedtuple('DepositAddress', ['exchange', 'address', 'expires'])
+
+_time_nonces = {}  # the last time_nonce, by account_id
+_time_nonces_lock = threading.Lock()
+
+LATENCY_SAMPLES = 256  # recent requests kept per exchange and endpoint class
+MIN_LATENCY_SAMPLES = 20  # before percentiles are trusted
+HEALTH_SMOOTHING = 0.2  # weight of the newest latency in the health score's moving average
+
+
+class OrderTemplate(object):
+    """
+    An order prepared ahead of the decision to trade.
+
+    Exchanges subclass this to build everything but the price, amount and nonce (params,
+    url, headers, the static part of the payload) when the template is created, so that
+    submit only has to fill in the rest, sign and send. This default just calls create_order.
+    """
+
+    def __init__(self, exchange, otype, **kwargs):
+        """
+        :param ExchangeABC exchange: the client to submit through
+        :param str otype: 'bid' or 'ask'
+        :param kwargs: any other create_order arguments, such as the symbol or order type
+        """
+        self.exchange = exchange
+        self.otype = otype
+        self.kwargs = kwargs
+
+    def submit(self, amount, price):
+        """
+        Place the order.
+
+        :return: The unique order id given by the exchange
+        :rtype: str
+        """
+        return self.exchange.create_order(amount, price, self.otype, **self.kwargs)
 
 
 class ExchangeABC:
@@ -28,9 +71,24 @@ class ExchangeABC:
     name = 'Exchange'
     fiatcurrency = 'USD'
     nonceDB = None
+    order_template = OrderTemplate
+    hosts = ()  # the api hosts used, for warming connections
+    # the api_creds fields passed to the constructor, in order. None if the client can only use the default account.
+    credential_fields = ('key', 'secret')
+    account = None  # the account name, set by get_client. None for the exchange's default api_creds.
+    withdrawal_currencies = ()  # the currencies withdraw can send
+    deposit_currencies = ('BTC',)  # the currencies get_deposit_address has addresses for
+    # seconds before the newest fill seen that get_fills can still report new fills from, for TradeSync to dedupe
+    fill_lookback = 0
 
     def __init__(self):
-        pass
+        self._order_templates = {}
+
+    @property
+    def account_id(self):
+        """The exchange name, and the account name unless this is the default account. Nonces and rate limits are
+        kept per account_id."""
+        return self.name if self.account is None else '%s:%s' % (self.name, self.account)
 
     @abc.abstractmethod
     def cancel_order(self, oid):
@@ -57,6 +115,21 @@ class ExchangeABC:
         """
         pass
 
+    def prepare_order(self, otype, **kwargs):
+        """
+        Prepare an order of a given type, to be submitted later with just a price and amount.
+        Templates are cached, so preparing the same order again is free.
+
+        :param str otype: 'bid' or 'ask'
+        :param kwargs: any other create_order arguments
+        :rtype: OrderTemplate
+        """
+        key = (otype, repr(sorted(kwargs.items())))
+        template = self._order_templates.get(key)
+        if template is None:
+            template = self._order_templates[key] = self.order_template(self, otype, **kwargs)
+        return template
+
     @classmethod
     def format_book_item(cls, item):
         """
@@ -79,6 +152,61 @@ class ExchangeABC:
         # expects each order to be a list with first element as price and second as size
         return [str(item[0]), str(item[1])]
 
+    @classmethod
+    def book_request(cls, symbol, depth=None):
+        """
+        The request for a raw order book, as get_order_book sends it, so that it can be fetched elsewhere (see
+        parse_pool).
+
+        :param Symbol symbol: the book's pair
+        :param int depth: the levels wanted on each side, where the exchange can limit them
+        :return: the url, the params and the keys the book is under in the response, or None if the book is only
+                 fetched through a client library
+        :rtype: tuple
+        """
+        return None
+
+    @classmethod
+    def limit_book(cls, book, depth=None, group=None):
+        """
+        Cut a raw order book down to its best levels, for exchanges which can not do it server side.
+        Both sides are returned best first, in the exchange's raw format.
+
+        :param dict book: the raw order book, with 'bids' and 'asks'
+        :param int depth: the number of price levels to keep on each side
+        :param group: if given, merge prices into levels this wide. Bids round down and asks up.
+        :rtype: dict
+        """
+        if not book or (depth is None and group is None):
+            return book
+        limited = dict(book)
+        for side in ('bids', 'asks'):
+            items = book.get(side) or []
+            if len(items) > 1:
+                first, last = cls.format_book_item(items[0]).price, cls.format_book_item(items[-1]).price
+                if (first < last) if side == 'bids' else (first > last):
+                    items = items[::-1]
+            if group is None:
+                limited[side] = items[:depth]
+            else:
+                limited[side] = cls._group_levels(items, depth, Decimal(str(group)),
+                                                  ROUND_FLOOR if side == 'bids' else ROUND_CEILING)
+        return limited
+
+    @classmethod
+    def _group_levels(cls, items, depth, group, rounding):
+        levels = []
+        for item in items:
+            price, amount = cls.format_book_item(item)
+            price = (price / group).to_integral_value(rounding) * group
+            if levels and levels[-1][0] == price:
+                levels[-1][1] += amount
+            elif depth is not None and len(levels) == depth:
+                break  # the items are best first, so no later item can join a kept level
+            else:
+                levels.append([price, amount])
+        return [cls.unformat_book_item(OrderbookItem(price, amount)) for price, amount in levels]
+
 
     @abc.abstractmethod
     def get_balance(self, btype='total'):
@@ -99,13 +227,15 @@ class ExchangeABC:
 
     @classmethod
     @abc.abstractmethod
-    def get_order_book(cls, pair=None):
+    def get_order_book(cls, pair=None, depth=None, group=None):
         """
         Get the orderbook for this exchange.
 
         :param pair: If the exchange supports multiple pairs, then the "pair" param
                              can be used to specify a given orderbook. In case the exchange
                              does not support that, then the "pair" param is ignored.
+        :param int depth: only get this many price levels on each side, from the server where it allows
+        :param group: merge prices into levels this wide (see limit_book)
         :return: a list of bids and asks
         :rtype: list
         """
@@ -124,6 +254,27 @@ class ExchangeABC:
         """
         pass
 
+    @classmethod
+    def get_tickers(cls, pairs):
+        """
+        Get the tickers for several pairs at once. Exchanges which can return many pairs in one request
+        should override this, the default is to request each pair concurrently.
+
+        :param list pairs: the pairs, by any of their names
+        :return: a Ticker for each pair, keyed by the pair as given
+        :rtype: dict
+        """
+        pairs = list(pairs)
+        return dict(zip(pairs, fan_out(cls.get_ticker, pairs)))
+
+    @classmethod
+    def heartbeat(cls):
+        """
+        Make a cheap public request, to check the exchange is up and keep its connections open.
+        Exchanges with a lighter endpoint than the ticker should override this.
+        """
+        cls.get_ticker()
+
     @abc.abstractmethod
     def get_transactions(self, limit=None):
         """
@@ -131,27 +282,98 @@ class ExchangeABC:
         :return: a list of transactions, possibly only a subset of them."""
         pass
 
+    @classmethod
+    def get_public_trades(cls, pair=None, since=None):
+        """
+        Get the exchange's recent public trades, oldest first.
+
+        :param str pair: the pair by any of its names. Defaults to the exchange's main pair.
+        :param Trade since: the last trade already seen. Where the exchange has a cursor, only trades at or after it
+                            are fetched, but there may still be overlap, so callers should dedupe by trade_id.
+        :return: a list of Trade objects
+        :rtype: list
+        """
+        raise ExchangeError(cls.name, 'public trades are not supported')
+
+    @abc.abstractmethod
+    def get_fills(self, since=None):
+        """
+        Get the account's trade fills, oldest first.
+
+        :param Fill since: the last fill already seen. Only fills at or after it are fetched,
+                           using whatever cursor (trade id or timestamp) the exchange supports.
+        :return: a list of Fill objects
+        :rtype: list
+        """
+        pass
+
     @abc.abstractmethod
-    def get_deposit_address(self):
+    def get_deposit_address(self, currency='BTC'):
         """
-        :return: a bitcoin address for making deposits to your account."""
+        :param str currency: one of deposit_currencies
+        :return: an address for making deposits of currency to your account."""
         pass
 
+    def get_deposit_addresses(self, new=False, currency='BTC'):
+        """
+        :param bool new: ask the exchange for a new address, where it can make one
+        :param str currency: one of deposit_currencies
+        :return: the account's deposit addresses for currency, as DepositAddress objects
+        :rtype: list
+        """
+        return [DepositAddress(self.name, self.get_deposit_address(currency), None)]
+
+    def check_deposit_currency(self, currency):
+        """Raise an ExchangeError unless the exchange has deposit addresses for currency."""
+        if currency not in self.deposit_currencies:
+            raise ExchangeError(self.name, 'deposits of %s are not supported' % currency)
+
+    def withdraw(self, amount, address):
+        """
+        Withdraw to an address. Only the currencies in withdrawal_currencies are supported.
+
+        :param Money amount: the amount and currency to withdraw
+        :param str address: the address to send it to
+        :return: the exchange's response, or "withdrawal blocked" if BLOCK_ORDERS is set
+        """
+        raise ExchangeError(self.name, 'withdrawals are not supported')
+
+    def time_nonce(self, scale=1000):
+        """
+        A nonce from the clock, for exchanges which only need nonces to increase. Concurrent requests on this
+        account never get the same nonce, however fine or coarse the clock is. The last nonce is kept per account_id,
+        not per client, so every client of one key shares a sequence.
+
+        :param scale: nonce units per second
+        :rtype: int
+        """
+        with _time_nonces_lock:
+            nonce = _time_nonces[self.account_id] = max(_time_nonces.get(self.account_id, 0) + 1,
+                                                        int(time.time() * scale))
+            return nonce
+
+    def initial_nonce(self):
+        """The nonce a new nonceDB sequence starts at."""
+        return int(time.time())
+
     def next_nonce(self):
-        """Atomically increment and get a nonce for an exchange."""
-        entry = self.nonceDB.find_and_modify({'exchange': self.name}, {'$inc': {'seq': 1}}, new=True)
+        """Atomically increment and get a nonce for this account, starting its sequence if there is none yet."""
+        entry = self.nonceDB.find_and_modify({'exchange': self.account_id}, {'$inc': {'seq': 1}}, new=True)
+        if entry is None:
+            self.create_nonce(self.initial_nonce())
+            entry = self.nonceDB.find_and_modify({'exchange': self.account_id}, {'$inc': {'seq': 1}}, new=True)
         return entry['seq']
 
     def create_nonce(self, nonce):
         """
-        Save a starting nonce for a given exchange.
+        Save a starting nonce for this account.
 
         :param int nonce: an integer that will be incremented on each
             next_nonce call.
         :return: nonce if an entry was created, None otherwise.
         """
         try:
-            self.nonceDB.insert({'exchange': self.name, 'nonce': nonce})
+            self.nonceDB.insert({'exchange': self.account_id, 'nonce': nonce})
         except DuplicateKeyError:
             # exchange already present.
             return None
@@ -172,18 +394,697 @@ class ExchangeError(Exception):
         return str(self.exchange) + ":\t" + str(self.error)
 
 
+class CircuitOpenError(ExchangeError):
+    """
+    A request was refused without being sent, because the exchange's circuit breaker is open.
+    """
+
+
+class HmacSigner(object):
+    """
+    A keyed HMAC prepared once per client.
+
+    Keying an HMAC hashes the secret into its inner and outer pads. Doing that once, and
+    then copying the prepared object for each message, saves repeating it on every request.
+    """
+
+    def __init__(self, secret, digestmod):
+        self._prototype = hmac.new(secret, digestmod=digestmod)
+
+    def sign(self, *parts):
+        """
+        :param parts: the strings making up the message, in order. They are hashed as they are,
+                      so the message never has to be concatenated.
+        :return: a finished hmac object for the message
+        """
+        mac = self._prototype.copy()
+        for part in parts:
+            mac.update(part)
+        return mac
+
+    def digest(self, *parts):
+        return self.sign(*parts).digest()
+
+    def hexdigest(self, *parts):
+        return self.sign(*parts).hexdigest()
+
+
+class LatencyTracker(object):
+    """The latencies of the most recent requests to one exchange and endpoint class."""
+
+    def __init__(self, size=LATENCY_SAMPLES):
+        self.samples = deque(maxlen=size)
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, p):
+        """
+        :param float p: between 0 and 1
+        :return: the latency in seconds, or None until there are enough samples
+        """
+        samples = sorted(self.samples)
+        if len(samples) < MIN_LATENCY_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+
+class RetryBudget(object):
+    """
+    Limits retries to a fraction of successful requests, so that retries never multiply
+    the load on an exchange that is already failing.
+
+    Each success deposits ratio tokens, up to max_tokens, and each retry withdraws one.
+    """
+
+    def __init__(self, ratio=0.1, max_tokens=10):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        """
+        :return: True if a retry may be made
+        :rtype: bool
+        """
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class RateLimiter(object):
+    """
+    A token bucket, holding back requests beyond an exchange's rate limit for one api key until they are allowed.
+
+    Tokens refill at rate per second, up to burst, and each request takes one.
+    """
+
+    def __init__(self, rate=1.0, burst=10):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token, waiting for one if the bucket is empty.
+
+        :return: the seconds waited
+        :rtype: float
+        """
+        with self._lock:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class RetryPolicy(object):
+    """
+    When and how to retry a request.
+
+    Retries back off exponentially with full jitter, and are drawn from the exchange's RetryBudget.
+    Idempotent requests are retried after any connection error or timeout. Others, like order
+    creation, only after errors which prove the request never reached the exchange.
+    """
+
+    def __init__(self, max_attempts=3, base_delay=0.05, max_delay=1.0, hedge=False, hedge_percentile=0.95):
+        """
+        :param int max_attempts: including the first
+        :param float base_delay: seconds to back off after the first attempt, doubling after each
+        :param float max_delay: the longest back off in seconds
+        :param bool hedge: if True, a public read still waiting after the hedge_percentile latency
+                           is sent again, and whichever response arrives first is used
+        :param float hedge_percentile: between 0 and 1
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    @staticmethod
+    def retryable(error, idempotent):
+        if isinstance(error, DeadlineExceeded):
+            return False
+        if idempotent:
+            return isinstance(error, (ConnectionError, Timeout))
+        return isinstance(error, ConnectTimeout)
+
+    def run(self, exchange, func, idempotent=True, retry_if=None):
+        """
+        Call func until it succeeds, or the attempts or retry budget run out.
+
+        :param str exchange: the exchange name, for its retry budget
+        :param func: makes the request. Called with no arguments.
+        :param bool idempotent: whether the request is safe to repeat
+        :param retry_if: called with each result. Returning True means the exchange rejected the
+                         request unprocessed (e.g. a stale nonce), so it is always safe to retry.
+        :return: the result of the last attempt
+        """
+        budget = get_retry_budget(exchange)
+        attempt = 1
+        while True:
+            try:
+                result = func()
+            except Exception as e:
+                if (not self.retryable(e, idempotent) or attempt >= self.max_attempts or
+                        not budget.withdraw()):
+                    raise
+            else:
+                if retry_if is None or not retry_if(result):
+                    budget.deposit()
+                    return result
+                if attempt >= self.max_attempts or not budget.withdraw():
+                    return result  # still rejected, so it earns the budget nothing
+            delay = self.backoff(attempt - 1)
+            remaining = time_remaining()
+            if remaining is not None:
+                delay = min(delay, max(remaining, 0))
+            time.sleep(delay)
+            attempt += 1
+
+    def run_hedged(self, exchange, func, delay):
+        """
+        Call func, and if it has not returned after delay seconds, call it again concurrently.
+        The hedge is drawn from the exchange's retry budget.
+
+        :return: the first successful result
+        """
+        results = Queue.Queue()
+        at = getattr(_deadlines, 'at', None)
+
+        def attempt():
+            _deadlines.at = at
+            try:
+                results.put((True, func()))
+            except Exception as e:
+                results.put((False, e))
+
+        def launch():
+            thread = threading.Thread(target=attempt)
+            thread.daemon = True
+            thread.start()
+
+        launch()
+        pending = 1
+        try:
+            outcome = results.get(timeout=delay)
+        except Queue.Empty:
+            if get_retry_budget(exchange).withdraw():
+                launch()
+                pending += 1
+            outcome = results.get()
+        pending -= 1
+        if not outcome[0] and pending > 0:
+            second = results.get()
+            if second[0]:
+                outcome = second
+        if outcome[0]:
+            return outcome[1]
+        raise outcome[1]
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+_retry_policies = {}
+_retry_budgets = {}
+_latency_trackers = {}
+_rate_limiters = {}
+_registry_lock = threading.Lock()
+
+# private requests per second and burst allowed per api key, overridden by a 'rate_limit' entry in an
+# exchange's exchange_config
+RATE_LIMITS = {
+    'bitfinex': (1, 10),
+    'bitstamp': (1, 10),  # 600 per 10 minutes
+    'btcchina': (1, 5),
+    'btce': (1, 10),
+    'huobi': (1, 5),
+    'kraken': (0.33, 15),  # the call counter decays by 1 every 3 seconds
+    'lakebtc': (1, 5),
+    'okcoin': (3, 6),
+    'poloniex': (6, 6),
+}
+
+
+def _get_or_create(registry, key, factory):
+    value = registry.get(key)
+    if value is None:
+        with _registry_lock:
+            value = registry.get(key)
+            if value is None:
+                value = registry[key] = factory()
+    return value
+
+
+def get_retry_policy(exchange):
+    return _retry_policies.get(exchange, DEFAULT_RETRY_POLICY)
+
+
+def set_retry_policy(exchange, policy):
+    """Use a different RetryPolicy for one exchange."""
+    _retry_policies[exchange] = policy
+
+
+def get_retry_budget(exchange):
+    return _get_or_create(_retry_budgets, exchange, RetryBudget)
+
+
+def get_rate_limiter(exchange, account_id=None):
+    """
+    :param str account_id: the ExchangeABC.account_id of the api key. Defaults to the exchange's default account.
+    :rtype: RateLimiter
+    """
+    def create():
+        rate, burst = exchange_config.get(exchange, {}).get('rate_limit', RATE_LIMITS.get(exchange, (1, 10)))
+        return RateLimiter(rate, burst)
+
+    return _get_or_create(_rate_limiters, (exchange, account_id or exchange), create)
+
+
+def get_latency_tracker(exchange, endpoint):
+    """
+    :param str endpoint: the endpoint class, 'public' or 'private'
+    :rtype: LatencyTracker
+    """
+    return _get_or_create(_latency_trackers, (exchange, endpoint), LatencyTracker)
+
+
+class DeadlineExceeded(Timeout):
+    """The deadline set with the deadline context manager passed before a request could be sent."""
+
+
+_deadlines = threading.local()
+
+
+@contextmanager
+def deadline(seconds):
+    """
+    Bound every request made in this block, including retries, to finish within seconds.
+    Nested deadlines can only shorten the enclosing one. fan_out passes the deadline on to its threads.
+    """
+    previous = getattr(_deadlines, 'at', None)
+    at = time.time() + seconds
+    if previous is not None:
+        at = min(at, previous)
+    _deadlines.at = at
+    try:
+        yield at
+    finally:
+        _deadlines.at = previous
+
+
+def time_remaining():
+    """
+    :return: seconds until the current deadline, or None if there is none
+    :rtype: float
+    """
+    at = getattr(_deadlines, 'at', None)
+    if at is None:
+        return None
+    return at - time.time()
+
+
+class TimeoutPolicy(object):
+    """
+    Derives request timeouts from the latencies observed for each exchange and endpoint class,
+    so a venue that normally answers in 80ms is given up on long before a blanket 10 second timeout.
+
+    The read timeout is the percentile latency times multiplier, bounded below by a floor and above by
+    the caller's timeout. The connect timeout is bounded below by its own floor, since a new connection
+    may need a TLS handshake the observed requests did not. Until enough latencies are known,
+    the caller's timeout is used unchanged.
+    """
+
+    def __init__(self, percentile=0.99, multiplier=3.0, public_floor=0.5, private_floor=1.0, connect_floor=1.0):
+        """
+        :param float percentile: between 0 and 1
+        :param float multiplier: the margin over the percentile latency
+        :param float public_floor: the shortest read timeout for public requests, in seconds
+        :param float private_floor: the shortest read timeout for private requests, in seconds
+        :param float connect_floor: the shortest connect timeout, in seconds
+        """
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.public_floor = public_floor
+        self.private_floor = private_floor
+        self.connect_floor = connect_floor
+
+    def timeout(self, exchange, endpoint, ceiling):
+        """
+        :param str endpoint: the endpoint class, 'public' or 'private'
+        :param ceiling: the caller's timeout in seconds, or a (connect, read) tuple, or None
+        :return: the (connect, read) timeout to use, or None for no timeout
+        """
+        if isinstance(ceiling, tuple):
+            connect_ceiling, read_ceiling = ceiling
+        else:
+            connect_ceiling = read_ceiling = ceiling
+        observed = get_latency_tracker(exchange, endpoint).percentile(self.percentile)
+        if observed is None:
+            connect, read = connect_ceiling, read_ceiling
+        else:
+            read = max(self.private_floor if endpoint == 'private' else self.public_floor, observed * self.multiplier)
+            connect = max(self.connect_floor, read)
+            if read_ceiling is not None:
+                read = min(read, read_ceiling)
+            if connect_ceiling is not None:
+                connect = min(connect, connect_ceiling)
+        remaining = time_remaining()
+        if remaining is not None:
+            if remaining <= 0:
+                raise DeadlineExceeded('deadline passed before sending request to %s' % exchange)
+            connect = remaining if connect is None else min(connect, remaining)
+            read = remaining if read is None else min(read, remaining)
+        if connect is None and read is None:
+            return None
+        return connect, read
+
+
+DEFAULT_TIMEOUT_POLICY = TimeoutPolicy()
+_timeout_policies = {}
+
+
+def get_timeout_policy(exchange):
+    return _timeout_policies.get(exchange, DEFAULT_TIMEOUT_POLICY)
+
+
+def set_timeout_policy(exchange, policy):
+    """Use a different TimeoutPolicy for one exchange."""
+    _timeout_policies[exchange] = policy
+
+
+class CircuitBreaker(object):
+    """
+    Fails requests to one exchange and endpoint class fast while it is erroring, instead of
+    letting every caller wait out its timeout.
+
+    The breaker opens when the error rate over the last window requests reaches error_threshold.
+    After reset_timeout seconds it lets probes through (half open), and closes again if they succeed.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half open'
+
+    def __init__(self, window=50, min_requests=10, error_threshold=0.5, reset_timeout=30, probes=1):
+        """
+        :param int window: the number of recent requests the error rate is measured over
+        :param int min_requests: requests needed in the window before the breaker can open
+        :param float error_threshold: the error rate, between 0 and 1, which opens the breaker
+        :param int reset_timeout: seconds to stay open before probing
+        :param int probes: concurrent requests allowed while half open
+        """
+        self.min_requests = min_requests
+        self.error_threshold = error_threshold
+        self.reset_timeout = reset_timeout
+        self.probes = probes
+        self.state = self.CLOSED
+        self.opened_at = None
+        self.outcomes = deque(maxlen=window)
+        self.avg_latency = None
+        self._probing = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        :return: True if a request may be sent now. Each allowed request must be followed by a call to record, or to
+                 release if it is not sent.
+        :rtype: bool
+        """
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.time() < self.opened_at + self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                if self._probing >= self.probes:
+                    return False
+                self._probing += 1
+            return True
+
+    def release(self):
+        """Give back an allowed request which was never sent, instead of recording it."""
+        with self._lock:
+            if self.state == self.HALF_OPEN and self._probing > 0:
+                self._probing -= 1
+
+    def record(self, success, latency=None):
+        """
+        :param bool success: False if the request raised a connection error or timeout, or got a server error
+        :param float latency: seconds the request took, if it got a response
+        """
+        with self._lock:
+            self.outcomes.append(success)
+            if latency is not None:
+                if self.avg_latency is None:
+                    self.avg_latency = latency
+                else:
+                    self.avg_latency += HEALTH_SMOOTHING * (latency - self.avg_latency)
+            if self.state == self.HALF_OPEN:
+                self._probing -= 1
+                if success:
+                    self.state = self.CLOSED
+                    self.outcomes.clear()
+                else:
+                    self._open()
+            elif (self.state == self.CLOSED and len(self.outcomes) >= self.min_requests and
+                    self.error_rate() >= self.error_threshold):
+                self._open()
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.time()
+
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return float(self.outcomes.count(False)) / len(self.outcomes)
+
+    def health(self):
+        """
+        :return: 0 while open, otherwise between 0 and 1, falling with the error rate and average latency
+        :rtype: float
+        """
+        if self.state == self.OPEN:
+            return 0.0
+        return (1 - self.error_rate()) / (1 + (self.avg_latency or 0))
+
+    def as_dict(self):
+        return {'state': self.state, 'error_rate': self.error_rate(), 'avg_latency': self.avg_latency,
+                'health': self.health()}
+
+
+_circuit_breakers = {}
+
+
+def get_circuit_breaker(exchange, endpoint):
+    """
+    :param str endpoint: the endpoint class, 'public' or 'private'
+    :rtype: CircuitBreaker
+    """
+    return _get_or_create(_circuit_breakers, (exchange, endpoint), CircuitBreaker)
+
+
+def exchange_health(exchange):
+    """
+    :return: the health of an exchange's sickest endpoint class, between 0 and 1. 1 if it has not been used.
+    :rtype: float
+    """
+    return min([breaker.health() for (name, endpoint), breaker in _circuit_breakers.items() if name == exchange] or
+               [1.0])
+
+
+def rank_by_health(exchanges):
+    """
+    :param exchanges: exchange names
+    :return: the exchange names, healthiest first
+    :rtype: list
+    """
+    return sorted(exchanges, key=exchange_health, reverse=True)
+
+
 # Convenience Function to create tuples
 def create_ticker(bid=0, ask=0, high=0, low=0, volume=0, last=0, timestamp=0,
-                  currency='USD'):
+                  currency='USD', base='BTC'):
     return Ticker(Money(bid, currency), Money(ask, currency),
                   Money(high, currency), Money(low, currency),
-                  Money(volume, 'BTC'), Money(last, currency),
+                  Money(volume, base), Money(last, currency),
                   timestamp)
 
 
-def get_live_exchange_workers():
+_pools = {}  # (workers, depth): ThreadPool
+_pools_lock = threading.Lock()
+_fan_out_depth = threading.local()
+
+
+def _get_pool(workers, depth):
+    """
+    The long-lived pool for a number of workers. Calls made from inside a pool's workers get a pool of the next
+    depth, so a nested fan_out never waits on the workers it is running in.
+    """
+    with _pools_lock:
+        pool = _pools.get((workers, depth))
+        if pool is None:
+            pool = _pools[(workers, depth)] = ThreadPool(workers)
+        return pool
+
+
+def _at_depth(func, depth):
+    def call(item):
+        _fan_out_depth.depth = depth
+        return func(item)
+    return call
+
+
+def fan_out(func, items, workers=8):
+    """
+    Call func on each item concurrently, using a shared pool of threads.
+
+    :return: the results, in the same order as items
+    :rtype: list
+    """
+    items = list(items)
+    if len(items) <= 1:
+        return map(func, items)
+    at = getattr(_deadlines, 'at', None)
+    if at is not None:
+        func = _with_deadline(func, at)
+    depth = getattr(_fan_out_depth, 'depth', 0)
+    return _get_pool(workers, depth).map(_at_depth(func, depth + 1), items)
+
+
+def _with_deadline(func, at):
+    def call(item):
+        _deadlines.at = at
+        try:
+            return func(item)
+        finally:
+            _deadlines.at = None
+    return call
+
+
+def get_live_exchange_workers(min_health=None):
+    """
+    :param float min_health: if given, skip exchanges whose health (see exchange_health) is below it
+    :return: the modules of the live exchanges, by name
+    :rtype: dict
+    """
     exchanges = {}
     for exch in exchange_config:
         if exch != 'UFX' and exchange_config[exch]['live']:
+            if min_health is not None and exchange_health(exch) < min_health:
+                continue
             exchanges[exch] = importlib.import_module('bitcoin_exchanges.%s' % exch)
     return exchanges
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_credentials(exchange, account=None):
+    """
+    :param str exchange: the exchange name
+    :param str account: the name of one of the exchange's 'accounts' in exchange_config. Defaults to its api_creds.
+    :rtype: dict
+    """
+    entry = exchange_config[exchange]
+    if account is None:
+        return entry['api_creds']
+    accounts = entry.get('accounts') or {}
+    if account not in accounts:
+        raise ExchangeError(exchange, 'no account named %r in exchange_config' % account)
+    return accounts[account]
+
+
+def get_client(exchange, account=None):
+    """
+    Get a client for one of an exchange's accounts. Clients of the same exchange share its connection pool, retry
+    budget, circuit breakers and latency tracking, so many accounts can be run from one process.
+
+    There is one client per account, and the default account's is the one behind the client module's `exchange`.
+    The credentials are read from the current config, so after config.reload_config an account whose
+    credentials changed gets a new client.
+
+    :param str exchange: the exchange name
+    :param str account: the account name (see get_credentials). Defaults to the exchange's api_creds.
+    :rtype: ExchangeABC
+    """
+    mod = importlib.import_module('bitcoin_exchanges.%s' % exchange)
+    fields = mod.eclass.credential_fields
+    if fields is None:
+        if account is not None:
+            raise ExchangeError(exchange, 'only the default account is supported')
+        args = ()
+    else:
+        creds = get_credentials(exchange, account)
+        args = tuple(creds[field] for field in fields)
+    key = (exchange, account, args)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                for old in [k for k in _clients if k[:2] == (exchange, account)]:
+                    del _clients[old]
+                client = mod.eclass(*args)
+                client.account = account
+                _clients[key] = client
+    return client
+
+
+class DefaultClient(object):
+    """
+    A client module's `exchange`: the default account's client from get_client, looked up on each use. Importing a
+    client module reads no config, and after reload_config the new api_creds are used.
+    """
+
+    def __init__(self, exchange):
+        self.exchange_name = exchange
+
+    def __getattr__(self, attr):
+        return getattr(get_client(self.exchange_name), attr)
+
+    def __repr__(self):
+        return '<default %s client>' % self.exchange_name
+
+
+class LazyClient(object):
+    """
+    An api client built from the config on first use, and built again after the config is reloaded, e.g. the shared
+    btcny and polo clients.
+    """
+
+    def __init__(self, build):
+        """
+        :param build: called with no arguments to make the client
+        """
+        self._build = build
+        self._client = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, attr):
+        client = self._client
+        if client is None or self._version != config.version:
+            with self._lock:
+                if self._client is None or self._version != config.version:
+                    self._client = self._build()
+                    self._version = config.version
+                client = self._client
+        return getattr(client, attr)
@@ -1,34 +1,96 @@
-from bitcoin_exchanges.exchange_util import ExchangeError
-import requests
+import threading
+import time
+
 from requests.exceptions import Timeout, ConnectionError
 
+from bitcoin_exchanges.exchange_util import ExchangeError, fan_out
+from bitcoin_exchanges import transport
+
 
 baseURL = "https://shapeshift.io/"
+REQ_TIMEOUT = 10  # seconds
+RATE_TTL = 30  # seconds to cache rates and deposit limits for
+LOOKUP_WORKERS = 16  # pairs or deposits looked up at once
+POLL_INTERVAL = 10  # seconds, the quickest a deposit is polled
+MAX_POLL_INTERVAL = 300  # seconds, the slowest a deposit which is not changing is polled
+FINAL_STATUSES = ('complete', 'failed')
+
+_cache = {}
+_cache_lock = threading.Lock()
 
 
 def send_shapeshift(path, values=None, pog='get'):
     """Send message to URL and return response contents
     Raises ExchangeError"""
     url = baseURL + path
-    if pog == 'post':
-        try:
-            resp = requests.post(url, values).json()
-        except (ConnectionError, Timeout, ValueError) as e:
-            raise ExchangeError('shapeshift', '%s %s while sending %r' % (type(e), str(e), values))
-    else:
-        try:
-            resp = requests.get(url).json()
-        except (ConnectionError, Timeout, ValueError) as e:
-            raise ExchangeError('shapeshift', '%s %s while sending %r' % (type(e), str(e), values))
+    try:
+        if pog == 'post':
+            resp = transport.request('shapeshift', 'post', url, idempotent=False, data=values, timeout=REQ_TIMEOUT)
+        else:
+            resp = transport.request('shapeshift', 'get', url, timeout=REQ_TIMEOUT)
+        return transport.decode(resp)
+    except (ConnectionError, Timeout, ValueError) as e:
+        raise ExchangeError('shapeshift', '%s %s while sending %r' % (type(e), str(e), values))
+
+
+def send_cached(path, ttl=RATE_TTL):
+    """Get a path, reusing the response for ttl seconds."""
+    entry = _cache.get(path)
+    if entry is not None and entry[0] > time.time():
+        return entry[1]
+    resp = send_shapeshift(path)
+    with _cache_lock:
+        _cache[path] = (time.time() + ttl, resp)
     return resp
 
 
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
 def rate(pair='ltc_btc'):
-    return send_shapeshift('rate/%s' % pair)
+    return send_cached('rate/%s' % pair)
 
 
 def deposit_limit(pair='ltc_btc'):
-    return send_shapeshift('limit/%s' % pair)
+    return send_cached('limit/%s' % pair)
+
+
+def _lookup_all(lookup, pairs):
+    """Look up many pairs concurrently, keeping each pair's error instead of failing them all."""
+    pairs = list(pairs)
+    errors = {}
+
+    def lookup_one(pair):
+        try:
+            return lookup(pair)
+        except ExchangeError as e:
+            errors[pair] = e
+            return None
+
+    results = fan_out(lookup_one, pairs, workers=LOOKUP_WORKERS)
+    return dict((pair, resp) for pair, resp in zip(pairs, results) if pair not in errors), errors
+
+
+def rates(pairs):
+    """
+    Get the rates of many pairs concurrently.
+
+    :return: each pair's response by pair, and the ExchangeError of each pair which failed by pair
+    :rtype: tuple
+    """
+    return _lookup_all(rate, pairs)
+
+
+def deposit_limits(pairs):
+    """
+    Get the deposit limits of many pairs concurrently.
+
+    :return: each pair's response by pair, and the ExchangeError of each pair which failed by pair
+    :rtype: tuple
+    """
+    return _lookup_all(deposit_limit, pairs)
 
 
 def recent_transactions(maxt=10):
@@ -50,3 +112,91 @@ def get_quote(address, pair='ltc_btc', amount=None):
         values['amount'] = amount
         path = 'sendamount/'
     return send_shapeshift(path, values, pog='post')
+
+
+class DepositWatcher(object):
+    """
+    Poll the status of many shift deposit addresses concurrently, until each is complete or failed.
+
+    A deposit whose status has not changed is polled half as often each time, up to MAX_POLL_INTERVAL, so that
+    hundreds of idle shifts cost little. Each callback is called with the address and its txStat response whenever
+    the status changes. Addresses are dropped once their status is final.
+    """
+
+    def __init__(self, interval=POLL_INTERVAL, max_interval=MAX_POLL_INTERVAL, workers=LOOKUP_WORKERS):
+        """
+        :param int interval: the seconds between polls of a deposit which has just changed
+        :param int max_interval: the most seconds between polls of a deposit
+        :param int workers: the most deposits polled at once
+        """
+        self.interval = interval
+        self.max_interval = max_interval
+        self.workers = workers
+        self.subscribers = []
+        self.deposits = {}  # address: [last status, seconds between polls, time of the next poll]
+        self.errors = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def watch(self, address):
+        with self._lock:
+            self.deposits.setdefault(address, [None, self.interval, time.time()])
+
+    def unwatch(self, address):
+        with self._lock:
+            self.deposits.pop(address, None)
+
+    def poll_one(self, address):
+        """Get one deposit's status, and schedule its next poll."""
+        try:
+            resp = get_order_status(address)
+        except ExchangeError as e:
+            resp = None
+            self.errors[address] = e
+        with self._lock:
+            deposit = self.deposits.get(address)
+            if deposit is None:
+                return
+            status = resp.get('status') if isinstance(resp, dict) else None
+            changed = status is not None and status != deposit[0]
+            if changed:
+                self.errors.pop(address, None)
+                deposit[0], deposit[1] = status, self.interval
+                if status in FINAL_STATUSES:
+                    del self.deposits[address]
+            else:
+                deposit[1] = min(deposit[1] * 2, self.max_interval)
+            deposit[2] = time.time() + deposit[1]
+        if changed:
+            for callback in self.subscribers:
+                callback(address, resp)
+
+    def poll(self):
+        """Poll every deposit which is due, concurrently."""
+        now = time.time()
+        with self._lock:
+            due = [address for address, deposit in self.deposits.iteritems() if deposit[2] <= now]
+        fan_out(self.poll_one, due, workers=self.workers)
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='shapeshift-deposits')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.poll()
+            with self._lock:
+                next_poll = min([deposit[2] for deposit in self.deposits.itervalues()] or [time.time() + 1])
+            self._stop.wait(min(max(next_poll - time.time(), 0.1), 1))
@@ -1,21 +1,65 @@
 import hashlib
-import json
 import time
-import requests
+import urllib
 from requests.exceptions import Timeout, ConnectionError
 
 from moneyed.classes import Money, MultiMoney
 
-from exchange_util import ExchangeABC, create_ticker, ExchangeError, exchange_config, BLOCK_ORDERS, MyOrder
+from exchange_util import ExchangeABC, DefaultClient, create_ticker, ExchangeError, exchange_config, BLOCK_ORDERS, \
+    MyOrder, OrderTemplate
+from bitcoin_exchanges import transport
+from bitcoin_exchanges.order_rules import get_order_rules, set_reference_price
+from bitcoin_exchanges.symbols import get_symbol
 
 
 BASE_URL = 'https://api.huobi.com/apiv2.php'
+MARKET_URL = 'https://market.huobi.com/staticmarket/'
 REQ_TIMEOUT = 10  # seconds
 
 
+class HuobiOrderTemplate(OrderTemplate):
+    def __init__(self, exchange, otype):
+        super(HuobiOrderTemplate, self).__init__(exchange, otype)
+        if otype == 'bid':
+            self.side = 'buy'
+        elif otype == 'ask':
+            self.side = 'sell'
+        else:
+            raise Exception('unknown side %r' % otype)
+        # the params are signed in sorted order (see huobi_encode): access_key, amount, coin_type, created,
+        # method, price, secret_key
+        self.sign_head = 'access_key=%s&amount=' % exchange.key
+        self.sign_tail = '&secret_key=%s' % exchange.secret
+        self.data_head = 'access_key=%s&amount=' % urllib.quote_plus(exchange.key)
+        # huobi rejects whole numbers for hashing/auth reasons, which the rules nudge away from
+        self.rules = get_order_rules('huobi')
+
+    def submit(self, amount, price):
+        if self.rules.needs_reference():
+            # huobi rejects prices too far from the market, which the rules check against the last price
+            set_reference_price('huobi', None, self.exchange.get_ticker().last)
+        amount, price = self.rules.format(amount, price, self.otype)
+        if BLOCK_ORDERS:
+            return "order blocked"
+        params = {
+            'coin_type': 1,
+            'price': price,
+            'amount': amount,
+        }
+        middle = '%s&coin_type=1&created=%d&method=%s&price=%s' % (params['amount'], int(time.time()), self.side,
+                                                                  params['price'])
+        sign = hashlib.md5(''.join((self.sign_head, middle, self.sign_tail))).hexdigest().lower()
+        data = self.exchange.huobi_post(''.join((self.data_head, middle, '&sign=', sign)), params, idempotent=False)
+        if 'result' in data and 'uccess' in data['result']:
+            return str(data['id'])
+        raise ExchangeError('huobi', 'unable to create order %r response was %r' % (params, data))
+
+
 class Huobi(ExchangeABC):
     name = 'huobi'
     fiatcurrency = 'USD'
+    hosts = ('api.huobi.com', 'market.huobi.com')
+    order_template = HuobiOrderTemplate
 
     def __init__(self, key, secret):
         super(Huobi, self).__init__()
@@ -23,11 +67,9 @@ class Huobi(ExchangeABC):
         self.secret = secret
 
     def huobi_encode(self, params):
-        postData = ''
         params['secret_key'] = self.secret
-        for k in sorted(params.keys()):
-            postData += '%s=%s&' % (k, params[k])
-        return hashlib.md5(postData[0:-1]).hexdigest().lower()
+        postData = '&'.join(['%s=%s' % (k, params[k]) for k in sorted(params)])
+        return hashlib.md5(postData).hexdigest().lower()
 
     def huobi_request(self, endpoint, params=None):
         params = params or {}
@@ -37,19 +79,27 @@ class Huobi(ExchangeABC):
         params['sign'] = self.huobi_encode(params)
         if 'secret_key' in params:
             del params['secret_key']
-
+        return self.huobi_post(params, params)
+
+    def huobi_post(self, data, params, idempotent=True):
+        """
+        :param data: the signed request body, as a dict or an encoded string
+        :param dict params: the request params, for error messages
+        :param bool idempotent: False if the request is not safe to repeat, like an order
+        """
         headers = {'contentType': 'application/x-www-form-urlencoded'}
         try:
-            response = requests.post(url=BASE_URL,
-                                     data=params,
-                                     headers=headers,
-                                     timeout=REQ_TIMEOUT)
+            response = transport.request('huobi', 'post', BASE_URL,
+                                         private=True, idempotent=idempotent, account_id=self.account_id,
+                                         data=data,
+                                         headers=headers,
+                                         timeout=REQ_TIMEOUT)
         except (ConnectionError, Timeout) as e:
             raise ExchangeError('huobi', '%s error while sending %r' % (str(e), params))
         if response.status_code != 200:
             raise ExchangeError('huobi', '%s while sending %r' % (str(response['error_code']), params))
         try:
-            resp = json.loads(response.text)
+            resp = transport.decode(response)
         except ValueError as e:
             raise ExchangeError('huobi', '%s error while sending %r, '
                                          'response is: %s' % (type(e), params, response.text))
@@ -79,33 +129,7 @@ class Huobi(ExchangeABC):
     def create_order(self, amount, price, otype):
         if BLOCK_ORDERS:
             return "order blocked"
-        if otype == 'bid':
-            otype = 'buy'
-        elif otype == 'ask':
-            otype = 'sell'
-        else:
-            raise Exception('unknown side %r' % otype)
-
-        # avoid round numbers to prevent hashing/auth issues
-        price = float(price)
-        amount = float(amount)
-        if round(price) == price:
-            if otype == 'buy':
-                price -= 0.01
-            else:
-                price += 0.01
-        if round(amount) == amount:
-            amount += 0.001
-
-        params = {
-            'coin_type': 1,
-            'price': round(price, 2),
-            'amount': round(amount, 4),
-        }
-        data = self.huobi_request(otype, params)
-        if 'result' in data and 'uccess' in data['result']:
-            return str(data['id'])
-        raise ExchangeError('huobi', 'unable to create order %r response was %r' % (params, data))
+        return self.prepare_order(otype).submit(amount, price)
 
     def get_balance(self, btype='total'):
         data = self.huobi_request('get_account_info')
@@ -128,30 +152,42 @@ class Huobi(ExchangeABC):
         return orders
 
     @classmethod
-    def get_order_book(cls, pair='btc_usd', **kwargs):
+    def book_request(cls, symbol, depth=None):
+        return MARKET_URL + 'depth_%s_json.js' % symbol.url, {}, ()
+
+    @classmethod
+    def get_order_book(cls, pair='BTC/CNY', depth=None, group=None, **kwargs):
+        url, params, path = cls.book_request(get_symbol(cls.name, pair), depth)
         try:
-            return requests.get('https://market.huobi.com/staticmarket/depth_btc_json.js', timeout=REQ_TIMEOUT).json()
-        except ValueError as e:
+            book = transport.decode(transport.request('huobi', 'get', url, params=params, timeout=REQ_TIMEOUT))
+        except (ConnectionError, Timeout, ValueError) as e:
             raise ExchangeError('huobi', '%s %s while sending get_order_book' % (type(e), str(e)))
+        return cls.limit_book(book, depth, group)
 
     @classmethod
-    def get_ticker(cls, pair='btc_usd'):
+    def get_ticker(cls, pair='BTC/CNY'):
+        symbol = get_symbol(cls.name, pair)
         try:
-            rawtick = requests.get('https://market.huobi.com/staticmarket/ticker_btc_json.js',
-                                   timeout=REQ_TIMEOUT).json()
+            rawtick = transport.decode(transport.request('huobi', 'get', MARKET_URL + 'ticker_%s_json.js' % symbol.url,
+                                                         timeout=REQ_TIMEOUT))
         except (ConnectionError, Timeout, ValueError) as e:
             raise ExchangeError('huobi', '%s %s while sending get_ticker to huobi' % (type(e), str(e)))
 
         return create_ticker(bid=rawtick['ticker']['buy'], ask=rawtick['ticker']['sell'],
                              high=rawtick['ticker']['high'], low=rawtick['ticker']['low'],
                              volume=rawtick['ticker']['vol'], last=rawtick['ticker']['last'],
-                             timestamp=time.time(), currency='CNY')
+                             timestamp=time.time(), currency=symbol.quote, base=symbol.base)
 
     def get_transactions(self, limit=None):
         # huobi appears not to support get_transactions
         return []
 
-    def get_deposit_address(self):
+    def get_fills(self, since=None):
+        # huobi appears not to support trade history either
+        return []
+
+    def get_deposit_address(self, currency='BTC'):
+        self.check_deposit_currency(currency)
         return exchange_config['huobi']['address']
 
 
@@ -194,5 +230,4 @@ error_codes = {
 
 
 eclass = Huobi
-exchange = Huobi(exchange_config['huobi']['api_creds']['key'],
-                 exchange_config['huobi']['api_creds']['secret'])
+exchange = DefaultClient('huobi')
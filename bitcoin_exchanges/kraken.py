@@ -1,77 +1,128 @@
 import base64
 import copy
 import hashlib
-import hmac
-import json
-import requests
 import urllib
 from requests.exceptions import Timeout, ConnectionError
 from moneyed import MultiMoney, Money
 
-from exchange_util import exchange_config, ExchangeABC, ExchangeError, create_ticker, BLOCK_ORDERS, MyOrder
+from exchange_util import exchange_config, ExchangeABC, DefaultClient, ExchangeError, create_ticker, BLOCK_ORDERS, \
+    MyOrder, Fill, fan_out, HmacSigner, OrderTemplate, Trade, DepositAddress
+from bitcoin_exchanges import transport
+from bitcoin_exchanges.order_rules import get_order_rules
+from bitcoin_exchanges.symbols import get_symbol
 
 import time
 
 
 baseUrl = 'https://api.kraken.com'
 REQ_TIMEOUT = 10  # seconds
+FILL_PAGE_SIZE = 50  # fixed by kraken
 
 
 def adjust_pair(pair):
     """
-    The pair can be specified either in the "kraken" format
+    The pair can be specified in the canonical format (e.g. BTC/USD), the "kraken" format
     (e.g. XXBTZUSD) or in the "bitfinex" format (e.g. btcusd).
 
     :return: a pair formated according to what kraken expects.
     """
-    if pair[0] != 'X':
-        half1 = pair[:3].upper()
-        if half1 == 'BTC':
-            half1 = 'XBT'
-        pair = 'X%sZ%s' % (half1, pair[3:].upper())
-    return pair
+    return get_symbol('kraken', pair).native
+
+
+class KrakenOrderTemplate(OrderTemplate):
+    path = '/0/private/AddOrder'
+
+    def __init__(self, exchange, otype, pair='BTC/EUR', **kwargs):
+        super(KrakenOrderTemplate, self).__init__(exchange, otype, pair=pair, **kwargs)
+        self.options = {'type': 'buy' if otype == 'bid' else 'sell', 'pair': get_symbol('kraken', pair).native,
+                        'ordertype': 'limit'}
+        self.options.update(kwargs)
+        self.rules = get_order_rules('kraken', pair)
+        self.data_head = urllib.urlencode(self.options)
+
+    def submit(self, amount, price):
+        amount, price = self.rules.format(amount, price, self.otype)
+        if BLOCK_ORDERS:
+            return "order blocked"
+
+        def sign():
+            nonce = self.exchange.time_nonce(1000)
+            data = '%s&volume=%s&price=%s&nonce=%d' % (self.data_head, amount, price, nonce)
+            return data, self.exchange.kraken_sign(self.path, nonce, data)
+
+        options = dict(self.options, volume=amount, price=price)
+        resp = self.exchange.kraken_post(self.path, sign, options, idempotent=False)
+        if 'error' in resp and len(resp['error']) > 0:
+            raise ExchangeError('kraken', 'unable to create order %r for reason %r' % (options, resp['error']))
+        elif 'result' in resp and 'txid' in resp['result'] and len(resp['result']['txid']) > 0:
+            return str(resp['result']['txid'][0])
 
 
 class Kraken(ExchangeABC):
     name = 'kraken'
     fiatcurrency = 'EUR'
+    hosts = ('api.kraken.com',)
+    order_template = KrakenOrderTemplate
 
     def __init__(self, key, secret):
         super(Kraken, self).__init__()
         self.key = key
         self.secret = secret
+        # kraken secrets are base64 encoded, so decode once instead of on every request
+        self.signer = HmacSigner(base64.b64decode(secret), hashlib.sha512)
 
-    def submit_private_request(self, method, params=None, retry=0):
-        """Submit request to Kraken"""
-        if not params:
-            params = {}
-        path = '/0/private/%s' % method
-
-        params['nonce'] = int(time.time() * 1000)
-        data = urllib.urlencode(params)
-        message = path + hashlib.sha256(str(params['nonce']) + data).digest()
-        sign = base64.b64encode(hmac.new(base64.b64decode(self.secret),
-                                         message, hashlib.sha512).digest())
-        headers = {
+    def kraken_sign(self, path, nonce, data):
+        """
+        :return: the headers for a private request
+        """
+        payload_hash = hashlib.sha256(str(nonce))
+        payload_hash.update(data)
+        return {
             'API-Key': self.key,
-            'API-Sign': sign
+            'API-Sign': base64.b64encode(self.signer.digest(path, payload_hash.digest()))
         }
+
+    def kraken_encode(self, path, params):
+        """
+        :return: the urlencoded request body and its headers
+        """
+        params['nonce'] = self.time_nonce(1000)
+        data = urllib.urlencode(params)
+        return data, self.kraken_sign(path, params['nonce'], data)
+
+    def kraken_post(self, path, sign, params, idempotent=True):
+        """
+        :param sign: returns a freshly signed request body and its headers, called again for each retry
+        :param dict params: the request params, for error messages
+        :param bool idempotent: False if the request is not safe to repeat, like an order
+        """
+        def sign_kwargs():
+            data, headers = sign()
+            return {'data': data, 'headers': headers}
+
         try:
-            response = json.loads(requests.post(baseUrl + path, data=data, headers=headers,
-                                                timeout=REQ_TIMEOUT).text)
+            return transport.decode(transport.request('kraken', 'post', baseUrl + path,
+                                                      private=True, idempotent=idempotent, sign=sign_kwargs,
+                                                      account_id=self.account_id,
+                                                      retry_if=lambda r: 'EAPI:Invalid nonce' in r.content,
+                                                      timeout=REQ_TIMEOUT))
         except (ConnectionError, Timeout, ValueError) as e:
             raise ExchangeError('kraken', '%s %s while sending %r to %s' % (type(e), e, params, path))
-        if "Invalid nonce" in response and retry < 3:
-            return self.submit_private_request(method, params=params, retry=retry + 1)
-        else:
-            return response
+
+    def submit_private_request(self, method, params=None):
+        """Submit request to Kraken"""
+        if not params:
+            params = {}
+        path = '/0/private/%s' % method
+        return self.kraken_post(path, lambda: self.kraken_encode(path, params), params)
 
     @classmethod
     def submit_public_request(cls, method, params=None):
         path = '/0/public/%s' % method
         data = urllib.urlencode(params)
         try:
-            return json.loads(requests.get(baseUrl + path + "?" + data, timeout=REQ_TIMEOUT).text)
+            return transport.decode(transport.request('kraken', 'get', baseUrl + path + "?" + data,
+                                                      timeout=REQ_TIMEOUT))
         except (ConnectionError, Timeout, ValueError) as e:
             raise ExchangeError('btce', '%s %s while sending %r to %s' % (type(e), e, params, path))
 
@@ -79,6 +130,12 @@ class Kraken(ExchangeABC):
     def get_time(cls):
         return cls.submit_public_request('Time')
 
+    @classmethod
+    def heartbeat(cls):
+        resp = cls.get_time()
+        if len(resp['error']) > 0:
+            raise ExchangeError('kraken', resp['error'])
+
     @classmethod
     def get_info(cls):
         return cls.submit_public_request('Assets')
@@ -88,30 +145,71 @@ class Kraken(ExchangeABC):
         return cls.submit_public_request('AssetPairs')
 
     @classmethod
-    def get_ticker(cls, pair='XXBTZEUR'):
-        pair = adjust_pair(pair)
-        fullticker = cls.submit_public_request('Ticker', {'pair': pair})
-        ticker = fullticker['result'][pair]
-        return create_ticker(ask=ticker['a'][0], bid=ticker['b'][0], timestamp=time.time(), volume=ticker['v'][1],
-                             last=ticker['c'][0], high=ticker['h'][1], low=ticker['l'][1], currency='EUR')
+    def get_ticker(cls, pair='BTC/EUR'):
+        return cls.get_tickers([pair])[pair]
+
+    @classmethod
+    def get_tickers(cls, pairs):
+        symbols = dict((pair, get_symbol(cls.name, pair)) for pair in pairs)
+        natives = sorted(set(symbol.native for symbol in symbols.values()))
+        fullticker = cls.submit_public_request('Ticker', {'pair': ','.join(natives)})
+        if len(fullticker.get('error', [])) > 0:
+            raise ExchangeError('kraken', 'unable to get tickers for %r: %r' % (natives, fullticker['error']))
+        now = time.time()
+        tickers = {}
+        for pair, symbol in symbols.iteritems():
+            ticker = fullticker['result'][symbol.native]
+            tickers[pair] = create_ticker(ask=ticker['a'][0], bid=ticker['b'][0], timestamp=now,
+                                          volume=ticker['v'][1], last=ticker['c'][0], high=ticker['h'][1],
+                                          low=ticker['l'][1], currency=symbol.quote, base=symbol.base)
+        return tickers
 
     @classmethod
     def get_ohlc(cls, pair):
-        return cls.submit_public_request(method='OHLC', params={'pair': pair})
+        return cls.submit_public_request(method='OHLC', params={'pair': get_symbol(cls.name, pair).native})
+
+    @classmethod
+    def book_request(cls, symbol, depth=None):
+        params = {'pair': symbol.native}
+        if depth is not None:
+            params['count'] = depth
+        return baseUrl + '/0/public/Depth', params, ('result', symbol.native)
 
     @classmethod
-    def get_order_book(cls, pair='XXBTZEUR'):
-        pair = adjust_pair(pair)
-        book = cls.submit_public_request('Depth', {'pair': pair})
-        return book['result'][pair]
+    def get_order_book(cls, pair='BTC/EUR', depth=None, group=None):
+        url, params, path = cls.book_request(get_symbol(cls.name, pair), depth if group is None else None)
+        try:
+            book = transport.decode(transport.request('kraken', 'get', url, params=params, timeout=REQ_TIMEOUT))
+        except (ConnectionError, Timeout, ValueError) as e:
+            raise ExchangeError('kraken', '%s %s while sending get_order_book' % (type(e), e))
+        if len(book.get('error', [])) > 0:
+            raise ExchangeError('kraken', 'unable to get order book: %r' % book['error'])
+        for key in path:
+            book = book[key]
+        return cls.limit_book(book, depth, group)
 
     @classmethod
-    def get_trades(cls, pair):
-        return cls.submit_public_request('Trades', {'pair': pair})
+    def get_trades(cls, pair, since=None):
+        params = {'pair': get_symbol(cls.name, pair).native}
+        if since is not None:
+            params['since'] = since
+        return cls.submit_public_request('Trades', params)
 
     @classmethod
-    def get_spread(cls, pair='XXBTZEUR'):
-        return cls.submit_public_request('Spread', {'pair': pair})
+    def get_public_trades(cls, pair='BTC/EUR', since=None):
+        symbol = get_symbol(cls.name, pair)
+        # kraken's cursor is the trade time in nanoseconds
+        resp = cls.get_trades(symbol.pair, since=int(since.timestamp * 10 ** 9) if since is not None else None)
+        if len(resp.get('error', [])) > 0:
+            raise ExchangeError('kraken', 'unable to get trades: %r' % resp['error'])
+        # kraken trades have no id, so one is made from the time, price and volume
+        return [Trade(cls.name, '%s-%s-%s' % (t[2], t[0], t[1]), 'bid' if t[3] == 'b' else 'ask',
+                      Money(t[0], symbol.quote), Money(t[1], symbol.base), float(t[2]))
+                for t in resp['result'][symbol.native]]
+
+    @classmethod
+    def get_spread(cls, pair='BTC/EUR'):
+        return cls.submit_public_request('Spread', {'pair': get_symbol(cls.name, pair).native})
 
     # private methods
     def cancel_order(self, oid):
@@ -129,21 +227,10 @@ class Kraken(ExchangeABC):
                 success = False
         return success
 
-    def create_order(self, amount, price, otype, pair='XXBTZEUR', **kwargs):
+    def create_order(self, amount, price, otype, pair='BTC/EUR', **kwargs):
         if BLOCK_ORDERS:
             return "order blocked"
-        otype = 'buy' if otype == 'bid' else 'sell'
-        if not isinstance(amount, str):
-            amount = str(amount)
-        if not isinstance(price, str):
-            price = str(price)
-        options = {'type': otype, 'volume': amount, 'price': price, 'pair': pair, 'ordertype': 'limit'}
-        options.update(kwargs)
-        resp = self.submit_private_request('AddOrder', options)
-        if 'error' in resp and len(resp['error']) > 0:
-            raise ExchangeError('kraken', 'unable to create order %r for reason %r' % (options, resp['error']))
-        elif 'result' in resp and 'txid' in resp['result'] and len(resp['result']['txid']) > 0:
-            return str(resp['result']['txid'][0])
+        return self.prepare_order(otype, pair=get_symbol(self.name, pair).pair, **kwargs).submit(amount, price)
 
     def get_closed_orders(self):
         return self.submit_private_request('ClosedOrders', {'trades': 'True'})
@@ -200,6 +287,29 @@ class Kraken(ExchangeABC):
 
     get_transactions = get_trades_hstory
 
+    def get_fills(self, since=None):
+        params = {'trades': 'True'}
+        if since is not None:
+            params['start'] = since.fill_id  # exclusive
+
+        def get_page(ofs):
+            page = self.submit_private_request('TradesHistory', dict(params, ofs=ofs))
+            if len(page['error']) > 0:
+                raise ExchangeError('kraken', 'unable to get fills: %r' % page['error'])
+            return page['result']
+
+        first = get_page(0)
+        pages = [first] + fan_out(get_page, range(FILL_PAGE_SIZE, int(first['count']), FILL_PAGE_SIZE))
+        fills = []
+        for page in pages:
+            for txid, t in page['trades'].iteritems():
+                side = 'bid' if t['type'] == 'buy' else 'ask'
+                fiat = t['pair'][-3:]
+                fills.append(Fill(self.name, str(txid), str(t['ordertxid']), side, Money(t['price'], fiat),
+                                  Money(t['vol']), Money(t['fee'], fiat), float(t['time'])))
+        fills.sort(key=lambda f: f.timestamp)
+        return fills
+
     def get_open_positions(self, list_of_txids=None, docalcs=True):
         """
         :param list list_of_txids:
@@ -222,7 +332,8 @@ class Kraken(ExchangeABC):
     def get_deposit_methods(self):
         return self.submit_private_request('DepositMethods', {'asset': 'BTC'})
 
-    def get_deposit_address(self):
+    def get_deposit_address(self, currency='BTC'):
+        self.check_deposit_currency(currency)
         addys = self.submit_private_request('DepositAddresses', {'asset': 'BTC', 'method': 'Bitcoin'})
         if len(addys['error']) > 0:
             raise ExchangeError('kraken', addys['error'])
@@ -231,6 +342,17 @@ class Kraken(ExchangeABC):
                 return str(addy['address'])
         raise ExchangeError('kraken', "unable to get deposit address")
 
+    def get_deposit_addresses(self, new=False, currency='BTC'):
+        self.check_deposit_currency(currency)
+        params = {'asset': 'BTC', 'method': 'Bitcoin'}
+        if new:
+            params['new'] = 'true'
+        addys = self.submit_private_request('DepositAddresses', params)
+        if len(addys['error']) > 0:
+            raise ExchangeError('kraken', addys['error'])
+        # an expiretm of 0 is an address which never expires
+        return [DepositAddress(self.name, str(addy['address']), int(addy['expiretm']) or None)
+                for addy in addys['result']]
+
 eclass = Kraken
-exchange = Kraken(key=exchange_config['kraken']['api_creds']['key'],
-                  secret=exchange_config['kraken']['api_creds']['secret'])
+exchange = DefaultClient('kraken')
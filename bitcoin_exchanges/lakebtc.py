@@ -1,65 +1,112 @@
 import base64
 import hashlib
-import hmac
 import json
-import requests
 from requests.exceptions import Timeout, ConnectionError
 
 from moneyed.classes import Money, MultiMoney
 import time
 
-from exchange_util import ExchangeABC, create_ticker, ExchangeError, exchange_config, BLOCK_ORDERS, MyOrder
+from exchange_util import ExchangeABC, DefaultClient, create_ticker, ExchangeError, exchange_config, BLOCK_ORDERS, \
+    MyOrder, Fill, HmacSigner, OrderTemplate
+from bitcoin_exchanges import transport
+from bitcoin_exchanges.order_rules import get_order_rules
+from bitcoin_exchanges.symbols import get_symbol
 
 
 BASE_URL = 'https://www.lakebtc.com/api_v1/'
 REQ_TIMEOUT = 10  # seconds
 
 
+class LakebtcOrderTemplate(OrderTemplate):
+    def __init__(self, exchange, otype, symbol='BTC/CNY'):
+        super(LakebtcOrderTemplate, self).__init__(exchange, otype, symbol=symbol)
+        self.currency = get_symbol('lakebtc', symbol).quote
+        if otype == 'bid':
+            self.method = 'buyOrder'
+        elif otype == 'ask':
+            self.method = 'sellOrder'
+        else:
+            raise Exception('unknown side %r' % otype)
+        # see lakebtc_encode
+        self.sign_middle = "&accesskey=%s&requestmethod=post&id=1&method=%s&params=" % (exchange.key, self.method)
+        self.data_head = '{"method": "%s", "requestmethod": "post", "id": 1, "params": ["' % self.method
+        self.data_tail = '", "%s"], "tonce": ' % self.currency
+        self.auth_head = '%s:' % exchange.key
+        self.rules = get_order_rules('lakebtc', symbol)
+
+    def submit(self, amount, price):
+        amount, price = self.rules.format(amount, price, self.otype)
+        if BLOCK_ORDERS:
+            return "order blocked"
+        tonce = str(self.exchange.time_nonce(1000000))
+        signature = self.exchange.signer.hexdigest('tonce=', tonce, self.sign_middle,
+                                                   ','.join((price, amount, self.currency)))
+        headers = {'Authorization': 'Basic %s' % base64.b64encode(self.auth_head + signature),
+                   'Json-Rpc-Tonce': tonce}
+        params = {'params': [price, amount, self.currency]}
+        data = self.exchange.lakebtc_post(''.join((self.data_head, price, '", "', amount, self.data_tail, tonce, '}')),
+                                          headers, params, idempotent=False)
+        if 'id' in data:
+            return str(data['id'])
+        raise ExchangeError('lakebtc', 'unable to create order %r response was %r' % (params, data))
+
+
 class Lakebtc(ExchangeABC):
     name = 'lakebtc'
     fiatcurrency = 'CNY'
+    hosts = ('www.lakebtc.com',)
+    order_template = LakebtcOrderTemplate
 
     def __init__(self, key, secret):
         super(Lakebtc, self).__init__()
         self.key = key
         self.secret = secret
+        self.signer = HmacSigner(secret, hashlib.sha1)
 
     def lakebtc_encode(self, params):
         mess = "tonce=%d&accesskey=%s&requestmethod=post&id=%d&method=%s&params=%s" % \
                (params['tonce'], self.key, 1, params['method'], ",".join(params['params']))
-        result = hmac.new(self.secret, mess, hashlib.sha1).hexdigest()
-        return result
+        return self.signer.hexdigest(mess)
 
     def lakebtc_request(self, method, params=None):
         if params is None:
             params = {'params': []}
         params['method'] = method
-        params['tonce'] = int(time.time() * 1000000)
+        params['tonce'] = self.time_nonce(1000000)
         params['requestmethod'] = 'post'
         params['id'] = 1
 
         auth_string = 'Basic %s' % base64.b64encode("%s:%s" % (self.key, self.lakebtc_encode(params)))
         headers = {'Authorization': auth_string, 'Json-Rpc-Tonce': params['tonce']}
+        return self.lakebtc_post(json.dumps(params), headers, params)
+
+    def lakebtc_post(self, data, headers, params, idempotent=True):
+        """
+        :param str data: the json-rpc request body
+        :param dict params: the request params, for error messages
+        :param bool idempotent: False if the request is not safe to repeat, like an order
+        """
         try:
-            response = requests.post(url=BASE_URL,
-                                     data=json.dumps(params),
-                                     headers=headers,
-                                     timeout=REQ_TIMEOUT)
+            response = transport.request('lakebtc', 'post', BASE_URL,
+                                         private=True, idempotent=idempotent, account_id=self.account_id,
+                                         data=data,
+                                         headers=headers,
+                                         timeout=REQ_TIMEOUT)
         except (ConnectionError, Timeout, ValueError) as e:
             raise ExchangeError('lakebtc', '%s %s while sending %r' % (type(e), str(e), params))
         if response.status_code == 200:
-            return response.json()
+            return transport.decode(response)
         else:
             raise ExchangeError('lakebtc', '%s %s while sending %r' % (response.status_code, response.text, params))
 
-    def cancel_order(self, order_id, symbol='btc_cny'):
+    def cancel_order(self, order_id, symbol='BTC/CNY'):
         params = {'params': [order_id]}
         resp = self.lakebtc_request('cancelOrder', params)
         if resp and 'result' in resp:
             return resp['result']
         return False
 
-    def cancel_orders(self, symbol='btc_cny', **kwargs):
+    def cancel_orders(self, symbol='BTC/CNY', **kwargs):
         oorders = self.get_open_orders(symbol)
         canceled = True
         for o in oorders:
@@ -68,23 +115,10 @@ class Lakebtc(ExchangeABC):
                 canceled = False
         return canceled
 
-    def create_order(self, amount, price, otype, symbol='btc_cny'):
+    def create_order(self, amount, price, otype, symbol='BTC/CNY'):
         if BLOCK_ORDERS:
             return "order blocked"
-        if otype == 'bid':
-            otype = 'buyOrder'
-        elif otype == 'ask':
-            otype = 'sellOrder'
-        else:
-            raise Exception('unknown side %r' % otype)
-
-        params = {
-            'params': ["{:0.2f}".format(float(price)), "{:0.3f}".format(float(amount)), self.fiatcurrency]
-        }
-        data = self.lakebtc_request(otype, params)
-        if 'id' in data:
-            return str(data['id'])
-        raise ExchangeError('lakebtc', 'unable to create order %r response was %r' % (params, data))
+        return self.prepare_order(otype, symbol=get_symbol(self.name, symbol).pair).submit(amount, price)
 
     def get_balance(self, btype='total'):
         data = self.lakebtc_request('getAccountInfo')
@@ -108,7 +142,7 @@ class Lakebtc(ExchangeABC):
                 unavailable += o.price * o.amount.amount
         return unavailable
 
-    def get_open_orders(self, symbol='btc_usd'):
+    def get_open_orders(self, symbol='BTC/CNY'):
         rawos = self.lakebtc_request('getOrders')
         orders = []
         for o in rawos:
@@ -118,25 +152,32 @@ class Lakebtc(ExchangeABC):
         return orders
 
     @classmethod
-    def get_order_book(cls, pair='btc_cny', **kwargs):
+    def book_request(cls, symbol, depth=None):
+        return BASE_URL + symbol.url, {}, ()
+
+    @classmethod
+    def get_order_book(cls, pair='BTC/CNY', depth=None, group=None, **kwargs):
+        url, params, path = cls.book_request(get_symbol(cls.name, pair), depth)
         try:
-            return requests.get(BASE_URL + 'bcorderbook_cny', timeout=REQ_TIMEOUT).json()
+            book = transport.decode(transport.request('lakebtc', 'get', url, params=params, timeout=REQ_TIMEOUT))
         except (ConnectionError, Timeout, ValueError) as e:
             raise ExchangeError('lakebtc', '%s %s while sending get_order_book' % (type(e), str(e)))
+        return cls.limit_book(book, depth, group)
 
     @classmethod
-    def get_ticker(cls, pair='btc_cny'):
+    def get_ticker(cls, pair='BTC/CNY'):
+        quote = get_symbol(cls.name, pair).quote
         try:
-            rawtick = requests.get(BASE_URL + 'ticker', timeout=REQ_TIMEOUT).json()
+            rawtick = transport.decode(transport.request('lakebtc', 'get', BASE_URL + 'ticker', timeout=REQ_TIMEOUT))
         except (ConnectionError, Timeout, ValueError) as e:
             raise ExchangeError('lakebtc', '%s %s while sending get_ticker to lakebtc' % (type(e), str(e)))
 
-        return create_ticker(bid=rawtick['CNY']['bid'], ask=rawtick['CNY']['ask'],
-                             high=rawtick['CNY']['high'], low=rawtick['CNY']['low'],
-                             volume=rawtick['CNY']['volume'], last=rawtick['CNY']['last'],
-                             timestamp=time.time(), currency='CNY')
+        return create_ticker(bid=rawtick[quote]['bid'], ask=rawtick[quote]['ask'],
+                             high=rawtick[quote]['high'], low=rawtick[quote]['low'],
+                             volume=rawtick[quote]['volume'], last=rawtick[quote]['last'],
+                             timestamp=time.time(), currency=quote)
 
-    def get_transactions(self, limit=None, status=1, current_page=1, page_length=200, symbol='btc_cny', timestamp=None):
+    def get_transactions(self, limit=None, status=1, current_page=1, page_length=200, symbol='BTC/CNY', timestamp=None):
         """
 
         :param limit:
@@ -155,11 +196,29 @@ class Lakebtc(ExchangeABC):
             return resp
         raise ExchangeError('lakebtc', 'unable to get transactions. response was %r' % resp)
 
-    def get_deposit_address(self):
+    def get_fills(self, since=None):
+        """
+        LakeBTC trades carry no id, so fills are identified by their time, side and amount.
+        """
+        timestamp = int(since.timestamp) if since is not None else 0
+        fills = []
+        for t in self.get_transactions(timestamp=timestamp):
+            if t['symbol'] != 'BTC':
+                continue
+            side = 'bid' if t['type'] == 'buy' else 'ask'
+            amount = abs(float(t['amount']))
+            price = abs(float(t['total'])) / amount if amount else 0
+            fills.append(Fill(self.name, '%s-%s-%s' % (t['at'], t['type'], t['amount']), None, side,
+                              Money(price, self.fiatcurrency), Money(amount), Money(0, self.fiatcurrency),
+                              float(t['at'])))
+        fills.sort(key=lambda f: f.timestamp)
+        return fills
+
+    def get_deposit_address(self, currency='BTC'):
+        self.check_deposit_currency(currency)
         data = self.lakebtc_request('getAccountInfo')
         return str(data['profile']['btc_deposit_addres'])
 
 
 eclass = Lakebtc
-exchange = Lakebtc(exchange_config['lakebtc']['api_creds']['key'],
-                   exchange_config['lakebtc']['api_creds']['secret'])
+exchange = DefaultClient('lakebtc')
@@ -0,0 +1,240 @@
+"""
+Positions and PnL, kept up to date one fill at a time.
+
+A Ledger holds a Position for each exchange and pair, built from Fills as they arrive (e.g. from TradeSync), so
+reporting never replays the fill history. A fill changes a handful of running totals: the position, its cost at
+average price, the realized PnL and the fees by currency. The totals are fixed-point integers (see parse_pool), as
+in trade_tape, which keeps applying a fill cheap.
+
+Unrealized PnL is worked out when a report is made, by marking each position at its exchange's last price. A
+snapshot of the totals can be saved and restored, so a restarted process only needs the fills made since.
+"""
+from collections import namedtuple
+import importlib
+import json
+import os
+import threading
+
+from bitcoin_exchanges.accounts import get_market_data_cache
+from bitcoin_exchanges.exchange_util import ExchangeError, fan_out
+from bitcoin_exchanges.parse_pool import SCALE, from_fixed, to_fixed
+
+# Decimals in the quote currency, except amount in the base. pnl is realized plus unrealized, less the fees at the
+# mark price. mark, unrealized and pnl are None without a mark price.
+PositionReport = namedtuple('PositionReport', ['exchange', 'pair', 'amount', 'average_cost', 'realized', 'fees',
+                                               'mark', 'unrealized', 'pnl'])
+
+
+def _from_cost(value):
+    """A fixed-point product (units of 1 / SCALE ** 2) as a Decimal, rounded to SCALE_DIGITS."""
+    return from_fixed((value + SCALE // 2) // SCALE)
+
+
+class Position(object):
+    """The running totals of one pair on one exchange, in fixed-point."""
+
+    __slots__ = ('base', 'quote', 'amount', 'cost', 'realized', 'fees', 'fills', 'last_fill_id', 'last_timestamp')
+
+    def __init__(self, base, quote):
+        self.base = base
+        self.quote = quote
+        self.amount = 0  # signed: negative when short
+        self.cost = 0  # what the open amount cost, signed like it, in units of 1 / SCALE ** 2
+        self.realized = 0  # in units of 1 / SCALE ** 2
+        self.fees = {}  # by currency
+        self.fills = 0
+        self.last_fill_id = None
+        self.last_timestamp = None
+
+    def add(self, side, price, amount, fee=0, fee_currency=None):
+        """
+        :param str side: 'bid' or 'ask'
+        :param int price: the fill price, in fixed-point
+        :param int amount: the amount filled, in fixed-point
+        :param int fee: the fee, in fixed-point
+        """
+        signed = amount if side == 'bid' else -amount
+        if self.amount and (self.amount > 0) != (signed > 0):
+            closed = min(amount, abs(self.amount))
+            closed_cost = abs(self.cost) * closed // abs(self.amount)
+            if self.amount > 0:
+                self.realized += price * closed - closed_cost
+                self.amount -= closed
+                self.cost -= closed_cost
+            else:
+                self.realized += closed_cost - price * closed
+                self.amount += closed
+                self.cost += closed_cost
+            signed += closed if signed < 0 else -closed
+        self.amount += signed
+        self.cost += price * signed
+        if fee:
+            self.fees[fee_currency] = self.fees.get(fee_currency, 0) + fee
+        self.fills += 1
+
+    def merge(self, other):
+        """Add another Position's totals to this one's."""
+        self.amount += other.amount
+        self.cost += other.cost
+        self.realized += other.realized
+        for currency, fee in other.fees.iteritems():
+            self.fees[currency] = self.fees.get(currency, 0) + fee
+        self.fills += other.fills
+
+    def report(self, exchange, mark=None):
+        """
+        :param Decimal mark: the price to value the open amount and base currency fees at
+        :rtype: PositionReport
+        """
+        fees = dict((currency, from_fixed(fee)) for currency, fee in self.fees.iteritems())
+        average = from_fixed(abs(self.cost) // abs(self.amount)) if self.amount else None
+        unrealized = pnl = None
+        if mark is not None:
+            mark_fixed = to_fixed(str(mark))
+            unrealized = mark_fixed * self.amount - self.cost
+            fee_cost = self.fees.get(self.quote, 0) * SCALE + self.fees.get(self.base, 0) * mark_fixed
+            pnl = _from_cost(self.realized + unrealized - fee_cost)
+            unrealized = _from_cost(unrealized)
+        return PositionReport(exchange, '%s/%s' % (self.base, self.quote), from_fixed(self.amount), average,
+                              _from_cost(self.realized), fees, mark, unrealized, pnl)
+
+    def snapshot(self):
+        """:rtype: dict"""
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    @classmethod
+    def restore(cls, snapshot):
+        """:rtype: Position"""
+        position = cls(snapshot['base'], snapshot['quote'])
+        for name in cls.__slots__:
+            setattr(position, name, snapshot[name])
+        return position
+
+
+class Ledger(object):
+    """Positions by exchange and pair, and their PnL in each quote currency."""
+
+    def __init__(self):
+        self.positions = {}  # (exchange, pair): Position
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def add(self, fill):
+        """
+        Apply one Fill. Fills must be applied once each, so feed the ledger from a deduplicating source such as
+        TradeSync.
+        """
+        base, quote = fill.amount.currency.code, fill.price.currency.code
+        key = (fill.exchange, '%s/%s' % (base, quote))
+        fee = fee_currency = None
+        if fill.fee is not None:
+            fee, fee_currency = to_fixed(str(abs(fill.fee.amount))), fill.fee.currency.code
+        price, amount = to_fixed(str(fill.price.amount)), to_fixed(str(fill.amount.amount))
+        with self._lock:
+            position = self.positions.get(key)
+            if position is None:
+                position = self.positions[key] = Position(base, quote)
+            position.add(fill.side, price, amount, fee, fee_currency)
+            position.last_fill_id, position.last_timestamp = fill.fill_id, fill.timestamp
+
+    def add_fills(self, fills):
+        """Apply Fills, oldest first."""
+        for fill in fills:
+            self.add(fill)
+
+    def position(self, exchange, pair):
+        """:rtype: Position"""
+        return self.positions.get((exchange, pair))
+
+    def marks(self):
+        """
+        Get the last price of every pair with a position, concurrently. The tickers are shared with AccountGroups
+        through the market data cache. Pairs whose ticker fails are left out, and their errors kept in self.errors.
+
+        :return: prices by (exchange, pair)
+        :rtype: dict
+        """
+        self.errors = {}
+        cache = get_market_data_cache()
+
+        def mark_one(key):
+            exchange, pair = key
+            eclass = importlib.import_module('bitcoin_exchanges.%s' % exchange).eclass
+            try:
+                return cache.get(lambda: eclass.get_ticker(pair), exchange, 'ticker', pair).last.amount
+            except ExchangeError as e:
+                self.errors[key] = e
+                return None
+
+        keys = list(self.positions)
+        return dict((key, mark) for key, mark in zip(keys, fan_out(mark_one, keys)) if mark is not None)
+
+    def report(self, marks=None):
+        """
+        :param dict marks: prices by (exchange, pair). Defaults to each exchange's last price, fetched now.
+        :return: a PositionReport for every exchange and pair
+        :rtype: list
+        """
+        if marks is None:
+            marks = self.marks()
+        with self._lock:
+            return [position.report(exchange, marks.get((exchange, pair))) for (exchange, pair), position in
+                    sorted(self.positions.iteritems())]
+
+    def aggregate(self, marks=None):
+        """
+        Each pair's positions netted across exchanges, and marked at the exchanges' average price.
+
+        :param dict marks: prices by (exchange, pair). Defaults to each exchange's last price, fetched now.
+        :return: a PositionReport by pair, with None for the exchange
+        :rtype: dict
+        """
+        if marks is None:
+            marks = self.marks()
+        totals = {}
+        prices = {}
+        with self._lock:
+            for (exchange, pair), position in self.positions.iteritems():
+                total = totals.get(pair)
+                if total is None:
+                    total = totals[pair] = Position(position.base, position.quote)
+                total.merge(position)
+                if (exchange, pair) in marks:
+                    prices.setdefault(pair, []).append(marks[(exchange, pair)])
+        return dict((pair, total.report(None, sum(prices[pair]) / len(prices[pair]) if pair in prices else None))
+                    for pair, total in totals.iteritems())
+
+    def snapshot(self):
+        """
+        :return: every position's totals, which can be saved as json
+        :rtype: dict
+        """
+        with self._lock:
+            return {'positions': [[exchange, pair, position.snapshot()] for (exchange, pair), position in
+                                  self.positions.iteritems()]}
+
+    @classmethod
+    def restore(cls, snapshot):
+        """:rtype: Ledger"""
+        ledger = cls()
+        for exchange, pair, position in snapshot['positions']:
+            ledger.positions[(exchange, pair)] = Position.restore(position)
+        return ledger
+
+    def save(self, path):
+        """Write a snapshot to a json file, replacing it atomically."""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        :return: the Ledger saved at path, or an empty one if there is no file
+        :rtype: Ledger
+        """
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            return cls.restore(json.load(f))
@@ -1,19 +1,68 @@
 import hashlib
-import requests
+import urllib
 from requests.exceptions import Timeout, ConnectionError
 
 from moneyed.classes import Money, MultiMoney
 
-from exchange_util import ExchangeABC, create_ticker, ExchangeError, exchange_config, BLOCK_ORDERS, MyOrder
+from exchange_util import ExchangeABC, DefaultClient, create_ticker, ExchangeError, exchange_config, BLOCK_ORDERS, \
+    MyOrder, Fill, fan_out, OrderTemplate, Trade
+from bitcoin_exchanges import transport
+from bitcoin_exchanges.order_rules import get_order_rules
+from bitcoin_exchanges.symbols import get_symbol
 
 
 BASE_URL = 'https://www.okcoin.com/api/v1/'
 REQ_TIMEOUT = 10  # seconds
+MAX_BOOK_SIZE = 200  # the most depth.do returns
+FILL_PAGE_SIZE = 200  # okcoin's maximum
+FILL_PAGE_BATCH = 4  # pages fetched concurrently once the first is known
+FILL_LOOKBACK = 86400  # seconds. Orders are listed when they complete, but dated when they were placed.
+
+
+class OKCoinOrderTemplate(OrderTemplate):
+    def __init__(self, exchange, otype, symbol='BTC/USD'):
+        super(OKCoinOrderTemplate, self).__init__(exchange, otype, symbol=symbol)
+        self.symbol = symbol = get_symbol('okcoin', symbol).native
+        if otype == 'bid':
+            self.side = 'buy'
+        elif otype == 'ask':
+            self.side = 'sell'
+        else:
+            raise Exception('unknown side %r' % otype)
+        # the params are signed in sorted order (see okcoin_encode): amount, partner, price, symbol, type
+        self.sign_middle = '&partner=%s&price=' % exchange.partner
+        self.sign_tail = '&symbol=%s&type=%s&secret_key=%s' % (symbol, self.side, exchange.secret)
+        self.data_middle = '&partner=%s&price=' % urllib.quote_plus(exchange.partner)
+        self.data_tail = '&symbol=%s&type=%s&sign=' % (urllib.quote_plus(symbol), self.side)
+        self.rules = get_order_rules('okcoin', symbol)
+
+    def submit(self, amount, price):
+        amount, price = self.rules.format(amount, price, self.otype)
+        if BLOCK_ORDERS:
+            return "order blocked"
+        sign = hashlib.md5(''.join(('amount=', amount, self.sign_middle, price, self.sign_tail))).hexdigest().upper()
+        params = {
+            'symbol': self.symbol,
+            'type': self.side,
+            'price': price,
+            'amount': amount,
+        }
+        data = self.exchange.okcoin_post('trade.do', ''.join(('amount=', amount, self.data_middle, price,
+                                                              self.data_tail, sign)), params,
+                                         idempotent=False)
+
+        if 'result' in data and data['result']:
+            return str(data['order_id'])
+        raise ExchangeError('okcoin', 'unable to create order %r response was %r' % (params, data))
 
 
 class OKCoin(ExchangeABC):
     name = 'okcoin'
     fiatcurrency = 'USD'
+    fill_lookback = FILL_LOOKBACK
+    hosts = ('www.okcoin.com',)
+    order_template = OKCoinOrderTemplate
+    credential_fields = ('partner', 'secret')
 
     def __init__(self, partner, secret):
         super(OKCoin, self).__init__()
@@ -21,39 +70,47 @@ class OKCoin(ExchangeABC):
         self.secret = secret
 
     def okcoin_encode(self, params):
-        postData = ''
         if not 'partner' in params:
             params['partner'] = self.partner
-        for k in sorted(params.keys()):
-            postData += '%s=%s&' % (k, params[k])
-        postData += 'secret_key='+self.secret
-        return hashlib.md5(postData).hexdigest().upper()
+        postData = ['%s=%s' % (k, params[k]) for k in sorted(params)]
+        postData.append('secret_key=' + self.secret)
+        return hashlib.md5('&'.join(postData)).hexdigest().upper()
 
     def okcoin_request(self, endpoint, params=None):
         params = params or {}
         sig = self.okcoin_encode(params)
         params['partner'] = self.partner
         params['sign'] = sig
+        return self.okcoin_post(endpoint, params, params)
+
+    def okcoin_post(self, endpoint, data, params, idempotent=True):
+        """
+        :param data: the signed request body, as a dict or an encoded string
+        :param dict params: the request params, for error messages
+        :param bool idempotent: False if the request is not safe to repeat, like an order
+        """
         headers = {'contentType': 'application/x-www-form-urlencoded'}
         try:
-            response = requests.post(url=BASE_URL + endpoint,
-                                     data=params,
-                                     headers=headers,
-                                     timeout=REQ_TIMEOUT).json()
+            response = transport.decode(transport.request('okcoin', 'post', BASE_URL + endpoint,
+                                                          private=True, idempotent=idempotent,
+                                                          account_id=self.account_id,
+                                                          data=data,
+                                                          headers=headers,
+                                                          timeout=REQ_TIMEOUT))
         except (ConnectionError, Timeout, ValueError) as e:
             raise ExchangeError('okcoin', '%s %s while sending %r' % (type(e), str(e), params))
         if 'error_code' in response:
             raise ExchangeError('okcoin', '%s while sending %r' % (str(response['error_code']), params))
         return response
 
-    def cancel_order(self, order_id, symbol='btc_usd'):
-        params = {'order_id': order_id, 'symbol': symbol}
+    def cancel_order(self, order_id, symbol='BTC/USD'):
+        params = {'order_id': order_id, 'symbol': get_symbol(self.name, symbol).native}
         resp = self.okcoin_request('cancel_order.do', params)
         if resp and 'order_id' in resp and resp['order_id'] == params['order_id']:
             return True
         return False
 
-    def cancel_orders(self, symbol='btc_usd', **kwargs):
+    def cancel_orders(self, symbol='BTC/USD', **kwargs):
         oorders = self.get_open_orders(symbol)
         canceled = True
         for o in oorders:
@@ -62,27 +119,10 @@ class OKCoin(ExchangeABC):
                 canceled = False
         return canceled
 
-    def create_order(self, amount, price, otype, symbol='btc_usd'):
+    def create_order(self, amount, price, otype, symbol='BTC/USD'):
         if BLOCK_ORDERS:
             return "order blocked"
-        if otype == 'bid':
-            otype = 'buy'
-        elif otype == 'ask':
-            otype = 'sell'
-        else:
-            raise Exception('unknown side %r' % otype)
-
-        params = {
-            'symbol': symbol,
-            'type': otype,
-            'price': price,
-            'amount': amount,
-        }
-        data = self.okcoin_request('trade.do', params)
-
-        if 'result' in data and data['result']:
-            return str(data['order_id'])
-        raise ExchangeError('okcoin', 'unable to create order %r response was %r' % (params, data))
+        return self.prepare_order(otype, symbol=get_symbol(self.name, symbol).pair).submit(amount, price)
 
     def get_balance(self, btype='total'):
         data = self.okcoin_request('userinfo.do')
@@ -98,8 +138,8 @@ class OKCoin(ExchangeABC):
             return free
         return freeze + free, free
 
-    def get_open_orders(self, symbol='btc_usd'):
-        params = {'order_id': -1, 'symbol': symbol}
+    def get_open_orders(self, symbol='BTC/USD'):
+        params = {'order_id': -1, 'symbol': get_symbol(self.name, symbol).native}
         resp = self.okcoin_request('order_info.do', params)
         if resp and 'result' in resp and resp['result']:
             rawos = resp['orders']
@@ -113,35 +153,102 @@ class OKCoin(ExchangeABC):
         return orders
 
     @classmethod
-    def get_order_book(cls, pair='btc_usd', **kwargs):
+    def book_request(cls, symbol, depth=None):
+        params = {'symbol': symbol.url}
+        if depth is not None:
+            params['size'] = min(depth, MAX_BOOK_SIZE)
+        return BASE_URL + 'depth.do', params, ()
+
+    @classmethod
+    def get_order_book(cls, pair='BTC/USD', depth=None, group=None, **kwargs):
+        url, params, path = cls.book_request(get_symbol(cls.name, pair), depth if group is None else None)
         try:
-            return requests.get('%sdepth.do?symbol=%s' % (BASE_URL, pair), timeout=REQ_TIMEOUT).json()
+            book = transport.decode(transport.request('okcoin', 'get', url, params=params, timeout=REQ_TIMEOUT))
         except (ConnectionError, Timeout, ValueError) as e:
             raise ExchangeError('okcoin', '%s %s while sending get_order_book' % (type(e), str(e)))
+        # okcoin lists asks worst first, which limit_book turns around
+        return cls.limit_book(book, depth, group)
 
     @classmethod
-    def get_ticker(cls, pair='btc_usd'):
+    def get_ticker(cls, pair='BTC/USD'):
+        symbol = get_symbol(cls.name, pair)
         try:
-            rawtick = requests.get(BASE_URL + 'ticker.do?symbol=%s' % pair, timeout=REQ_TIMEOUT).json()
+            rawtick = transport.decode(transport.request('okcoin', 'get', BASE_URL + 'ticker.do?symbol=%s' % symbol.url,
+                                                         timeout=REQ_TIMEOUT))
         except (ConnectionError, Timeout, ValueError) as e:
             raise ExchangeError('okcoin', '%s %s while sending get_ticker to okcoin' % (type(e), str(e)))
 
         return create_ticker(bid=rawtick['ticker']['buy'], ask=rawtick['ticker']['sell'],
                              high=rawtick['ticker']['high'], low=rawtick['ticker']['low'],
                              volume=rawtick['ticker']['vol'], last=rawtick['ticker']['last'],
-                             timestamp=rawtick['date'], currency='USD')
+                             timestamp=rawtick['date'], currency=symbol.quote, base=symbol.base)
 
-    def get_transactions(self, limit=None, status=1, current_page=1, page_length=200, symbol='btc_usd'):
-        params = {'status': status, 'current_page': current_page, 'page_length': page_length, 'symbol': symbol}
+    @classmethod
+    def get_public_trades(cls, pair='BTC/USD', since=None):
+        symbol = get_symbol(cls.name, pair)
+        params = {'symbol': symbol.url}
+        if since is not None:
+            params['since'] = since.trade_id
+        try:
+            resp = transport.decode(transport.request('okcoin', 'get', BASE_URL + 'trades.do', params=params,
+                                                      timeout=REQ_TIMEOUT))
+        except (ConnectionError, Timeout, ValueError) as e:
+            raise ExchangeError('okcoin', '%s %s while sending get_public_trades' % (type(e), str(e)))
+        if not isinstance(resp, list):
+            raise ExchangeError('okcoin', 'unable to get trades: %r' % resp)
+        # oldest first
+        return [Trade(cls.name, str(t['tid']), 'bid' if t['type'] == 'buy' else 'ask', Money(t['price'], symbol.quote),
+                      Money(t['amount'], symbol.base), float(t['date'])) for t in resp]
+
+    def get_transactions(self, limit=None, status=1, current_page=1, page_length=200, symbol='BTC/USD'):
+        params = {'status': status, 'current_page': current_page, 'page_length': page_length,
+                  'symbol': get_symbol(self.name, symbol).native}
         resp = self.okcoin_request('order_history.do', params)
         if resp and 'result' in resp and resp['result']:
             return resp
         raise ExchangeError('okcoin', 'unable to get transactions. response was %r' % resp)
 
-    def get_deposit_address(self):
+    def get_fills(self, since=None, symbol='BTC/USD'):
+        """
+        OKCoin only reports filled orders, so each Fill is a whole order at its average price, dated when the order
+        was placed. An order placed before the cursor can complete after it, so every order placed up to
+        fill_lookback seconds before the cursor is returned again, for TradeSync to dedupe by id.
+        Orders are listed newest first, so pages are fetched until one reaches back that far.
+        """
+        market = get_symbol(self.name, symbol)
+        start = since.timestamp - self.fill_lookback if since is not None else 0
+
+        def get_page(page):
+            return self.get_transactions(current_page=page, page_length=FILL_PAGE_SIZE, symbol=symbol)['orders']
+
+        def placed(o):
+            return float(o['create_date']) / 1000
+
+        first = self.get_transactions(current_page=1, page_length=FILL_PAGE_SIZE, symbol=symbol)
+        npages = (int(first['total']) + FILL_PAGE_SIZE - 1) // FILL_PAGE_SIZE
+        orders = list(first['orders'])
+        page = 2
+        while page <= npages and all(placed(o) >= start for o in orders):
+            batch = range(page, min(page + FILL_PAGE_BATCH, npages + 1))
+            for result in fan_out(get_page, batch):
+                orders.extend(result)
+            page = batch[-1] + 1
+
+        fills = []
+        for o in orders:
+            if placed(o) < start:
+                continue
+            side = 'ask' if o['type'] == 'sell' else 'bid'
+            fills.append(Fill(self.name, str(o['order_id']), str(o['order_id']), side,
+                              Money(o['avg_price'], market.quote), Money(o['deal_amount'], market.base),
+                              Money(0, market.quote), placed(o)))
+        fills.sort(key=lambda f: (f.timestamp, int(f.fill_id)))
+        return fills
+
+    def get_deposit_address(self, currency='BTC'):
+        self.check_deposit_currency(currency)
         return exchange_config['okcoin']['address']
 
 
 eclass = OKCoin
-exchange = OKCoin(exchange_config['okcoin']['api_creds']['partner'],
-                    exchange_config['okcoin']['api_creds']['secret'])
+exchange = DefaultClient('okcoin')
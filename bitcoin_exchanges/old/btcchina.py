@@ -8,23 +8,24 @@ Hopefully improved a little bit by implementing ticker methods and using request
 """
 import time
 import re
-import hmac
 import hashlib
 import base64
 import json
 from decimal import Decimal
-import requests
 from requests.exceptions import Timeout, ConnectionError
-from bitcoin_exchanges.exchange_util import ExchangeError
+from bitcoin_exchanges.exchange_util import ExchangeError, HmacSigner
+from bitcoin_exchanges import transport
 
 
 REQ_TIMEOUT = 10  # seconds
+PARAMS_STRIP = re.compile("[\\[\\] ']")
 
 
 class BTCChina():
     def __init__(self, access=None, secret=None, normalization_rate=Decimal(1 / 6.1 * 0.975)):
         self.access_key = access
         self.secret_key = secret
+        self.signer = HmacSigner(secret or '', hashlib.sha1)
         self.url = "https://api.btcchina.com"
         self.normalization_rate = normalization_rate
 
@@ -32,28 +33,24 @@ class BTCChina():
         return int(time.time() * 1000000)
 
     def _get_params_hash(self, pdict):
-        pstring = ""
+        pstring = []
         # The order of params is critical for calculating a correct hash
         fields = ['tonce', 'accesskey', 'requestmethod', 'id', 'method', 'params']
         for f in fields:
             if pdict[f]:
                 if f == 'params':
-                    # Convert list to string, then strip brackets and spaces
-                    # probably a cleaner way to do this
-                    param_string = re.sub("[\[\] ]", "", str(pdict[f]))
-                    param_string = re.sub("'", '', param_string)
-                    pstring += f + '=' + param_string + '&'
+                    # Convert list to string, then strip brackets, spaces and quotes
+                    param_string = PARAMS_STRIP.sub('', str(pdict[f]))
+                    pstring.append(f + '=' + param_string)
                 else:
-                    pstring += f + '=' + str(pdict[f]) + '&'
+                    pstring.append(f + '=' + str(pdict[f]))
             else:
-                pstring += f + '=&'
-        pstring = pstring.strip('&')
+                pstring.append(f + '=')
 
         # now with correctly ordered param string, calculate hash
-        phash = hmac.new(self.secret_key, pstring, hashlib.sha1).hexdigest()
-        return phash
+        return self.signer.hexdigest('&'.join(pstring))
 
-    def _private_request(self, post_data, retry=0):
+    def _sign(self, post_data):
         # fill in common post_data parameters
         tonce = self._get_tonce()
         post_data['tonce'] = tonce
@@ -71,11 +68,16 @@ class BTCChina():
         headers = {'Authorization': auth_string, 'Json-Rpc-Tonce': tonce}
 
         # post_data dictionary passed as JSON
-        # self.conn.request("POST",'/api_trade_v1.php',json.dumps(post_data),headers)
-        # response = self.conn.getresponse()
+        return {'data': json.dumps(post_data), 'headers': headers}
+
+    def _private_request(self, post_data, idempotent=True):
         try:
-            response = requests.post(self.url + '/api_trade_v1.php', data=json.dumps(post_data), headers=headers,
-                                     verify=False, timeout=REQ_TIMEOUT)
+            # a 401 is a possible tonce collision, so it is retried with a fresh tonce
+            response = transport.request('btcchina', 'post', self.url + '/api_trade_v1.php',
+                                         private=True, idempotent=idempotent,
+                                         sign=lambda: self._sign(post_data),
+                                         retry_if=lambda r: r.status_code == 401,
+                                         verify=False, timeout=REQ_TIMEOUT)
         except (ConnectionError, Timeout) as e:
             raise ExchangeError('btcchina', 'Could not complete request %r for reason %s' % (post_data, e))
 
@@ -85,7 +87,7 @@ class BTCChina():
         if response.status_code == 200:
             # this might fail if non-json data is returned
             # resp_dict = json.loads(response.read())
-            resp_dict = json.loads(response.text)
+            resp_dict = transport.decode(response)
 
             # The id's may need to be used by the calling application,
             # but for now, check and discard from the return dict
@@ -96,9 +98,6 @@ class BTCChina():
                     ExchangeError('btcchina', 'error response for %r: %s' % (post_data, str(resp_dict['error'])))
                 elif 'code' in resp_dict:
                     ExchangeError('btcchina', 'error response for %r: %s' % (post_data, str(resp_dict['code'])))
-        elif response.status_code == 401 and retry < 2:
-            # possible nonce collision?
-            self._private_request(post_data, retry=retry + 1)
         else:
             print "status:" + str(response.status_code)
             raise ExchangeError('btcchina', 'error response for %r: %s' % (post_data, str(response.status_code)))
@@ -112,11 +111,14 @@ class BTCChina():
         post_data['params'] = []
         return self._private_request(post_data)
 
-    def get_market_depth(self, post_data=None):
+    def get_market_depth(self, post_data=None, market='btccny', limit=None):
+        params = {'market': market}
+        if limit is not None:
+            params['limit'] = limit
         try:
-            depth = requests.get('https://data.btcchina.com/data/orderbook',
-                                 timeout=REQ_TIMEOUT)
-            return depth.json()
+            depth = transport.request('btcchina', 'get', 'https://data.btcchina.com/data/orderbook',
+                                      params=params, timeout=REQ_TIMEOUT)
+            return transport.decode(depth)
         except (ConnectionError, Timeout, ValueError) as e:
             raise ExchangeError('btcchina', 'Could not get_market_depth using data %s for reason %s' % (post_data, e))
 
@@ -125,14 +127,14 @@ class BTCChina():
             post_data = {}
         post_data['method'] = 'buyOrder'
         post_data['params'] = [price, amount]
-        return self._private_request(post_data)
+        return self._private_request(post_data, idempotent=False)
 
     def sell(self, price, amount, post_data=None):
         if not post_data:
             post_data = {}
         post_data['method'] = 'sellOrder'
         post_data['params'] = [price, amount]
-        return self._private_request(post_data)
+        return self._private_request(post_data, idempotent=False)
 
     def cancel(self, order_id, post_data=None):
         if not post_data:
@@ -146,7 +148,7 @@ class BTCChina():
             post_data = {}
         post_data['method'] = 'requestWithdrawal'
         post_data['params'] = [currency, amount]
-        return self._private_request(post_data)
+        return self._private_request(post_data, idempotent=False)
 
     def get_deposits(self, currency='BTC', pending=True, post_data=None):
         if not post_data:
@@ -194,17 +196,26 @@ class BTCChina():
                 post_data['params'] = [wid, 'false']
         return self._private_request(post_data)
 
-    def get_ticker(self, retry=0):
+    def get_ticker(self, market='btccny'):
+        decoded = []
+
+        def invalid_json(response):
+            # keep the decoded ticker, so the accepted response is not decoded twice
+            try:
+                decoded.append(transport.decode(response))
+            except ValueError:
+                return True
+            return False
+
         try:
-            resp = requests.get('https://data.btcchina.com/data/ticker', verify=False,
-                                timeout=REQ_TIMEOUT)
+            resp = transport.request('btcchina', 'get', 'https://data.btcchina.com/data/ticker',
+                                     params={'market': market}, retry_if=invalid_json, verify=False,
+                                     timeout=REQ_TIMEOUT)
         except (ConnectionError, Timeout) as e:
             raise ExchangeError('btcchina', 'Could not get_ticker for reason %s' % e)
-        try:
-            return json.loads(resp.text)
-        except ValueError:
-            if retry < 5:
-                self.get_ticker(retry=retry + 1)
+        if not decoded:
+            raise ExchangeError('btcchina', 'Could not get_ticker for reason invalid json %r' % resp.content[:100])
+        return decoded[-1]
 
     def get_usd_ticker(self):
         cnyticker = self.get_ticker()
@@ -218,8 +229,11 @@ class BTCChina():
             usdticker['ticker']['vol'] = cnyticker['ticker']['vol']
             return usdticker
 
-    def get_transactions(self, limit=None, ttype='all', offset=0):
-        limit = 10 if limit is None else 0
+    def get_transactions(self, limit=None, ttype='all', offset=0, since=None, sincetype='id'):
+        limit = 10 if limit is None else limit
+        params = [ttype, limit, offset]
+        if since is not None:
+            params.extend([since, sincetype])
         post_data = {'method': 'getTransactions',
-                     'params': [ttype, limit, offset]}
+                     'params': params}
         return self._private_request(post_data)
@@ -1,11 +1,10 @@
 import urllib
 import urllib2
-import json
 import time
-import hmac,hashlib
-import requests
+import hashlib
 from requests.exceptions import Timeout, ConnectionError
-from bitcoin_exchanges.exchange_util import ExchangeError
+from bitcoin_exchanges.exchange_util import ExchangeError, HmacSigner
+from bitcoin_exchanges import transport
 
 REQ_TIMEOUT = 10  # seconds
 publicURL = 'https://poloniex.com/public?command='
@@ -18,6 +17,7 @@ class poloniex:
     def __init__(self, APIKey=None, Secret=None):
         self.APIKey = APIKey
         self.Secret = Secret
+        self.signer = HmacSigner(Secret or '', hashlib.sha512)
     
     def post_process(self, before):
         after = before
@@ -32,41 +32,46 @@ class poloniex:
                             
         return after
     
-    def api_query(self, command, req={}):
+    def api_query(self, command, req={}, idempotent=True):
 
         if(command == 'returnTicker' or command == "return24Volume"):
             try:
-                ret = requests.get(publicURL + command, timeout=REQ_TIMEOUT)
+                ret = transport.request('poloniex', 'get', publicURL + command, timeout=REQ_TIMEOUT)
             except (ConnectionError, Timeout) as e:
                 raise ExchangeError('poloniex', 'Could not complete request %r for reason %s %s' % (command, type(e), str(e)))
 
-            return json.loads(ret.text)
+            return transport.decode(ret)
         
         elif(command == "returnOrderBook" or command == "returnMarketTradeHistory"):
             try:
-                ret = requests.get(publicURL + command + '&currencyPair=' + str(req['currencyPair']), timeout=REQ_TIMEOUT)
+                ret = transport.request('poloniex', 'get', publicURL + command + '&currencyPair=' + str(req['currencyPair']),
+                                        params=dict((k, v) for k, v in req.items() if k != 'currencyPair') or None,
+                                        timeout=REQ_TIMEOUT)
             except (ConnectionError, Timeout) as e:
                 raise ExchangeError('poloniex', 'Could not complete request %r for reason %s %s' % (command, type(e), str(e)))
 
-            return json.loads(ret.text)
+            return transport.decode(ret)
 
         else:
             req['command'] = command
-            req['nonce'] = int(time.time()*1000)
-            post_data = urllib.urlencode(req)
-            sign = hmac.new(self.Secret, post_data, hashlib.sha512).hexdigest()
-            headers = {
-                'Sign': sign,
-                'Key': self.APIKey
-            }
-            
+
+            def sign():
+                req['nonce'] = int(time.time()*1000)
+                post_data = urllib.urlencode(req)
+                headers = {
+                    'Content-type': 'application/x-www-form-urlencoded',
+                    'Sign': self.signer.hexdigest(post_data),
+                    'Key': self.APIKey
+                }
+                return {'data': post_data, 'headers': headers}
+
             try:
-                ret = requests.post(url=tradeURL, data=req,
-                                    headers=headers, timeout=REQ_TIMEOUT)
+                ret = transport.request('poloniex', 'post', tradeURL, private=True, idempotent=idempotent,
+                                        sign=sign, timeout=REQ_TIMEOUT)
             except (ConnectionError, Timeout) as e:
                 raise ExchangeError('poloniex', 'Could not complete request %r for reason %s %s' % (req, type(e), str(e)))
 
-            return json.loads(ret.text)
+            return transport.decode(ret)
 
     def returnTicker(self):
         return self.api_query("returnTicker")
@@ -74,11 +79,19 @@ class poloniex:
     def return24Volume(self):
         return self.api_query("return24Volume")
 
-    def returnOrderBook(self, currencyPair):
-        return self.api_query("returnOrderBook", {'currencyPair': currencyPair})
+    def returnOrderBook(self, currencyPair, depth=None):
+        req = {'currencyPair': currencyPair}
+        if depth is not None:
+            req['depth'] = depth
+        return self.api_query("returnOrderBook", req)
 
-    def returnMarketTradeHistory(self, currencyPair):
-        return self.api_query("returnMarketTradeHistory", {'currencyPair': currencyPair})
+    def returnMarketTradeHistory(self, currencyPair, start=None, end=None):
+        req = {'currencyPair': currencyPair}
+        if start is not None:
+            req['start'] = start
+        if end is not None:
+            req['end'] = end
+        return self.api_query("returnMarketTradeHistory", req)
 
 
     # Returns all of your balances.
@@ -107,14 +120,22 @@ class poloniex:
     # Returns your trade history for a given market, specified by the "currencyPair" POST parameter
     # Inputs:
     # currencyPair  The currency pair e.g. "BTC_XCP"
+    # start         (optional) UNIX timestamp to begin the history at
+    # end           (optional) UNIX timestamp to end the history at
     # Outputs: 
     # date          Date in the form: "2014-02-19 03:44:59"
     # rate          Price the order is selling or buying at
     # amount        Quantity of order
     # total         Total value of order (price * quantity)
     # type          sell or buy
-    def returnTradeHistory(self,currencyPair):
-        return self.api_query('returnTradeHistory',{"currencyPair":currencyPair})
+    # fee           The fee rate charged on the trade
+    def returnTradeHistory(self,currencyPair,start=None,end=None):
+        req = {"currencyPair": currencyPair}
+        if start is not None:
+            req['start'] = start
+        if end is not None:
+            req['end'] = end
+        return self.api_query('returnTradeHistory',req)
 
     # Places a buy order in a given market. Required POST parameters are "currencyPair", "rate", and "amount". If successful, the method will return the order number.
     # Inputs:
@@ -124,7 +145,7 @@ class poloniex:
     # Outputs: 
     # orderNumber   The order number
     def buy(self,currencyPair,rate,amount):
-        return self.api_query('buy',{"currencyPair":currencyPair,"rate":rate,"amount":amount})
+        return self.api_query('buy',{"currencyPair":currencyPair,"rate":rate,"amount":amount}, idempotent=False)
 
     # Places a sell order in a given market. Required POST parameters are "currencyPair", "rate", and "amount". If successful, the method will return the order number.
     # Inputs:
@@ -134,7 +155,7 @@ class poloniex:
     # Outputs: 
     # orderNumber   The order number
     def sell(self,currencyPair,rate,amount):
-        return self.api_query('sell',{"currencyPair":currencyPair,"rate":rate,"amount":amount})
+        return self.api_query('sell',{"currencyPair":currencyPair,"rate":rate,"amount":amount}, idempotent=False)
 
     # Cancels an order you have placed in a given market. Required POST parameters are "currencyPair" and "orderNumber".
     # Inputs:
@@ -153,7 +174,8 @@ class poloniex:
     # Outputs: 
     # response      Text containing message about the withdrawal
     def withdraw(self, currency, amount, address):
-        return self.api_query('withdraw',{"currency":currency, "amount":amount, "address":address})
+        return self.api_query('withdraw',{"currency":currency, "amount":amount, "address":address},
+                              idempotent=False)
 
     def returnDepositAddresses(self):
         return self.api_query('returnDepositAddresses')
@@ -0,0 +1,175 @@
+"""
+Each exchange's order limits, checked locally so that an order the exchange would reject fails before any request
+is sent, without spending a round trip or a nonce.
+
+Prices and amounts are rounded to the precision in symbols.SYMBOLS. Amounts round down, and prices round away from
+the market (bids down, asks up), so a formatted order never trades more, or at a worse price, than was asked.
+"""
+from decimal import Decimal, ROUND_CEILING, ROUND_DOWN, ROUND_FLOOR
+import threading
+import time
+
+from moneyed import Money
+
+from bitcoin_exchanges.exchange_util import ExchangeError
+from bitcoin_exchanges.symbols import get_symbol
+
+# the smallest order amount, in the base currency, by exchange and base currency
+MIN_AMOUNTS = {
+    'bitfinex': {'BTC': '0.01', 'LTC': '0.1', 'ETH': '0.1'},
+    'btcchina': {'BTC': '0.001', 'LTC': '0.001'},
+    'btce': {'BTC': '0.01', 'LTC': '0.1'},
+    'huobi': {'BTC': '0.001', 'LTC': '0.01'},  # error 46
+    'kraken': {'BTC': '0.01', 'LTC': '0.1', 'ETH': '0.01'},
+    'lakebtc': {'BTC': '0.01'},
+    'okcoin': {'BTC': '0.01', 'LTC': '0.1'},
+}
+# the smallest order value, in the quote currency, by exchange and quote currency
+MIN_TOTALS = {
+    'bitstamp': {'USD': '5'},
+    'poloniex': {'USD': '1', 'BTC': '0.0001'},
+}
+# how far an order's price may be from the market, as a fraction of the reference price
+PRICE_BANDS = {
+    'huobi': '0.1',  # errors 55 and 56
+}
+REFERENCE_MAX_AGE = 60  # seconds a reference price is checked against before it has to be set again
+# exchanges which reject whole number amounts (huobi signatures, btcchina), and the step to move them by.
+# Whole number prices are moved one tick away from the market.
+ROUND_NUMBER_NUDGES = {
+    'huobi': '0.001',
+    'btcchina': '-0.0001',
+}
+
+_rules = {}
+_rules_lock = threading.Lock()
+
+
+def to_decimal(value):
+    """
+    :param value: a Money, Decimal, number or string
+    :rtype: Decimal
+    """
+    if isinstance(value, Money):
+        return value.amount
+    if isinstance(value, float):
+        return Decimal(repr(value))  # the shortest repr, not the binary expansion
+    return Decimal(value)
+
+
+def plain(value):
+    """
+    :return: a Decimal as a string without trailing zeros or an exponent, as signatures are computed over it
+    :rtype: str
+    """
+    return '{:f}'.format(value.normalize())
+
+
+class OrderRules(object):
+    """The precision and limits of one pair on one exchange."""
+
+    def __init__(self, symbol, min_amount=None, min_total=None, price_band=None, nudge=None):
+        """
+        :param Symbol symbol: the pair
+        :param min_amount: the smallest amount, in the base currency
+        :param min_total: the smallest price * amount, in the quote currency
+        :param price_band: the furthest a price may be from the reference price, as a fraction of it
+        :param nudge: if given, whole number amounts are moved by this, and whole number prices by a tick
+        """
+        self.symbol = symbol
+        self.price_step = Decimal(1).scaleb(-symbol.price_precision)
+        self.amount_step = Decimal(1).scaleb(-symbol.amount_precision)
+        self.min_amount = Decimal(min_amount) if min_amount is not None else None
+        self.min_total = Decimal(min_total) if min_total is not None else None
+        self.price_band = Decimal(price_band) if price_band is not None else None
+        self.nudge = Decimal(nudge) if nudge is not None else None
+        self.reference_price = None  # a recent market price, see set_reference_price
+        self.reference_time = None
+
+    def needs_reference(self):
+        """
+        :return: whether orders are checked against a reference price, and there is no recent one
+        :rtype: bool
+        """
+        return self.price_band is not None and (self.reference_time is None or
+                                                time.time() - self.reference_time > REFERENCE_MAX_AGE)
+
+    def format(self, amount, price, side):
+        """
+        Round an order to the exchange's precision, and check it against the exchange's limits.
+
+        :param amount: the amount, in the base currency
+        :param price: the price, in the quote currency
+        :param str side: 'bid' or 'ask' ('buy' and 'sell' are accepted too)
+        :return: the amount and price as strings, ready to send
+        :rtype: tuple
+        :raises ExchangeError: if the exchange would reject the order, or there is no recent reference price to check
+                               it against
+        """
+        exchange = self.symbol.exchange
+        bid = side in ('bid', 'buy')
+        amount = to_decimal(amount).quantize(self.amount_step, ROUND_DOWN)
+        price = to_decimal(price).quantize(self.price_step, ROUND_FLOOR if bid else ROUND_CEILING)
+        if self.nudge is not None:
+            if amount == amount.to_integral_value():
+                amount += self.nudge
+            if price == price.to_integral_value():
+                price += -self.price_step if bid else self.price_step
+        if amount <= 0 or price <= 0:
+            raise ExchangeError(exchange, 'invalid order of %s at %s' % (plain(amount), plain(price)))
+        if self.min_amount is not None and amount < self.min_amount:
+            raise ExchangeError(exchange, 'order amount %s is below the minimum of %s %s' % (
+                plain(amount), self.min_amount, self.symbol.base))
+        if self.min_total is not None and amount * price < self.min_total:
+            raise ExchangeError(exchange, 'order value %s is below the minimum of %s %s' % (
+                plain(amount * price), self.min_total, self.symbol.quote))
+        if self.price_band is not None:
+            if self.needs_reference():
+                raise ExchangeError(exchange, 'no market price within %ss to check order price %s against' % (
+                    REFERENCE_MAX_AGE, plain(price)))
+            reference = self.reference_price
+            if abs(price - reference) > reference * self.price_band:
+                raise ExchangeError(exchange, 'order price %s is too far from the market price %s' % (
+                    plain(price), reference))
+        return plain(amount), plain(price)
+
+
+def get_order_rules(exchange, pair=None):
+    """
+    :param str exchange: the exchange name
+    :param str pair: the pair by any of its names. Defaults to the exchange's main pair.
+    :rtype: OrderRules
+    """
+    symbol = get_symbol(exchange, pair)
+    rules = _rules.get((exchange, symbol.pair))
+    if rules is None:
+        with _rules_lock:
+            rules = _rules.get((exchange, symbol.pair))
+            if rules is None:
+                rules = _rules[(exchange, symbol.pair)] = OrderRules(
+                    symbol, min_amount=MIN_AMOUNTS.get(exchange, {}).get(symbol.base),
+                    min_total=MIN_TOTALS.get(exchange, {}).get(symbol.quote),
+                    price_band=PRICE_BANDS.get(exchange), nudge=ROUND_NUMBER_NUDGES.get(exchange))
+    return rules
+
+
+def set_reference_price(exchange, pair, price):
+    """
+    Record a recent market price, which orders on exchanges with a price band are checked against.
+    Until one is set, and once it is older than REFERENCE_MAX_AGE, their orders are rejected.
+
+    :param price: e.g. the last trade price or the mid price
+    """
+    rules = get_order_rules(exchange, pair)
+    rules.reference_price = to_decimal(price)
+    rules.reference_time = time.time()
+
+
+def format_order(exchange, amount, price, side, pair=None):
+    """
+    Round and check an order with the exchange's rules (see OrderRules.format).
+
+    :return: the amount and price as strings
+    :rtype: tuple
+    """
+    return get_order_rules(exchange, pair).format(amount, price, side)
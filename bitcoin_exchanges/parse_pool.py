@@ -0,0 +1,255 @@
+"""
+Parse order books in a pool of processes, instead of in the threads that fetch them.
+
+Converting every level of a large book to Decimal holds the GIL, so however many threads fetch books, only one
+core's worth of them is parsed at a time. A ParsePool sends the raw response bytes to worker processes instead.
+Each worker decodes a book and writes its levels, as fixed-point integers (units of 1 / SCALE), into its own slot
+of an array shared with the parent, so only the level counts travel back through a pipe. The fetching threads
+wait on the workers without holding the GIL, so fetching and parsing overlap across cores.
+
+It is an optional stage. get_order_book works as before, and books parsed here are FixedBooks of arrays, not the
+raw dicts get_order_book returns.
+"""
+from array import array
+from collections import namedtuple
+import ctypes
+from decimal import Decimal
+import importlib
+import json
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+import Queue
+
+from requests.exceptions import ConnectionError, Timeout
+
+from bitcoin_exchanges.exchange_util import ExchangeError, fan_out, get_live_exchange_workers
+from bitcoin_exchanges import transport
+from bitcoin_exchanges.symbols import get_symbol
+
+SCALE_DIGITS = 8
+SCALE = 10 ** SCALE_DIGITS  # fixed-point units per coin, i.e. satoshis
+MAX_LEVELS = 1000  # levels kept per side. Deeper books are cut to this.
+REQ_TIMEOUT = 10  # seconds
+
+# the array typecode of a 64 bit integer, which is 'l' on 64 bit linux
+TYPECODE = 'l' if array('l').itemsize == ctypes.sizeof(ctypes.c_longlong) else 'q'
+
+# each side's prices and amounts, best level first, as arrays of fixed-point integers
+FixedBook = namedtuple('FixedBook', ['exchange', 'pair', 'bid_prices', 'bid_amounts', 'ask_prices', 'ask_amounts'])
+
+
+def to_fixed(value):
+    """
+    Convert a price or amount to fixed-point, exactly, without going through Decimal for the usual plain numbers.
+    Digits past SCALE_DIGITS are truncated.
+
+    :param value: a number, or its string form
+    :rtype: int
+    """
+    if isinstance(value, (int, long)):
+        return value * SCALE
+    text = value if isinstance(value, basestring) else repr(value)
+    if 'e' in text or 'E' in text:
+        return int(Decimal(text).scaleb(SCALE_DIGITS))
+    negative = text.startswith('-')
+    whole, _, fraction = text.lstrip('+-').partition('.')
+    fixed = int(whole or 0) * SCALE + int((fraction + '0' * SCALE_DIGITS)[:SCALE_DIGITS])
+    return -fixed if negative else fixed
+
+
+def from_fixed(value):
+    """
+    :rtype: Decimal
+    """
+    return Decimal(value).scaleb(-SCALE_DIGITS)
+
+
+def levels(book, side):
+    """
+    :param FixedBook book: a parsed book
+    :param str side: 'bids' or 'asks'
+    :return: the side's (price, amount) levels as Decimals, best first
+    :rtype: list
+    """
+    prices, amounts = (book.bid_prices, book.bid_amounts) if side == 'bids' else (book.ask_prices, book.ask_amounts)
+    return [(from_fixed(p), from_fixed(a)) for p, a in zip(prices, amounts)]
+
+
+def _raw_price(item):
+    return item['price'] if isinstance(item, dict) else item[0]
+
+
+def _fixed_side(items, best_high, limit=MAX_LEVELS):
+    """The (price, amount) fixed-point levels of one side of a raw book, best first, up to limit of them."""
+    if len(items) > 1 and (to_fixed(_raw_price(items[0])) < to_fixed(_raw_price(items[-1]))) == best_high:
+        items = items[::-1]
+    fixed = []
+    for item in items[:limit]:
+        if isinstance(item, dict):
+            fixed.append((to_fixed(item['price']), to_fixed(item['amount'])))
+        else:
+            fixed.append((to_fixed(item[0]), to_fixed(item[1])))
+    return fixed
+
+
+# set in each worker process by _init_worker
+_slab = None
+_slot_size = None
+
+
+def _init_worker(slab, slot_size):
+    global _slab, _slot_size
+    _slab = slab
+    _slot_size = slot_size
+
+
+def _write_side(offset, fixed):
+    for i, (price, amount) in enumerate(fixed):
+        _slab[offset + i] = price
+        _slab[offset + MAX_LEVELS + i] = amount
+
+
+def parse_into_slot(slot, raw, path, depth):
+    """
+    Decode a raw book in a worker, and write its levels into a slot of the shared array.
+    A slot holds the bid prices, bid amounts, ask prices and ask amounts, MAX_LEVELS each.
+
+    :return: the number of bids and asks written
+    :rtype: tuple
+    """
+    # numbers are left as strings, which to_fixed converts exactly
+    book = json.loads(raw, parse_float=str, parse_int=str)
+    for key in path:
+        book = book[key]
+    limit = min(depth or MAX_LEVELS, MAX_LEVELS)
+    bids = _fixed_side(book['bids'], True, limit)
+    asks = _fixed_side(book['asks'], False, limit)
+    base = slot * _slot_size
+    _write_side(base, bids)
+    _write_side(base + 2 * MAX_LEVELS, asks)
+    return len(bids), len(asks)
+
+
+class ParsePool(object):
+    """
+    A pool of processes which parse raw order books into FixedBooks.
+
+    Each book being parsed holds a slot of the shared array until it has been copied out, so at most `slots`
+    books are in the workers at once, and further ones wait for a slot.
+    """
+
+    def __init__(self, processes=None, slots=None):
+        """
+        :param int processes: worker processes. Defaults to the number of cores.
+        :param int slots: books parsed at once. Defaults to twice the processes.
+        """
+        self.processes = processes or multiprocessing.cpu_count()
+        self.slots = slots or 2 * self.processes
+        self.slot_size = 4 * MAX_LEVELS
+        self._slab = None
+        self._pool = None
+        self._free = None
+
+    def start(self):
+        self._slab = RawArray(ctypes.c_longlong, self.slots * self.slot_size)
+        self._free = Queue.Queue()
+        for slot in range(self.slots):
+            self._free.put(slot)
+        self._pool = multiprocessing.Pool(self.processes, initializer=_init_worker,
+                                          initargs=(self._slab, self.slot_size))
+
+    def stop(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def _copy_out(self, offset, count):
+        copied = array(TYPECODE, [0]) * count
+        if count:
+            itemsize = ctypes.sizeof(ctypes.c_longlong)
+            ctypes.memmove(copied.buffer_info()[0], ctypes.addressof(self._slab) + offset * itemsize,
+                           count * itemsize)
+        return copied
+
+    def parse(self, exchange, raw, pair=None, path=(), depth=None):
+        """
+        Parse a raw order book in a worker process. Blocks the calling thread, but not the GIL, until it is done.
+
+        :param str exchange: the exchange name
+        :param str raw: the response body
+        :param str pair: the book's pair by any of its names, for the FixedBook. Defaults to the main pair.
+        :param tuple path: the keys the book is under in the response, if it is not at the top
+        :param int depth: the levels to keep on each side
+        :rtype: FixedBook
+        :raises ExchangeError: if the response is not an order book
+        """
+        if self._pool is None:
+            raise ExchangeError(exchange, 'the parse pool has not been started')
+        slot = self._free.get()
+        try:
+            try:
+                bid_count, ask_count = self._pool.apply_async(parse_into_slot, (slot, raw, path, depth)).get()
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                raise ExchangeError(exchange, '%s %s while parsing order book %r' % (type(e), e, raw[:200]))
+            base = slot * self.slot_size
+            return FixedBook(exchange, get_symbol(exchange, pair).pair,
+                             self._copy_out(base, bid_count), self._copy_out(base + MAX_LEVELS, bid_count),
+                             self._copy_out(base + 2 * MAX_LEVELS, ask_count),
+                             self._copy_out(base + 3 * MAX_LEVELS, ask_count))
+        finally:
+            self._free.put(slot)
+
+    def get_order_book(self, exchange, pair=None, depth=None):
+        """
+        Fetch an order book's raw bytes, and parse them in the pool.
+
+        The request is the client's book_request. Books without one, like btcchina's and poloniex's, come through
+        their own client libraries already decoded, so they are converted in the calling thread.
+
+        :rtype: FixedBook
+        :raises ExchangeError: if the book could not be fetched or parsed
+        """
+        symbol = get_symbol(exchange, pair)
+        eclass = importlib.import_module('bitcoin_exchanges.%s' % exchange).eclass
+        req = eclass.book_request(symbol, depth)
+        if req is None:
+            try:
+                book = eclass.get_order_book(symbol.pair, depth=depth)
+            except (ConnectionError, Timeout) as e:
+                raise ExchangeError(exchange, '%s %s while sending get_order_book' % (type(e), str(e)))
+            limit = min(depth or MAX_LEVELS, MAX_LEVELS)
+            bids = zip(*_fixed_side(book['bids'], True, limit)) or ((), ())
+            asks = zip(*_fixed_side(book['asks'], False, limit)) or ((), ())
+            return FixedBook(exchange, symbol.pair, array(TYPECODE, bids[0]), array(TYPECODE, bids[1]),
+                             array(TYPECODE, asks[0]), array(TYPECODE, asks[1]))
+        url, params, path = req
+        try:
+            resp = transport.request(exchange, 'get', url, params=params, timeout=REQ_TIMEOUT)
+        except (ConnectionError, Timeout) as e:
+            raise ExchangeError(exchange, '%s %s while sending get_order_book' % (type(e), str(e)))
+        if resp.status_code != 200:
+            raise ExchangeError(exchange, 'unable to get order book: status %s %r' % (resp.status_code,
+                                                                                      resp.content[:200]))
+        return self.parse(exchange, resp.content, symbol.pair, path, depth)
+
+    def get_order_books(self, pairs=None, depth=None):
+        """
+        Fetch and parse the books of several exchanges concurrently.
+
+        :param dict pairs: the pair to get on each exchange, by exchange name. Defaults to each live exchange's
+                           main pair.
+        :return: a FixedBook by exchange name. Exchanges that failed are left out.
+        :rtype: dict
+        """
+        if pairs is None:
+            pairs = dict((name, None) for name in get_live_exchange_workers())
+
+        def get_one(name):
+            try:
+                return self.get_order_book(name, pairs[name], depth)
+            except ExchangeError:
+                return None
+
+        names = list(pairs)
+        return dict((name, book) for name, book in zip(names, fan_out(get_one, names)) if book is not None)
@@ -1,38 +1,73 @@
+import calendar
 import time
 import json
+from decimal import Decimal
 from moneyed.classes import Money, MultiMoney
-from exchange_util import exchange_config, ExchangeABC, ExchangeError, create_ticker, BLOCK_ORDERS, MyOrder
+from exchange_util import exchange_config, ExchangeABC, DefaultClient, LazyClient, ExchangeError, create_ticker, \
+    BLOCK_ORDERS, MyOrder, Fill, Trade
+from bitcoin_exchanges.order_rules import format_order
+from bitcoin_exchanges.symbols import get_symbol
 
 from old import poloniex
 
-polo = poloniex.poloniex(APIKey=exchange_config['poloniex']['api_creds']['key'],
-                          Secret=exchange_config['poloniex']['api_creds']['secret'])
+polo = LazyClient(lambda: poloniex.poloniex(APIKey=exchange_config['poloniex']['api_creds']['key'],
+                                             Secret=exchange_config['poloniex']['api_creds']['secret']))
 
 REQ_TIMEOUT = poloniex.REQ_TIMEOUT
 
-currencyPair='USDT_BTC'
 
 class Poloniex(ExchangeABC):
     name = 'poloniex'
     fiatcurrency = 'USD'
+    hosts = ('poloniex.com',)
+    credential_fields = None  # the shared polo client holds the credentials
+    withdrawal_currencies = ('BTC', 'LTC', 'ETH')
+    deposit_currencies = ('BTC', 'LTC', 'ETH')
 
     def __init__(self):
         super(Poloniex, self).__init__()
 
     @classmethod
-    def get_ticker(cls, **kwargs):
+    def get_ticker(cls, pair='BTC/USD', **kwargs):
+        return cls.get_tickers([pair])[pair]
+
+    @classmethod
+    def get_tickers(cls, pairs):
+        # returnTicker always returns every market, so one request covers any number of pairs
         rawticker = polo.returnTicker()
-        usdtick = rawticker['USDT_BTC']
-        return create_ticker(bid=usdtick['highestBid'], ask=usdtick['lowestAsk'],
-                             high=usdtick['high24hr'], low=usdtick['low24hr'],
-                             last=usdtick['last'], volume=usdtick['baseVolume'],
-                             timestamp=time.time(), currency='USD')
+        now = time.time()
+        tickers = {}
+        for pair in pairs:
+            symbol = get_symbol(cls.name, pair)
+            tick = rawticker[symbol.native]
+            # poloniex names pairs quote first, so its quoteVolume is in the coin traded
+            tickers[pair] = create_ticker(bid=tick['highestBid'], ask=tick['lowestAsk'],
+                                          high=tick['high24hr'], low=tick['low24hr'],
+                                          last=tick['last'], volume=tick['quoteVolume'],
+                                          timestamp=now, currency=symbol.quote, base=symbol.base)
+        return tickers
 
     @classmethod
-    def get_order_book(cls, pair=None):
-        pair = currencyPair
-        return polo.returnOrderBook(currencyPair=pair)
+    def get_order_book(cls, pair='BTC/USD', depth=None, group=None):
+        book = polo.returnOrderBook(currencyPair=get_symbol(cls.name, pair).native,
+                                    depth=depth if group is None else None)
+        return cls.limit_book(book, depth, group)
     
+    @classmethod
+    def get_public_trades(cls, pair='BTC/USD', since=None):
+        symbol = get_symbol(cls.name, pair)
+        start = int(since.timestamp) if since is not None else None
+        try:
+            resp = polo.returnMarketTradeHistory(symbol.native, start=start)
+        except ValueError as e:
+            raise ExchangeError('poloniex', '%s %s while sending get_public_trades' % (type(e), str(e)))
+        if not isinstance(resp, list):
+            raise ExchangeError('poloniex', 'unable to get trades: %r' % resp)
+        # newest first, with times in UTC
+        return [Trade(cls.name, str(t['tradeID']), 'bid' if t['type'] == 'buy' else 'ask',
+                      Money(t['rate'], symbol.quote), Money(t['amount'], symbol.base),
+                      float(calendar.timegm(time.strptime(t['date'], '%Y-%m-%d %H:%M:%S')))) for t in reversed(resp)]
+
     def get_balance(self, btype='total'):
         data = polo.returnCompleteBalances()
 
@@ -47,9 +82,9 @@ class Poloniex(ExchangeABC):
             return available
         return available + onOrders, available
             
-    def get_open_orders(self):        
+    def get_open_orders(self, pair='BTC/USD'):
         try:
-            rawos = polo.returnOpenOrders(currencyPair)
+            rawos = polo.returnOpenOrders(get_symbol(self.name, pair).native)
         except ValueError as e:
             raise ExchangeError('poloniex', '%s %s while sending to poloniex get_open_orders' % (type(e), str(e)))
         orders = []
@@ -59,8 +94,10 @@ class Poloniex(ExchangeABC):
                                   self.name, str(o['orderNumber'])))
         return orders
     
-    def create_order(self, amount, price, otype):
+    def create_order(self, amount, price, otype, pair='BTC/USD'):
+        amount, price = format_order(self.name, amount, price, otype, pair)
         rate=price
+        currencyPair = get_symbol(self.name, pair).native
         if BLOCK_ORDERS:
             return "order blocked"
         if otype == 'bid':
@@ -91,7 +128,8 @@ class Poloniex(ExchangeABC):
             return str(order['orderNumber'])
         raise ExchangeError('poloniex', 'unable to create order %r response was %r' % (params, order))
 
-    def cancel_order(self, oid):
+    def cancel_order(self, oid, pair='BTC/USD'):
+        currencyPair = get_symbol(self.name, pair).native
         params = {'currencyPair': currencyPair, 'orderNumber': oid}
 
         try:
@@ -120,20 +158,53 @@ class Poloniex(ExchangeABC):
                 success = False
         return success
             
-    def get_deposit_address(self):
+    def get_deposit_address(self, currency='BTC'):
+        self.check_deposit_currency(currency)
         result = polo.returnDepositAddresses()
-        return str(result['BTC'])
-    # TODO: returns addresses per coin
+        if currency not in result:
+            raise ExchangeError('poloniex', 'no %s deposit address has been generated' % currency)
+        return str(result[currency])
+
+    def withdraw(self, amount, address):
+        currency = str(amount.currency)
+        if currency not in self.withdrawal_currencies:
+            raise ExchangeError('poloniex', 'withdrawals of %s are not supported' % currency)
+        if BLOCK_ORDERS:
+            return "withdrawal blocked"
+        try:
+            resp = polo.withdraw(currency, str(amount.amount), address)
+        except ValueError as e:
+            raise ExchangeError('poloniex', '%s %s while sending to poloniex withdraw' % (type(e), str(e)))
+        if 'error' in resp:
+            raise ExchangeError('poloniex', resp['error'])
+        return resp
 
-    def get_transactions(self, limit=None):
-        params = {'currencyPair': currencyPair}
+    def get_transactions(self, limit=None, start=None, pair='BTC/USD'):
         try:
-            return polo.returnTradeHistory(params)
+            return polo.returnTradeHistory(get_symbol(self.name, pair).native, start=start)
         except ValueError as e:
             raise ExchangeError('poloniex', '%s %s while sending to poloniex get_transactions' % (type(e), str(e)))
 
+    def get_fills(self, since=None, pair='BTC/USD'):
+        # poloniex only pages by time, and returns the newest trades first
+        symbol = get_symbol(self.name, pair)
+        start = int(since.timestamp) if since is not None else 0
+        fills = []
+        for t in self.get_transactions(start=start, pair=pair):
+            side = 'bid' if t['type'] == 'buy' else 'ask'
+            amount = Money(t['amount'], symbol.base)
+            if side == 'bid':  # fees are taken from what was received
+                fee = amount * Decimal(t['fee'])
+            else:
+                fee = Money(t['total'], symbol.quote) * Decimal(t['fee'])
+            timestamp = calendar.timegm(time.strptime(t['date'], '%Y-%m-%d %H:%M:%S'))
+            fills.append(Fill(self.name, str(t['globalTradeID']), str(t['orderNumber']), side,
+                              Money(t['rate'], symbol.quote), amount, fee, float(timestamp)))
+        fills.reverse()
+        return fills
+
 
 
 eclass = Poloniex
-exchange = Poloniex()
+exchange = DefaultClient('poloniex')
 
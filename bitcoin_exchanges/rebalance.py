@@ -0,0 +1,223 @@
+"""
+Planning and running transfers between exchanges, to bring each one's holdings of a currency to a target.
+
+A Rebalancer reads each exchange's available balance, works out which exchanges have more than their target share
+and which have less, and solves a min-cost flow from the first to the second. Moving funds costs the withdrawal fee
+and the time the funds spend in transit, when they can't be traded, so each unit moved from one exchange to another
+costs the sender's fee rate plus IDLE_COST for each minute the transfer takes: the sender's withdrawal time, then the
+receiver's deposit confirmations. The flat withdrawal fee can't be a unit cost, so it is spread over the smallest
+transfer, which overstates it for larger ones but still prefers the cheaper senders. Each receiver is credited the
+amount less the fee, and the fee it falls short by is left in the unmet amounts. Only exchanges which can withdraw the currency (see withdrawal_currencies) send
+funds, and only those with deposit addresses for it (see deposit_currencies) receive them. Whatever can't be moved
+that way is left in the plan's unmet amounts.
+
+A plan only names the transfers. run sends them, through each exchange's withdraw, to the receiving exchange's
+deposit address, unless it is a dry run, which is the default when BLOCK_ORDERS is set.
+"""
+from collections import namedtuple
+from decimal import Decimal
+
+from moneyed.classes import Money
+
+from bitcoin_exchanges.exchange_util import BLOCK_ORDERS, ExchangeError, exchange_config, fan_out, \
+    get_live_exchange_workers
+from bitcoin_exchanges.parse_pool import from_fixed, to_fixed
+
+IDLE_COST = Decimal('0.000001')  # the cost of a unit of funds spending a minute in transit, as a fraction of it
+WITHDRAWAL_MINUTES = 30  # how long an exchange takes to send a withdrawal, unless set in exchange_config
+DEPOSIT_CONFIRMATIONS = 6  # confirmations an exchange waits for on a deposit, unless set in exchange_config
+BLOCK_MINUTES = {'BTC': 10, 'LTC': 2.5, 'ETH': 0.25}
+WITHDRAWAL_FEES = {'BTC': Decimal('0.0005'), 'LTC': Decimal('0.001'), 'ETH': Decimal('0.01')}  # per withdrawal
+MIN_TRANSFER = Decimal('0.01')  # smaller imbalances are left alone
+COST_SCALE = 10 ** 9  # unit costs are solved as integers of this precision
+
+# amount and fee are Decimals in currency. The receiver gets amount less fee, after minutes.
+Transfer = namedtuple('Transfer', ['source', 'destination', 'currency', 'amount', 'fee', 'minutes', 'address'])
+
+# transfers is a list of Transfers, and unmet is each exchange's remaining surplus (positive) or shortfall
+# (negative), by name, where the transfers can't reach its target
+Plan = namedtuple('Plan', ['currency', 'transfers', 'unmet'])
+
+
+def _setting(exchange, field, default):
+    return exchange_config.get(exchange, {}).get(field, default)
+
+
+def transfer_minutes(source, destination, currency):
+    """:return: the minutes a transfer takes, from the withdrawal request to the deposit being credited"""
+    return (_setting(source, 'withdrawal_minutes', WITHDRAWAL_MINUTES) +
+            _setting(destination, 'deposit_confirmations', DEPOSIT_CONFIRMATIONS) * BLOCK_MINUTES.get(currency, 0))
+
+
+def transfer_fee(source, currency):
+    """:return: the flat fee an exchange charges for a withdrawal"""
+    return Decimal(str(_setting(source, 'withdrawal_fees', {}).get(currency, WITHDRAWAL_FEES.get(currency, 0))))
+
+
+def min_cost_flow(supplies, demands, costs):
+    """
+    Send as much as possible from supplies to demands at the least total cost, by successive shortest paths.
+
+    :param dict supplies: the amount each source can send, as positive ints
+    :param dict demands: the amount each sink needs, as positive ints
+    :param dict costs: the unit cost of sending from a source to a sink, as ints, by (source, sink). Pairs without a
+                       cost can't send to each other.
+    :return: the amount sent by (source, sink)
+    :rtype: dict
+    """
+    supplies, demands = dict(supplies), dict(demands)
+    flows = dict((edge, 0) for edge in costs)
+    while True:
+        # Bellman-Ford over the residual graph, starting from every source with supply left. Forward edges run from
+        # ('source', s) to ('sink', t), and edges carrying flow can be undone from ('sink', t) back to ('source', s).
+        dist = dict((('source', s), 0) for s, left in supplies.iteritems() if left > 0)
+        via = {}  # node: (the edge reaching it, whether it is used forward)
+        for _ in range(len(supplies) + len(demands)):
+            changed = False
+            for edge, cost in costs.iteritems():
+                source, sink = ('source', edge[0]), ('sink', edge[1])
+                if source in dist and (sink not in dist or dist[source] + cost < dist[sink]):
+                    dist[sink] = dist[source] + cost
+                    via[sink] = (edge, True)
+                    changed = True
+                if flows[edge] > 0 and sink in dist and (source not in dist or dist[sink] - cost < dist[source]):
+                    dist[source] = dist[sink] - cost
+                    via[source] = (edge, False)
+                    changed = True
+            if not changed:
+                break
+        reachable = [t for t, need in demands.iteritems() if need > 0 and ('sink', t) in dist]
+        if not reachable:
+            return dict((edge, flow) for edge, flow in flows.iteritems() if flow > 0)
+        node = ('sink', min(reachable, key=lambda t: dist[('sink', t)]))
+        amount = demands[node[1]]
+        path = []
+        while node in via:
+            edge, forward = via[node]
+            path.append((edge, forward))
+            if not forward:
+                amount = min(amount, flows[edge])
+            node = ('source', edge[0]) if forward else ('sink', edge[1])
+        amount = min(amount, supplies[node[1]])
+        for edge, forward in path:
+            flows[edge] += amount if forward else -amount
+        supplies[node[1]] -= amount
+        demands[path[0][0][1]] -= amount
+
+
+class Rebalancer(object):
+    """Plan and run transfers of one currency between exchanges."""
+
+    def __init__(self, exchanges=None, balances=None, addresses=None):
+        """
+        :param dict exchanges: exchange clients by name. Defaults to all of the live exchanges.
+        :param BalanceAggregator balances: where to read balances. Without one, each balance is fetched when planning.
+        :param AddressPool addresses: where to get deposit addresses. Without one, each is fetched when running.
+        """
+        if exchanges is None:
+            exchanges = dict((name, mod.exchange) for name, mod in get_live_exchange_workers().iteritems())
+        self.exchanges = exchanges
+        self.balances = balances
+        self.addresses = addresses
+        self.errors = {}
+
+    def available(self, currency):
+        """
+        :return: each exchange's available balance of currency. Exchanges without a balance are left out.
+        :rtype: dict
+        """
+        if self.balances is not None:
+            return dict((name, balance[1].getMoneys(currency).amount) for name, balance in
+                        self.balances.balances.items() if name in self.exchanges)
+
+        def fetch(name):
+            try:
+                return self.exchanges[name].get_balance(btype='available').getMoneys(currency).amount
+            except ExchangeError as e:
+                self.errors[name] = e
+                return None
+
+        names = list(self.exchanges)
+        return dict((name, amount) for name, amount in zip(names, fan_out(fetch, names)) if amount is not None)
+
+    def plan(self, targets, currency='BTC', available=None, min_transfer=MIN_TRANSFER):
+        """
+        :param dict targets: each exchange's share of the total, by name, e.g. {'kraken': 1, 'bitstamp': 2}.
+                             Exchanges left out are emptied.
+        :param dict available: each exchange's available balance. Defaults to the current balances.
+        :param min_transfer: imbalances smaller than this are left alone
+        :rtype: Plan
+        """
+        if available is None:
+            available = self.available(currency)
+        total = sum(available.values())
+        weight = sum(Decimal(str(w)) for w in targets.values())
+        excess = {}
+        for name in set(available) | set(targets):
+            target = total * Decimal(str(targets.get(name, 0))) / weight if weight else Decimal(0)
+            difference = available.get(name, Decimal(0)) - target
+            if abs(difference) >= min_transfer:
+                excess[name] = to_fixed(str(difference))
+        senders = [name for name, amount in excess.items() if amount > 0 and name in self.exchanges and
+                   currency in self.exchanges[name].withdrawal_currencies]
+        supplies = dict((name, excess[name]) for name in senders)
+        demands = dict((name, -amount) for name, amount in excess.items() if amount < 0 and name in self.exchanges and
+                       currency in self.exchanges[name].deposit_currencies)
+        costs = {}
+        for source in senders:
+            fee_rate = Decimal(str(_setting(source, 'withdrawal_fee_rate', 0)))
+            fee_rate += transfer_fee(source, currency) / Decimal(str(min_transfer))
+            for sink in demands:
+                unit = fee_rate + IDLE_COST * Decimal(str(transfer_minutes(source, sink, currency)))
+                costs[(source, sink)] = int(unit * COST_SCALE)
+        transfers = []
+        for (source, sink), amount in sorted(min_cost_flow(supplies, demands, costs).items()):
+            fee = transfer_fee(source, currency)
+            excess[source] -= amount
+            excess[sink] += max(amount - to_fixed(str(fee)), 0)
+            transfers.append(Transfer(source, sink, currency, from_fixed(amount), fee,
+                                      transfer_minutes(source, sink, currency), None))
+        unmet = dict((name, from_fixed(amount)) for name, amount in excess.items() if amount)
+        return Plan(currency, transfers, unmet)
+
+    def address(self, name, currency='BTC'):
+        """:return: an exchange's deposit address for currency, from the address pool if it holds that currency"""
+        if self.addresses is not None and self.addresses.currency == currency:
+            return self.addresses.get(name, currency=currency)
+        return self.exchanges[name].get_deposit_address(currency)
+
+    def run(self, plan, dry_run=None):
+        """
+        Send a plan's transfers, concurrently. Transfers that fail are left out of the result, and their errors kept
+        in self.errors by (source, destination).
+
+        :param bool dry_run: only look up the deposit addresses, without withdrawing. Defaults to BLOCK_ORDERS.
+        :return: the sent Transfers, with their addresses, and the exchanges' responses
+        :rtype: list
+        """
+        if dry_run is None:
+            dry_run = bool(BLOCK_ORDERS)
+        self.errors = {}
+
+        def send(transfer):
+            try:
+                transfer = transfer._replace(address=self.address(transfer.destination, transfer.currency))
+                if dry_run:
+                    return transfer, 'dry run'
+                amount = Money(transfer.amount, transfer.currency)
+                return transfer, self.exchanges[transfer.source].withdraw(amount, transfer.address)
+            except ExchangeError as e:
+                self.errors[(transfer.source, transfer.destination)] = e
+                return None
+
+        return [result for result in fan_out(send, plan.transfers) if result is not None]
+
+    def rebalance(self, targets, currency='BTC', dry_run=None):
+        """
+        Plan and run the transfers to bring each exchange to its target.
+
+        :return: the Plan, and the results of running it
+        :rtype: tuple
+        """
+        plan = self.plan(targets, currency)
+        return plan, self.run(plan, dry_run)
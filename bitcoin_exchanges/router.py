@@ -0,0 +1,224 @@
+"""
+Smart order routing across the live exchanges.
+
+A Router splits a parent order, like "buy 10 BTC at no more than 400 USD", into child orders on each exchange's
+main BTC pair. Book levels from every exchange are merged by their price net of the exchange's taker fee and
+converted to USD, and taken best first while they are within the limit and the exchange's balance covers them.
+The child orders are sent concurrently, and what is left unfilled is cancelled and routed again.
+"""
+from collections import namedtuple
+from decimal import Decimal
+import heapq
+import time
+
+from requests.exceptions import ConnectionError, Timeout
+
+from bitcoin_exchanges.exchange_util import BLOCK_ORDERS, ExchangeError, exchange_config, fan_out, \
+    get_live_exchange_workers
+from bitcoin_exchanges.order_rules import format_order, set_reference_price
+from bitcoin_exchanges.symbols import get_symbol
+
+BOOK_DEPTH = 20  # levels fetched per exchange
+# taker fees as a fraction, overridden by a 'taker_fee' entry in an exchange's exchange_config
+TAKER_FEES = {
+    'bitfinex': '0.002',
+    'bitstamp': '0.0025',
+    'btcchina': '0',
+    'btce': '0.002',
+    'huobi': '0',
+    'kraken': '0.0026',
+    'lakebtc': '0.002',
+    'okcoin': '0.002',
+    'poloniex': '0.0025',
+}
+# exchanges which return no order ids, so their orders can not be followed up and re-routed
+UNTRACKED = ('btcchina',)
+
+# order_id is None until submitted, and error is set if the exchange refused it
+ChildOrder = namedtuple('ChildOrder', ['exchange', 'side', 'amount', 'price', 'order_id', 'error'])
+# one exchange's book and available balance, as seen by the router
+Venue = namedtuple('Venue', ['exchange', 'symbol', 'fee', 'fx', 'levels', 'balance'])
+
+
+def get_taker_fee(exchange):
+    """
+    :rtype: Decimal
+    """
+    return Decimal(str(exchange_config.get(exchange, {}).get('taker_fee', TAKER_FEES.get(exchange, '0'))))
+
+
+class Router(object):
+    def __init__(self, exchanges=None, fx=None, depth=BOOK_DEPTH, min_health=None):
+        """
+        :param dict exchanges: exchange modules by name. Defaults to all of the live exchanges.
+        :param dict fx: the USD value of one unit of each quote currency, e.g. {'EUR': '1.1', 'CNY': '0.16'}.
+                        Exchanges quoting in a currency without a rate are not routed to.
+        :param int depth: the book levels to consider on each exchange
+        :param float min_health: skip exchanges whose health is below this (see exchange_util.exchange_health)
+        """
+        if exchanges is None:
+            exchanges = get_live_exchange_workers(min_health=min_health)
+        self.exchanges = exchanges
+        self.fx = dict((currency, Decimal(str(rate))) for currency, rate in (fx or {}).iteritems())
+        self.fx.setdefault('USD', Decimal(1))
+        self.depth = depth
+        self.errors = {}
+
+    def venues(self, side, exclude=()):
+        """
+        Get the books and balances on every exchange concurrently. Exchanges that fail are left out,
+        and their errors are kept in self.errors.
+
+        :param str side: 'bid' to buy from the asks, or 'ask' to sell into the bids
+        :param exclude: names of exchanges not to route to
+        :return: a Venue for each exchange
+        :rtype: list
+        """
+        self.errors = {}
+
+        def venue(name):
+            mod = self.exchanges[name]
+            symbol = get_symbol(name)
+            if symbol.base != 'BTC' or symbol.quote not in self.fx:
+                return None
+            try:
+                book = mod.eclass.get_order_book(depth=self.depth)
+                balance = mod.exchange.get_balance(btype='available')
+            except (ExchangeError, ConnectionError, Timeout) as e:
+                self.errors[name] = e
+                return None
+            levels = [mod.eclass.format_book_item(item) for item in book['asks' if side == 'bid' else 'bids']]
+            if levels:
+                set_reference_price(name, symbol.pair, levels[0].price)  # for exchanges with a price band
+            have = balance.getMoneys(symbol.quote if side == 'bid' else symbol.base).amount
+            return Venue(name, symbol, get_taker_fee(name), self.fx[symbol.quote], levels, have)
+
+        names = [name for name in self.exchanges if name not in exclude]
+        return [v for v in fan_out(venue, names) if v is not None]
+
+    @staticmethod
+    def plan(venues, side, amount, limit):
+        """
+        Split an order across venues, taking the levels with the best price net of fees first.
+
+        :param list venues: Venues, with their levels best first
+        :param str side: 'bid' or 'ask'
+        :param amount: the BTC to buy or sell
+        :param limit: the worst USD price to trade at, net of fees
+        :return: the child orders, unsent
+        :rtype: list
+        """
+        buy = side == 'bid'
+        amount, limit = Decimal(str(amount)), Decimal(str(limit))
+
+        def stream(i, venue):
+            for level in venue.levels:
+                value = level.price * venue.fx * (1 + venue.fee if buy else 1 - venue.fee)
+                yield (value if buy else -value), i, level  # negated for sells, so the best sorts first
+
+        streams = [stream(i, venue) for i, venue in enumerate(venues)]
+        taken = {}  # venue index: [amount, worst price]
+        spent = [Decimal(0)] * len(venues)  # quote currency for buys, BTC for sells
+        remaining = amount
+        for value, i, level in heapq.merge(*streams):
+            if remaining <= 0 or (value > limit if buy else -value < limit):
+                break
+            venue = venues[i]
+            take = min(remaining, level.amount)
+            if buy:
+                take = min(take, (venue.balance - spent[i]) / (level.price * (1 + venue.fee)))
+                spent[i] += take * level.price * (1 + venue.fee)
+            else:
+                take = min(take, venue.balance - spent[i])
+                spent[i] += take
+            if take <= 0:
+                continue
+            child = taken.setdefault(i, [Decimal(0), level.price])
+            child[0] += take
+            child[1] = level.price
+            remaining -= take
+
+        children = []
+        for i, (child_amount, price) in sorted(taken.items()):
+            try:
+                child_amount, price = format_order(venues[i].exchange, child_amount, price, side)
+            except ExchangeError:
+                continue  # too small for the exchange, so left for the next round
+            children.append(ChildOrder(venues[i].exchange, side, Decimal(child_amount), Decimal(price), None, None))
+        return children
+
+    def submit(self, children):
+        """
+        Send child orders concurrently.
+
+        :return: the child orders, with their order ids or errors
+        :rtype: list
+        """
+        def send(child):
+            try:
+                oid = self.exchanges[child.exchange].exchange.create_order(amount=child.amount, price=child.price,
+                                                                           otype=child.side)
+            except (ExchangeError, ConnectionError, Timeout) as e:
+                return child._replace(error=e)
+            return child._replace(order_id=oid)
+
+        return fan_out(send, children)
+
+    def unfilled(self, children):
+        """
+        Cancel whatever is still open of the child orders.
+
+        :return: the BTC left unfilled
+        :rtype: Decimal
+        """
+        def cancel_open(exchange):
+            ids = set(c.order_id for c in children if c.exchange == exchange)
+            try:
+                orders = [o for o in self.exchanges[exchange].exchange.get_open_orders() if o.order_id in ids]
+                left = Decimal(0)
+                for o in orders:
+                    if self.exchanges[exchange].exchange.cancel_order(o.order_id):
+                        left += o.amount.amount
+                return left
+            except (ExchangeError, ConnectionError, Timeout) as e:
+                self.errors[exchange] = e
+                return Decimal(0)
+
+        sent = sorted(set(c.exchange for c in children if c.order_id is not None and c.exchange not in UNTRACKED))
+        left = sum(fan_out(cancel_open, sent), Decimal(0))
+        return left + sum((c.amount for c in children if c.error is not None), Decimal(0))
+
+    def route(self, side, amount, limit, dry_run=None, rounds=3, wait=2):
+        """
+        Work a parent order: plan, send the child orders, then cancel and re-route whatever is left unfilled.
+        When there is more than one round, the UNTRACKED exchanges are not routed to, as what is left open on them
+        would be counted as filled.
+
+        :param str side: 'bid' or 'ask'
+        :param amount: the BTC to buy or sell
+        :param limit: the worst USD price to trade at, net of fees
+        :param bool dry_run: only plan the first round, without sending anything. Defaults to BLOCK_ORDERS.
+        :param int rounds: the most times to route the remainder
+        :param float wait: seconds to give the child orders to fill before re-routing
+        :return: every child order, and the BTC left unfilled
+        :rtype: tuple
+        """
+        if dry_run is None:
+            dry_run = BLOCK_ORDERS
+        remaining = Decimal(str(amount))
+        orders = []
+        exclude = UNTRACKED if rounds > 1 else ()
+        for i in range(rounds):
+            children = self.plan(self.venues(side, exclude), side, remaining, limit)
+            if dry_run:
+                return children, remaining - sum((c.amount for c in children), Decimal(0))
+            if not children:
+                break
+            children = self.submit(children)
+            orders.extend(children)
+            remaining -= sum(c.amount for c in children)
+            time.sleep(wait)
+            remaining += self.unfilled(children)
+            if remaining <= 0:
+                break
+        return orders, remaining
@@ -0,0 +1,504 @@
+"""
+Streaming market data from the exchanges' websocket feeds.
+
+A MarketStream keeps a live OrderBook per pair, and passes on tickers and trades as the same
+Ticker and Trade tuples the REST clients return. Books are re-synced from the REST get_order_book
+whenever the feed skips an update or reconnects.
+
+Requires the websocket-client package.
+"""
+import abc
+import importlib
+import json
+import socket
+import threading
+import time
+from decimal import Decimal
+
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
+from moneyed import Money
+
+from bitcoin_exchanges.exchange_util import ExchangeError, OrderbookItem, Trade, create_ticker
+from bitcoin_exchanges import transport
+from bitcoin_exchanges.symbols import get_symbol
+
+CONNECT_TIMEOUT = 10  # seconds
+RECV_TIMEOUT = 1  # seconds, how often the stream checks for staleness and stop requests
+STALE_AFTER = 30  # seconds without a message before reconnecting
+RECONNECT_DELAY = 1  # seconds, doubling on each failure up to MAX_RECONNECT_DELAY
+MAX_RECONNECT_DELAY = 60
+
+
+class OrderBook(object):
+    """The bids and asks for one pair, kept as amounts by price."""
+
+    def __init__(self, exchange, pair):
+        self.exchange = exchange
+        self.pair = pair
+        self.sequence = None
+        self.timestamp = None
+        self.synced = False
+        self._bids = {}
+        self._asks = {}
+        self._lock = threading.Lock()
+
+    def load(self, bids, asks, sequence=None, timestamp=None):
+        """
+        Replace the whole book.
+
+        :param list bids: OrderbookItems
+        :param list asks: OrderbookItems
+        """
+        with self._lock:
+            self._bids = dict((item.price, item.amount) for item in bids if item.amount)
+            self._asks = dict((item.price, item.amount) for item in asks if item.amount)
+            self.sequence = sequence
+            self.timestamp = timestamp
+            self.synced = True
+
+    def update(self, side, price, amount):
+        """
+        Set the amount at a price level. An amount of 0 removes the level.
+
+        :param str side: 'bid' or 'ask'
+        """
+        levels = self._bids if side == 'bid' else self._asks
+        with self._lock:
+            if amount:
+                levels[price] = amount
+            else:
+                levels.pop(price, None)
+
+    def bids(self, depth=None):
+        """
+        :return: the best depth bids, highest first
+        :rtype: list
+        """
+        with self._lock:
+            prices = sorted(self._bids, reverse=True)[:depth]
+            return [OrderbookItem(price, self._bids[price]) for price in prices]
+
+    def asks(self, depth=None):
+        """
+        :return: the best depth asks, lowest first
+        :rtype: list
+        """
+        with self._lock:
+            prices = sorted(self._asks)[:depth]
+            return [OrderbookItem(price, self._asks[price]) for price in prices]
+
+    def best_bid(self):
+        bids = self.bids(1)
+        return bids[0] if bids else None
+
+    def best_ask(self):
+        asks = self.asks(1)
+        return asks[0] if asks else None
+
+
+class Feed(object):
+    """
+    Translates one exchange's websocket protocol into MarketStream calls.
+
+    Subclasses set the url, and implement subscriptions and handle.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    name = None
+    url = None
+    rest_sync = True  # whether books come from the REST api, or are pushed whole by the feed
+    keepalive_interval = None  # seconds between keepalive messages, if the exchange requires them
+
+    def __init__(self, pairs):
+        """
+        :param list pairs: the pairs to subscribe to, by any of their names (see symbols.get_symbol)
+        """
+        self.symbols = dict((symbol.pair, symbol) for symbol in (get_symbol(self.name, pair) for pair in pairs))
+        self.pairs = [get_symbol(self.name, pair).pair for pair in pairs]
+
+    @property
+    def eclass(self):
+        return importlib.import_module('bitcoin_exchanges.%s' % self.name).eclass
+
+    def subscriptions(self):
+        """
+        :return: the messages to send after connecting
+        :rtype: list
+        """
+        return []
+
+    def keepalive(self):
+        """
+        :return: a message to send every keepalive_interval seconds
+        """
+        return None
+
+    @abc.abstractmethod
+    def handle(self, message, stream):
+        """
+        Handle one decoded message, calling the stream's ticker, trade, book_snapshot and book_update methods.
+        """
+        pass
+
+    def snapshot(self, pair):
+        """
+        Get a book from the REST api.
+
+        :return: the bids and asks as OrderbookItems, and the book's sequence number and timestamp, if any
+        :rtype: tuple
+        """
+        raw = self.eclass.get_order_book(pair)
+        if not raw or 'bids' not in raw:
+            raise ExchangeError(self.name, 'unable to get order book for %s, response was %r' % (pair, raw))
+        bids = [self.eclass.format_book_item(item) for item in raw['bids']]
+        asks = [self.eclass.format_book_item(item) for item in raw['asks']]
+        timestamp = float(raw['timestamp']) if 'timestamp' in raw else None
+        return bids, asks, None, timestamp
+
+
+class BitfinexFeed(Feed):
+    """
+    Bitfinex pushes a whole book when subscribing, then level updates.
+    Book, ticker and trade messages are identified by the channel id given on subscription.
+    """
+    name = 'bitfinex'
+    url = 'wss://api.bitfinex.com/ws'
+    rest_sync = False
+
+    def __init__(self, pairs=('BTC/USD',)):
+        super(BitfinexFeed, self).__init__(pairs)
+        self.channels = {}
+
+    def subscriptions(self):
+        self.channels = {}
+        messages = []
+        for pair in self.pairs:
+            native = self.symbols[pair].native.upper()
+            messages.append({'event': 'subscribe', 'channel': 'book', 'pair': native, 'prec': 'P0'})
+            messages.append({'event': 'subscribe', 'channel': 'ticker', 'pair': native})
+            messages.append({'event': 'subscribe', 'channel': 'trades', 'pair': native})
+        return messages
+
+    def handle(self, message, stream):
+        if isinstance(message, dict):
+            if message.get('event') == 'subscribed':
+                self.channels[message['chanId']] = (message['channel'], get_symbol(self.name, message['pair']).pair)
+            elif message.get('event') == 'info' and message.get('code') == 20051:
+                stream.reconnect()  # bitfinex is restarting
+            return
+        if message[0] not in self.channels or message[1] == 'hb':
+            return
+        channel, pair = self.channels[message[0]]
+        symbol = self.symbols[pair]
+        if channel == 'book':
+            if isinstance(message[1], list):
+                bids, asks = [], []
+                for price, count, amount in message[1]:
+                    item = OrderbookItem(Decimal(str(price)), abs(Decimal(str(amount))))
+                    (bids if amount > 0 else asks).append(item)
+                stream.book_snapshot(pair, bids, asks)
+            else:
+                price, count, amount = message[1:4]
+                side = 'bid' if amount > 0 else 'ask'
+                stream.book_update(pair, [(side, Decimal(str(price)), abs(Decimal(str(amount))) if count else 0)])
+        elif channel == 'ticker':
+            bid, bid_size, ask, ask_size, change, change_perc, last, volume, high, low = map(str, message[1:11])
+            stream.ticker(pair, create_ticker(bid=bid, ask=ask, high=high, low=low, volume=volume, last=last,
+                                              timestamp=time.time(), currency=symbol.quote, base=symbol.base))
+        elif channel == 'trades' and message[1] == 'te':
+            seq, timestamp, price, amount = message[2:6]
+            stream.trade(pair, Trade(self.name, str(seq), 'bid' if amount > 0 else 'ask',
+                                     Money(str(price), symbol.quote), Money(str(abs(amount)), symbol.base),
+                                     float(timestamp)))
+
+
+class BitstampFeed(Feed):
+    """
+    Bitstamp publishes through Pusher. Book updates give the new amount at each changed price,
+    so updates from before the REST snapshot can be dropped by their timestamp.
+    """
+    name = 'bitstamp'
+    url = 'wss://ws.pusherapp.com/app/de504dc5763aeef9ff52?protocol=7&client=bitcoin_exchanges&version=0.0.3'
+
+    def __init__(self, pairs=('BTC/USD',)):
+        super(BitstampFeed, self).__init__(pairs)
+
+    def subscriptions(self):
+        return [{'event': 'pusher:subscribe', 'data': {'channel': channel}}
+                for channel in ('diff_order_book', 'live_trades')]
+
+    def handle(self, message, stream):
+        event = message.get('event')
+        if event == 'pusher:ping':
+            stream.send({'event': 'pusher:pong', 'data': {}})
+            return
+        if event not in ('data', 'trade'):
+            return
+        data = message['data']
+        if isinstance(data, basestring):
+            data = transport.decode(data)
+        pair = self.pairs[0]
+        if event == 'data':
+            changes = [('bid', Decimal(price), Decimal(amount)) for price, amount in data['bids']]
+            changes.extend(('ask', Decimal(price), Decimal(amount)) for price, amount in data['asks'])
+            timestamp = float(data['timestamp']) if 'timestamp' in data else None
+            stream.book_update(pair, changes, timestamp=timestamp)
+        else:
+            side = 'ask' if data.get('type') == 1 else 'bid'
+            stream.trade(pair, Trade(self.name, str(data['id']), side, Money(str(data['price']), 'USD'),
+                                     Money(str(data['amount'])), float(data.get('timestamp', time.time()))))
+
+
+class OKCoinFeed(Feed):
+    """
+    OKCoin pushes the top of the book whole each time it changes, so there are no updates to lose.
+    It closes connections which have not sent a ping for 30 seconds.
+    """
+    name = 'okcoin'
+    url = 'wss://real.okcoin.com:10440/websocket/okcoinapi'
+    rest_sync = False
+    keepalive_interval = 20
+    depth = 20
+
+    def __init__(self, pairs=('BTC/USD',)):
+        super(OKCoinFeed, self).__init__(pairs)
+        self.channels = {}
+
+    def channel(self, pair, kind):
+        symbol = self.symbols[pair]
+        return 'ok_sub_spot%s_%s_%s' % (symbol.quote.lower(), symbol.base.lower(), kind)
+
+    def subscriptions(self):
+        self.channels = {}
+        messages = []
+        for pair in self.pairs:
+            for kind in ('ticker', 'depth_%d' % self.depth, 'trades'):
+                self.channels[self.channel(pair, kind)] = (kind.split('_')[0], pair)
+                messages.append({'event': 'addChannel', 'channel': self.channel(pair, kind)})
+        return messages
+
+    def keepalive(self):
+        return {'event': 'ping'}
+
+    def handle(self, message, stream):
+        for item in message if isinstance(message, list) else [message]:
+            if not isinstance(item, dict) or item.get('channel') not in self.channels or 'data' not in item:
+                continue
+            kind, pair = self.channels[item['channel']]
+            symbol = self.symbols[pair]
+            data = item['data']
+            if kind == 'ticker':
+                stream.ticker(pair, create_ticker(bid=data['buy'], ask=data['sell'], high=data['high'],
+                                                  low=data['low'], volume=str(data['vol']).replace(',', ''),
+                                                  last=data['last'], timestamp=float(data['timestamp']) / 1000,
+                                                  currency=symbol.quote, base=symbol.base))
+            elif kind == 'depth':
+                stream.book_snapshot(pair,
+                                     [OrderbookItem(Decimal(str(p)), Decimal(str(a))) for p, a in data['bids']],
+                                     [OrderbookItem(Decimal(str(p)), Decimal(str(a))) for p, a in data['asks']],
+                                     timestamp=float(data['timestamp']) / 1000)
+            elif kind == 'trades':
+                for tid, price, amount, at, side in data:
+                    stream.trade(pair, Trade(self.name, str(tid), 'ask' if side == 'ask' else 'bid',
+                                             Money(str(price), symbol.quote), Money(str(amount), symbol.base),
+                                             time.time()))
+
+
+FEEDS = {
+    'bitfinex': BitfinexFeed,
+    'bitstamp': BitstampFeed,
+    'okcoin': OKCoinFeed,
+}
+
+
+class MarketStream(object):
+    """
+    Consume one exchange's feed in a background thread, reconnecting with backoff.
+
+    Book updates which arrive before a book is synced are held, then replayed on top of the REST snapshot.
+    An update with a gap in its sequence numbers triggers a re-sync.
+    """
+
+    def __init__(self, feed, on_ticker=None, on_trade=None, on_book=None, url=None, stale_after=STALE_AFTER):
+        """
+        :param Feed feed: the exchange's feed
+        :param on_ticker: called with the pair and each Ticker
+        :param on_trade: called with the pair and each Trade
+        :param on_book: called with each OrderBook after it changes
+        :param str url: overrides the feed's url, e.g. for a local stand-in
+        :param int stale_after: seconds without a message before reconnecting
+        """
+        self.feed = feed
+        self.url = url or feed.url
+        self.on_ticker = on_ticker
+        self.on_trade = on_trade
+        self.on_book = on_book
+        self.stale_after = stale_after
+        self.books = dict((pair, OrderBook(feed.name, pair)) for pair in feed.pairs)
+        self.tickers = {}
+        self.connected = threading.Event()
+        self.last_error = None
+        self._pending = dict((pair, []) for pair in feed.pairs)
+        self._ws = None
+        self._reconnect = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if websocket is None:
+            raise ExchangeError(self.feed.name, 'streaming requires the websocket-client package')
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='%s-stream' % self.feed.name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def run(self):
+        delay = RECONNECT_DELAY
+        while not self._stop.is_set():
+            try:
+                self._connect()
+                delay = RECONNECT_DELAY
+                self._receive()
+            except Exception as e:
+                # including errors handling a message, which are as likely to be fixed by a re-sync
+                self.last_error = '%s %s' % (type(e).__name__, e)
+            finally:
+                self._close()
+            if not self._stop.wait(delay):
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    def _connect(self):
+        self._reconnect = False
+        self._ws = websocket.create_connection(self.url, timeout=CONNECT_TIMEOUT)
+        self._ws.settimeout(RECV_TIMEOUT)
+        for message in self.feed.subscriptions():
+            self.send(message)
+        for pair, book in self.books.iteritems():
+            book.synced = False
+            if self.feed.rest_sync:
+                self.resync(pair)
+        self.connected.set()
+
+    def _receive(self):
+        last_message = last_keepalive = time.time()
+        while not self._stop.is_set() and not self._reconnect:
+            try:
+                raw = self._ws.recv()
+            except websocket.WebSocketTimeoutException:
+                raw = None
+            now = time.time()
+            if raw:
+                last_message = now
+                self.feed.handle(transport.decode(raw), self)
+            elif now - last_message > self.stale_after:
+                raise ExchangeError(self.feed.name, 'no message for %d seconds' % self.stale_after)
+            interval = self.feed.keepalive_interval
+            if interval is not None and now - last_keepalive > interval:
+                self.send(self.feed.keepalive())
+                last_keepalive = now
+
+    def _close(self):
+        self.connected.clear()
+        if self._ws is not None:
+            try:
+                self._ws.close()
+            except (websocket.WebSocketException, socket.error):
+                pass
+            self._ws = None
+
+    def send(self, message):
+        self._ws.send(json.dumps(message))
+
+    def reconnect(self):
+        """Drop the connection after the current message. The stream reconnects and re-syncs."""
+        self._reconnect = True
+
+    def resync(self, pair):
+        """Reload a book from the REST api, then replay the updates held while it was out of sync."""
+        book = self.books[pair]
+        book.synced = False
+        bids, asks, sequence, timestamp = self.feed.snapshot(pair)
+        book.load(bids, asks, sequence, timestamp)
+        pending, self._pending[pair] = self._pending[pair], []
+        for changes, sequence, timestamp in pending:
+            # the snapshot may not say which update it is up to, so any gap after it cannot be checked
+            if not self._is_stale(book, sequence, timestamp):
+                self._apply(book, changes, sequence)
+        if self.on_book is not None:
+            self.on_book(book)
+
+    def ticker(self, pair, ticker):
+        self.tickers[pair] = ticker
+        if self.on_ticker is not None:
+            self.on_ticker(pair, ticker)
+
+    def trade(self, pair, trade):
+        if self.on_trade is not None:
+            self.on_trade(pair, trade)
+
+    def book_snapshot(self, pair, bids, asks, sequence=None, timestamp=None):
+        book = self.books[pair]
+        book.load(bids, asks, sequence, timestamp)
+        if self.on_book is not None:
+            self.on_book(book)
+
+    def book_update(self, pair, changes, sequence=None, timestamp=None):
+        """
+        :param list changes: (side, price, amount) tuples, an amount of 0 removing the price level
+        :param int sequence: the update's sequence number, if the feed numbers them
+        :param float timestamp: the update's time, if the feed gives one
+        """
+        book = self.books[pair]
+        if not book.synced:
+            self._pending[pair].append((changes, sequence, timestamp))
+            return
+        if self._is_stale(book, sequence, timestamp):
+            return
+        if sequence is not None and book.sequence is not None and sequence != book.sequence + 1:
+            self._pending[pair].append((changes, sequence, timestamp))
+            self.resync(pair)
+            return
+        self._apply(book, changes, sequence)
+        if self.on_book is not None:
+            self.on_book(book)
+
+    @staticmethod
+    def _is_stale(book, sequence, timestamp):
+        """Whether an update is already included in the book."""
+        if sequence is not None and book.sequence is not None:
+            return sequence <= book.sequence
+        return timestamp is not None and book.timestamp is not None and timestamp < book.timestamp
+
+    @staticmethod
+    def _apply(book, changes, sequence):
+        for side, price, amount in changes:
+            book.update(side, price, amount)
+        if sequence is not None:
+            book.sequence = sequence
+
+
+def stream(exchange, pairs=None, **kwargs):
+    """
+    Start streaming an exchange's market data.
+
+    :param str exchange: the exchange name
+    :param list pairs: the pairs to subscribe to, by any of their names. Defaults to the exchange's main pair.
+    :param kwargs: passed to MarketStream
+    :rtype: MarketStream
+    """
+    if exchange not in FEEDS:
+        raise ExchangeError(exchange, 'no streaming feed')
+    feed = FEEDS[exchange](pairs) if pairs is not None else FEEDS[exchange]()
+    market = MarketStream(feed, **kwargs)
+    market.start()
+    return market
@@ -0,0 +1,112 @@
+"""
+The pairs each exchange trades, and how the exchange names them.
+
+Pairs are named canonically as 'BASE/QUOTE', e.g. 'BTC/USD'. Every client also accepts the exchange's
+own symbol (e.g. 'XXBTZEUR' on kraken) and the common spellings 'btcusd', 'btc_usd' and 'BTCUSD'.
+All of the names are worked out once, when this module is imported, so a lookup is a single dict access.
+"""
+from collections import namedtuple
+
+from bitcoin_exchanges.exchange_util import ExchangeError
+
+# native is the exchange's symbol for the pair, and url the fragment used in its public api urls
+Symbol = namedtuple('Symbol', ['exchange', 'pair', 'native', 'url', 'base', 'quote', 'price_precision',
+                               'amount_precision'])
+
+# (pair, native symbol, url fragment, price decimals, amount decimals) by exchange. The first is the default.
+SYMBOLS = {
+    'bitfinex': [
+        ('BTC/USD', 'btcusd', 'btcusd', 3, 3),
+        ('LTC/USD', 'ltcusd', 'ltcusd', 3, 3),
+        ('LTC/BTC', 'ltcbtc', 'ltcbtc', 5, 3),
+        ('ETH/USD', 'ethusd', 'ethusd', 3, 3),
+        ('ETH/BTC', 'ethbtc', 'ethbtc', 5, 3),
+    ],
+    'bitstamp': [
+        ('BTC/USD', 'btcusd', '', 2, 8),
+    ],
+    'btcchina': [
+        ('BTC/CNY', 'btccny', 'btccny', 2, 4),
+        ('LTC/CNY', 'ltccny', 'ltccny', 2, 3),
+        ('LTC/BTC', 'ltcbtc', 'ltcbtc', 4, 3),
+    ],
+    'btce': [
+        ('BTC/USD', 'btc_usd', 'btc_usd', 3, 8),
+        ('BTC/EUR', 'btc_eur', 'btc_eur', 3, 8),
+        ('LTC/USD', 'ltc_usd', 'ltc_usd', 3, 8),
+        ('LTC/BTC', 'ltc_btc', 'ltc_btc', 5, 8),
+    ],
+    'huobi': [
+        ('BTC/CNY', 'btc', 'btc', 2, 4),
+        ('LTC/CNY', 'ltc', 'ltc', 2, 4),
+    ],
+    'kraken': [
+        ('BTC/EUR', 'XXBTZEUR', 'XXBTZEUR', 5, 8),
+        ('BTC/USD', 'XXBTZUSD', 'XXBTZUSD', 5, 8),
+        ('LTC/EUR', 'XLTCZEUR', 'XLTCZEUR', 5, 8),
+        ('LTC/BTC', 'XLTCXXBT', 'XLTCXXBT', 6, 8),
+        ('ETH/EUR', 'XETHZEUR', 'XETHZEUR', 5, 8),
+        ('ETH/BTC', 'XETHXXBT', 'XETHXXBT', 5, 8),
+    ],
+    'lakebtc': [
+        ('BTC/CNY', 'btc_cny', 'bcorderbook_cny', 2, 3),
+        ('BTC/USD', 'btc_usd', 'bcorderbook', 2, 3),
+    ],
+    'okcoin': [
+        ('BTC/USD', 'btc_usd', 'btc_usd', 2, 3),
+        ('LTC/USD', 'ltc_usd', 'ltc_usd', 2, 3),
+    ],
+    'poloniex': [
+        ('BTC/USD', 'USDT_BTC', 'USDT_BTC', 8, 8),
+        ('ETH/USD', 'USDT_ETH', 'USDT_ETH', 8, 8),
+        ('LTC/USD', 'USDT_LTC', 'USDT_LTC', 8, 8),
+        ('ETH/BTC', 'BTC_ETH', 'BTC_ETH', 8, 8),
+        ('LTC/BTC', 'BTC_LTC', 'BTC_LTC', 8, 8),
+    ],
+}
+
+_by_name = {}
+_by_exchange = {}
+
+
+def register(exchange, pair, native, url, price_precision, amount_precision):
+    """
+    Add a pair to an exchange, under all of its names.
+
+    :rtype: Symbol
+    """
+    base, quote = pair.split('/')
+    symbol = Symbol(exchange, pair, native, url, base, quote, price_precision, amount_precision)
+    for name in (pair, pair.lower(), base + quote, (base + quote).lower(), base + '_' + quote,
+                 (base + '_' + quote).lower(), native):
+        _by_name[(exchange, name)] = symbol
+    if symbol not in _by_exchange.setdefault(exchange, []):
+        _by_exchange[exchange].append(symbol)
+    return symbol
+
+
+def get_symbol(exchange, pair=None):
+    """
+    :param str exchange: the exchange name
+    :param str pair: the pair by any of its names. Defaults to the exchange's main pair.
+    :rtype: Symbol
+    """
+    if pair is None:
+        return _by_exchange[exchange][0]
+    try:
+        return _by_name[(exchange, pair)]
+    except KeyError:
+        raise ExchangeError(exchange, 'unknown pair %r' % (pair,))
+
+
+def get_symbols(exchange):
+    """
+    :return: all of the pairs an exchange trades, default first
+    :rtype: list
+    """
+    return list(_by_exchange.get(exchange, []))
+
+
+for _exchange, _symbols in SYMBOLS.iteritems():
+    for _symbol in _symbols:
+        register(_exchange, *_symbol)
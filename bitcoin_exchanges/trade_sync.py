@@ -0,0 +1,148 @@
+"""
+Incremental trade history sync.
+
+A CursorStore remembers the last fill seen on each exchange, so a sync only asks
+each exchange for fills newer than that, instead of downloading the full history.
+"""
+import json
+import os
+import threading
+
+from bitcoin_exchanges.exchange_util import Fill, ExchangeError, fan_out, get_live_exchange_workers
+
+
+class CursorStore(object):
+    """
+    A local json file holding one cursor per exchange.
+
+    A cursor is the id and timestamp of the newest fill seen, along with the ids of every
+    fill sharing that timestamp, since most exchanges treat their cursors inclusively.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                self._cursors = json.load(f)
+        else:
+            self._cursors = {}
+
+    def get(self, exchange):
+        """
+        :return: the last Fill seen on an exchange (only its id and timestamp are set), or None
+        """
+        cursor = self._cursors.get(exchange)
+        if cursor is None:
+            return None
+        return Fill(exchange, cursor['fill_id'], None, None, None, None, None, cursor['timestamp'])
+
+    def seen(self, exchange):
+        """
+        :return: the ids of the fills remembered for dedupe: those at the cursor's timestamp, and any within the
+                 exchange's lookback window before it
+        :rtype: set
+        """
+        cursor = self._cursors.get(exchange)
+        return set(self._seen(cursor)) if cursor is not None else set()
+
+    @staticmethod
+    def _seen(cursor):
+        """:return: the timestamp of each remembered fill id, by id"""
+        # older files hold only the ids at the cursor's timestamp
+        return dict(s if isinstance(s, list) else (s, cursor['timestamp']) for s in cursor['seen'])
+
+    def update(self, exchange, fills, lookback=0):
+        """
+        Advance an exchange's cursor past a list of new fills, sorted oldest first.
+
+        :param lookback: seconds before the cursor to keep remembering fill ids for, for exchanges which can report
+                         fills older than ones already seen
+        """
+        if not fills:
+            return
+        with self._lock:
+            previous = self._cursors.get(exchange)
+            seen = self._seen(previous) if previous is not None else {}
+            for f in fills:
+                seen[f.fill_id] = f.timestamp
+            last = max(fills, key=lambda f: f.timestamp)
+            if previous is not None and previous['timestamp'] > last.timestamp:
+                fill_id, timestamp = previous['fill_id'], previous['timestamp']
+            else:
+                fill_id, timestamp = last.fill_id, last.timestamp
+            self._cursors[exchange] = {'fill_id': fill_id, 'timestamp': timestamp,
+                                       'seen': sorted([i, t] for i, t in seen.iteritems() if t >= timestamp - lookback)}
+            self._save()
+
+    def reset(self, exchange):
+        """Forget an exchange's cursor, so the next sync downloads its full history."""
+        with self._lock:
+            self._cursors.pop(exchange, None)
+            self._save()
+
+    def _save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._cursors, f)
+        os.rename(tmp_path, self.path)
+
+
+class TradeSync(object):
+    """
+    Fetch only the new fills from each exchange, deduplicated and in the common Fill format.
+    """
+
+    def __init__(self, store, exchanges=None):
+        """
+        :param CursorStore store: where the cursors are kept between runs
+        :param dict exchanges: exchange clients by name. Defaults to all of the live exchanges.
+        """
+        self.store = store
+        if exchanges is None:
+            exchanges = dict((name, mod.exchange) for name, mod in get_live_exchange_workers().iteritems())
+        self.exchanges = exchanges
+        self.errors = {}
+
+    def sync(self, name):
+        """
+        Get the fills on an exchange since the last sync, and advance its cursor.
+
+        :return: the new fills, oldest first
+        :rtype: list
+        """
+        client = self.exchanges[name]
+        lookback = getattr(client, 'fill_lookback', 0)
+        cursor = self.store.get(name)
+        seen = self.store.seen(name)
+        fills = []
+        for fill in sorted(client.get_fills(since=cursor), key=lambda f: f.timestamp):
+            if cursor is not None and fill.timestamp < cursor.timestamp - lookback:
+                continue
+            if fill.fill_id in seen:
+                continue
+            seen.add(fill.fill_id)
+            fills.append(fill)
+        self.store.update(name, fills, lookback)
+        return fills
+
+    def sync_all(self):
+        """
+        Sync every exchange concurrently. Exchanges that fail are left out of the result,
+        and their errors are kept in self.errors.
+
+        :return: the new fills by exchange name
+        :rtype: dict
+        """
+        self.errors = {}
+
+        def sync_one(name):
+            try:
+                return self.sync(name)
+            except ExchangeError as e:
+                self.errors[name] = e
+                return None
+
+        names = list(self.exchanges)
+        results = fan_out(sync_one, names)
+        return dict((name, fills) for name, fills in zip(names, results) if fills is not None)
@@ -0,0 +1,233 @@
+"""
+A tape of each exchange's public trades, with rolling statistics.
+
+A TapeReader polls get_public_trades on each exchange, passing the last trade seen as the cursor, and drops the
+trades it has already seen. Each TradeTape keeps rolling windows (e.g. the last minute, five minutes and hour) of
+VWAP, volume, trade count and volatility. A window is a ring of time buckets holding running sums, so adding a trade
+and reading a window both take constant time, however many trades the window covers. The sums are kept as
+fixed-point integers (see parse_pool), which are exact and much quicker to add than Decimals.
+"""
+from collections import deque, namedtuple
+from decimal import Decimal
+import math
+import threading
+import time
+
+from bitcoin_exchanges.exchange_util import ExchangeError, fan_out, get_live_exchange_workers
+from bitcoin_exchanges.parse_pool import SCALE_DIGITS, from_fixed, to_fixed
+from bitcoin_exchanges.symbols import get_symbol
+
+WINDOWS = (60, 300, 3600)  # seconds
+WINDOW_BUCKETS = 60  # buckets per window
+SEEN_TRADES = 5000  # trade ids remembered per tape, for dedupe
+POLL_INTERVAL = 5  # seconds
+
+# volatility is the standard deviation of the log returns between consecutive trades, or None without two trades
+WindowStats = namedtuple('WindowStats', ['vwap', 'volume', 'count', 'volatility'])
+
+
+class RollingWindow(object):
+    """Running sums of the trades in the last span seconds, in a ring of buckets."""
+
+    def __init__(self, span, buckets=WINDOW_BUCKETS):
+        """
+        :param span: the window length in seconds
+        :param int buckets: how finely to divide it. Trades leave the window a bucket at a time.
+        """
+        self.span = span
+        self.width = float(span) / buckets
+        self.size = buckets
+        # each bucket is [bucket number, volume, notional, count, sum of squared log returns, return count]
+        self.buckets = [[None, 0, 0, 0, 0.0, 0] for _ in range(buckets)]
+        self.totals = [0, 0, 0, 0.0, 0]
+        self.newest = None  # the number of the newest bucket seen
+
+    def _expire(self, number):
+        """Clear out the buckets which have left the window as of bucket number."""
+        if self.newest is not None and number > self.newest:
+            for old in range(max(self.newest + 1, number - self.size + 1), number + 1):
+                self._clear(self.buckets[old % self.size])
+        if self.newest is None or number > self.newest:
+            self.newest = number
+
+    def _clear(self, bucket):
+        for i in range(1, 6):
+            self.totals[i - 1] -= bucket[i]
+        bucket[1:] = [0, 0, 0, 0.0, 0]
+        bucket[0] = None
+
+    def add(self, timestamp, price, amount, log_return=None):
+        """
+        :param float timestamp: the trade time
+        :param int price: the trade price, in fixed-point
+        :param int amount: the trade amount, in fixed-point
+        :param float log_return: the log of this trade's price over the previous one's, if there was one
+        """
+        number = int(timestamp // self.width)
+        if self.newest is not None and number <= self.newest - self.size:
+            return  # already out of the window
+        self._expire(number)
+        bucket = self.buckets[number % self.size]
+        if bucket[0] != number:
+            self._clear(bucket)
+            bucket[0] = number
+        values = (amount, price * amount, 1, log_return * log_return if log_return is not None else 0.0,
+                  1 if log_return is not None else 0)
+        for i, value in enumerate(values):
+            bucket[i + 1] += value
+            self.totals[i] += value
+
+    def sums(self, now=None):
+        """
+        :return: the window's volume, notional (in units of 1 / SCALE ** 2), count, sum of squared log returns and
+                 return count
+        :rtype: list
+        """
+        self._expire(int((now if now is not None else time.time()) // self.width))
+        return list(self.totals)
+
+    def stats(self, now=None):
+        """:rtype: WindowStats"""
+        return stats_from_sums(self.sums(now))
+
+
+def stats_from_sums(sums):
+    volume, notional, count, squares, returns = sums
+    return WindowStats((Decimal(notional) / volume).scaleb(-SCALE_DIGITS) if volume else None, from_fixed(volume),
+                       count, math.sqrt(squares / returns) if returns else None)
+
+
+class TradeTape(object):
+    """The trades of one pair on one exchange, and rolling windows over them."""
+
+    def __init__(self, exchange, pair=None, windows=WINDOWS):
+        """
+        :param str exchange: the exchange name
+        :param str pair: the pair by any of its names. Defaults to the exchange's main pair.
+        :param tuple windows: the window lengths to keep, in seconds
+        """
+        self.exchange = exchange
+        self.symbol = get_symbol(exchange, pair)
+        self.windows = dict((span, RollingWindow(span)) for span in windows)
+        self.last = None  # the newest Trade added, which is the cursor for the next poll
+        self._seen = set()
+        self._seen_order = deque()
+        self._last_price = None
+        self._lock = threading.Lock()
+
+    def add(self, trades):
+        """
+        Add trades, oldest first, skipping any already added.
+
+        :return: the trades which were new
+        :rtype: list
+        """
+        new = []
+        with self._lock:
+            for trade in trades:
+                if trade.trade_id in self._seen:
+                    continue
+                self._seen.add(trade.trade_id)
+                self._seen_order.append(trade.trade_id)
+                if len(self._seen_order) > SEEN_TRADES:
+                    self._seen.discard(self._seen_order.popleft())
+                price, amount = to_fixed(str(trade.price.amount)), to_fixed(str(trade.amount.amount))
+                log_return = None
+                if self._last_price and price:
+                    log_return = math.log(float(price) / self._last_price)
+                self._last_price = price
+                for window in self.windows.itervalues():
+                    window.add(trade.timestamp, price, amount, log_return)
+                if self.last is None or trade.timestamp >= self.last.timestamp:
+                    self.last = trade
+                new.append(trade)
+        return new
+
+    def sums(self, span, now=None):
+        with self._lock:
+            return self.windows[span].sums(now)
+
+    def stats(self, span, now=None):
+        """
+        :param span: one of the tape's window lengths
+        :rtype: WindowStats
+        """
+        return stats_from_sums(self.sums(span, now))
+
+
+class TapeReader(object):
+    """
+    Poll the public trades of the live exchanges into TradeTapes. Each subscriber is called with the exchange name
+    and a list of its new trades.
+    """
+
+    def __init__(self, exchanges=None, pairs=None, windows=WINDOWS, interval=POLL_INTERVAL):
+        """
+        :param dict exchanges: exchange classes by name. Defaults to all of the live exchanges.
+        :param dict pairs: the pair to read on each exchange. Defaults to each exchange's main pair.
+        :param tuple windows: the window lengths to keep, in seconds
+        :param int interval: seconds between polls
+        """
+        if exchanges is None:
+            exchanges = dict((name, mod.eclass) for name, mod in get_live_exchange_workers().iteritems())
+        self.exchanges = exchanges
+        self.tapes = dict((name, TradeTape(name, (pairs or {}).get(name), windows)) for name in exchanges)
+        self.interval = interval
+        self.subscribers = []
+        self.errors = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def poll(self):
+        """Get every exchange's new trades once, concurrently."""
+        def poll_one(name):
+            tape = self.tapes[name]
+            try:
+                trades = self.exchanges[name].get_public_trades(tape.symbol.pair, since=tape.last)
+            except ExchangeError as e:
+                self.errors[name] = e
+                return
+            self.errors.pop(name, None)
+            new = tape.add(trades)
+            if new:
+                for callback in self.subscribers:
+                    callback(name, new)
+
+        fan_out(poll_one, list(self.exchanges))
+
+    def stats(self, exchange, span, now=None):
+        """:rtype: WindowStats"""
+        return self.tapes[exchange].stats(span, now)
+
+    def consolidated(self, span, quote='USD', base='BTC', now=None):
+        """
+        One window's statistics over every exchange trading base for quote, as if their trades were on one tape.
+
+        :rtype: WindowStats
+        """
+        totals = [0, 0, 0, 0.0, 0]
+        for tape in self.tapes.itervalues():
+            if tape.symbol.quote == quote and tape.symbol.base == base:
+                for i, value in enumerate(tape.sums(span, now)):
+                    totals[i] += value
+        return stats_from_sums(totals)
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='trade-tape')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        self.poll()
+        while not self._stop.wait(self.interval):
+            self.poll()
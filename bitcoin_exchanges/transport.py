@@ -0,0 +1,323 @@
+"""
+The HTTP transport shared by the exchange clients.
+
+Each exchange gets one pooled requests.Session, so connections and their TLS sessions are
+reused between calls, and between every client instance for that exchange, instead of being
+opened for each request.
+"""
+from decimal import Decimal
+import json
+import socket
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import simplejson
+    from simplejson import _speedups
+except ImportError:
+    simplejson = None
+
+from bitcoin_exchanges.exchange_util import fan_out, get_latency_tracker, get_live_exchange_workers, \
+    get_retry_policy, get_circuit_breaker, exchange_health, CircuitOpenError, get_timeout_policy, get_rate_limiter
+
+POOL_SIZE = 10  # connections kept open per host
+HEARTBEAT_INTERVAL = 30  # seconds, well inside the usual 60 second server idle timeout
+WARM_TIMEOUT = 5  # seconds
+LATENCY_SMOOTHING = 0.2  # weight of the newest sample in moving averages
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(exchange):
+    """
+    :param str exchange: the exchange name
+    :return: the pooled session for an exchange
+    :rtype: requests.Session
+    """
+    session = _sessions.get(exchange)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(exchange)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _sessions[exchange] = session
+    return session
+
+
+def request(exchange, method, url, private=False, idempotent=True, sign=None, retry_if=None, account_id=None,
+            **kwargs):
+    """
+    Send a request over an exchange's pooled session, retrying it according to the exchange's
+    RetryPolicy. Otherwise takes the same arguments as requests.request.
+
+    Raises CircuitOpenError without sending anything while the endpoint class's circuit breaker is open.
+
+    The timeout given is a ceiling. Each attempt's connect and read timeouts come from the exchange's
+    TimeoutPolicy, and are cut short by any deadline set with exchange_util.deadline.
+
+    :param bool private: whether this is an authenticated endpoint, which are timed separately
+    :param bool idempotent: whether the request is safe to repeat after it may have reached the exchange
+    :param sign: called before each attempt, returning a dict of request arguments (e.g. data and headers)
+                 to use for that attempt, so every retry carries a fresh nonce
+    :param retry_if: called with each response, returning True if the exchange rejected it unprocessed
+    :param str account_id: for private requests, the ExchangeABC.account_id of the client, whose rate limit each
+                           attempt waits for
+    :rtype: requests.Response
+    """
+    session = get_session(exchange)
+    endpoint = 'private' if private else 'public'
+    latency = get_latency_tracker(exchange, endpoint)
+    breaker = get_circuit_breaker(exchange, endpoint)
+    timeouts = get_timeout_policy(exchange)
+    ceiling = kwargs.pop('timeout', None)
+    limiter = get_rate_limiter(exchange, account_id) if private else None
+
+    def attempt():
+        # first, so an open circuit spends no rate limit tokens or nonces
+        if not breaker.allow():
+            raise CircuitOpenError(exchange, 'circuit open for %s requests, not sending %s %s' % (endpoint, method,
+                                                                                                url))
+        try:
+            if limiter is not None:
+                limiter.acquire()  # before signing, so the nonce is fresh when the request goes out
+            kwargs['timeout'] = timeouts.timeout(exchange, endpoint, ceiling)
+            if sign is not None:
+                kwargs.update(sign())
+        except Exception:
+            breaker.release()
+            raise
+        start = time.time()
+        try:
+            response = session.request(method, url, **kwargs)
+        except Exception:
+            breaker.record(False)
+            raise
+        elapsed = time.time() - start
+        latency.record(elapsed)
+        breaker.record(response.status_code < 500, elapsed)
+        return response
+
+    policy = get_retry_policy(exchange)
+    send = attempt
+    if policy.hedge and idempotent and not private and sign is None:
+        delay = latency.percentile(policy.hedge_percentile)
+        if delay is not None:
+            send = lambda: policy.run_hedged(exchange, attempt, delay)
+    return policy.run(exchange, send, idempotent=idempotent, retry_if=retry_if)
+
+
+def stdlib_decoder(raw):
+    return json.loads(raw, parse_float=Decimal)
+
+
+def simplejson_decoder(raw):
+    return simplejson.loads(raw, use_decimal=True)
+
+
+_decoder = simplejson_decoder if simplejson is not None else stdlib_decoder
+
+
+def set_decoder(decoder):
+    """
+    Replace the JSON decoder used for every response.
+
+    :param decoder: called with the raw response body, returning the decoded value. It must parse
+                    non-integer numbers as Decimal, and raise ValueError on bad input.
+    """
+    global _decoder
+    _decoder = decoder
+
+
+def decode(response):
+    """
+    Decode a JSON response, straight from its raw bytes. Numbers with a fraction or exponent become Decimals,
+    so prices and amounts keep their exact value. simplejson is used if its C speedups are installed.
+
+    :param response: a requests.Response, or a response body
+    :raises ValueError: if the body is not valid JSON
+    """
+    if isinstance(response, requests.Response):
+        response = response.content
+    return _decoder(response)
+
+
+class DNSCache(object):
+    """
+    A cache in front of socket.getaddrinfo, so that reconnecting to an exchange does not wait on DNS.
+
+    Once installed it is used for every lookup in the process.
+    """
+
+    def __init__(self, ttl=300):
+        """
+        :param int ttl: seconds to keep each answer
+        """
+        self.ttl = ttl
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._getaddrinfo = socket.getaddrinfo
+
+    def getaddrinfo(self, host, port, *args, **kwargs):
+        key = (host, port, args, tuple(sorted(kwargs.items())))
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] > time.time():
+            return entry[1]
+        addresses = self._getaddrinfo(host, port, *args, **kwargs)
+        with self._lock:
+            self._cache[key] = (time.time() + self.ttl, addresses)
+        return addresses
+
+    def resolve(self, host, port=443):
+        """Look up a host now, so later connections find it cached."""
+        return self.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+
+    def install(self):
+        socket.getaddrinfo = self.getaddrinfo
+
+    def uninstall(self):
+        socket.getaddrinfo = self._getaddrinfo
+
+
+class ConnectionManager(object):
+    """
+    Keep connections to the live exchanges open, so the first request after a quiet period
+    does not pay for DNS, TCP and TLS setup.
+
+    On start every exchange's hosts are resolved and connected to, then each exchange is sent
+    a cheap heartbeat request every interval seconds to stop the server closing its idle connections.
+    """
+
+    def __init__(self, exchanges=None, interval=HEARTBEAT_INTERVAL, dns_cache=None):
+        """
+        :param dict exchanges: exchange classes by name. Defaults to all of the live exchanges.
+        :param int interval: seconds between heartbeats
+        :param DNSCache dns_cache: the DNS cache to install. A default one is created if not given.
+        """
+        if exchanges is None:
+            exchanges = dict((name, mod.eclass) for name, mod in get_live_exchange_workers().iteritems())
+        self.exchanges = exchanges
+        self.interval = interval
+        self.dns_cache = dns_cache if dns_cache is not None else DNSCache()
+        self.health = dict((name, ConnectionHealth()) for name in exchanges)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Install the DNS cache, warm every exchange's connections and start the heartbeat thread."""
+        self.dns_cache.install()
+        self.warm()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='exchange-heartbeat')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def warm(self):
+        """Resolve and connect to every exchange's hosts, concurrently."""
+        def warm_one(name):
+            for host in self.exchanges[name].hosts:
+                try:
+                    self.dns_cache.resolve(host)
+                except socket.error:
+                    pass  # recorded by the ping that follows
+            self.ping(name)
+
+        fan_out(warm_one, list(self.exchanges))
+
+    def ping(self, name):
+        """
+        Touch each of an exchange's hosts, then send its heartbeat request. The touches go straight through the
+        pooled session, since any answer warms the connection, so only the heartbeat counts towards the exchange's
+        latency, circuit breaker and retry budget.
+
+        :return: True if the exchange responded
+        :rtype: bool
+        """
+        eclass = self.exchanges[name]
+        start = time.time()
+        try:
+            for host in eclass.hosts:
+                get_session(name).head('https://%s/' % host, timeout=WARM_TIMEOUT, allow_redirects=False)
+            eclass.heartbeat()
+        except Exception as e:
+            self.health[name].failed(e)
+            return False
+        self.health[name].succeeded(time.time() - start)
+        return True
+
+    def stats(self):
+        """
+        :return: the connection health of each exchange, by name
+        :rtype: dict
+        """
+        stats = {}
+        for name, health in self.health.iteritems():
+            stats[name] = health.as_dict()
+            stats[name]['open_connections'], stats[name]['idle_connections'] = pool_stats(name)
+            stats[name]['health'] = exchange_health(name)
+        return stats
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            fan_out(self.ping, list(self.exchanges))
+
+
+class ConnectionHealth(object):
+    """Heartbeat results for one exchange."""
+
+    def __init__(self):
+        self.pings = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.last_latency = None
+        self.avg_latency = None
+        self.last_success = None
+        self.last_error = None
+
+    def succeeded(self, latency):
+        self.pings += 1
+        self.consecutive_failures = 0
+        self.last_latency = latency
+        if self.avg_latency is None:
+            self.avg_latency = latency
+        else:
+            self.avg_latency += LATENCY_SMOOTHING * (latency - self.avg_latency)
+        self.last_success = time.time()
+
+    def failed(self, error):
+        self.pings += 1
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_error = '%s %s' % (type(error).__name__, error)
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+def pool_stats(exchange):
+    """
+    :return: the number of connections opened, and the number now idle, in an exchange's pools
+    :rtype: tuple
+    """
+    session = _sessions.get(exchange)
+    if session is None:
+        return 0, 0
+    opened = idle = 0
+    for adapter in set(session.adapters.values()):
+        for key in adapter.poolmanager.pools.keys():
+            pool = adapter.poolmanager.pools[key]
+            opened += pool.num_connections
+            idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+    return opened, idle
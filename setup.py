@@ -15,6 +15,10 @@ setuptools.setup(
         'pymongo',
         'hashlib'
     ],
+    extras_require={
+        'streaming': ['websocket-client'],
+        'speedups': ['simplejson'],
+    },
     dependency_links=['git+https://github.com/bearbones/py-moneyed/',
                       'requests',
                       'pymongo',
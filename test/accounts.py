@@ -0,0 +1,102 @@
+"""
+Calling several accounts together, and sharing their market data, against stand-in clients without any network.
+
+run with
+    python -m unittest test.accounts
+"""
+import threading
+import time
+import unittest
+
+from requests.exceptions import ConnectionError
+
+from bitcoin_exchanges.accounts import AccountGroup, MarketDataCache
+from bitcoin_exchanges.exchange_util import ExchangeError
+
+
+class StandIn(object):
+    """An account's client, which fails with error if it is given one."""
+
+    def __init__(self, account, error=None):
+        self.account = account
+        self.error = error
+
+    def cancel_orders(self):
+        if self.error is not None:
+            raise self.error
+        return None
+
+    def get_balance(self, btype='total'):
+        if self.error is not None:
+            raise self.error
+        return '%s %s' % (self.account, btype)
+
+
+class StandInGroup(AccountGroup):
+    def __init__(self, clients, **kwargs):
+        super(StandInGroup, self).__init__('bitstamp', accounts=list(clients), **kwargs)
+        self.clients = clients
+
+    def client(self, account=None):
+        return self.clients[account]
+
+
+class TestAccountGroup(unittest.TestCase):
+    def test_each_collects_errors(self):
+        down = ExchangeError('bitstamp', 'down')
+        refused = ConnectionError('refused')
+        group = StandInGroup({None: StandIn(None), 'a': StandIn('a', down), 'b': StandIn('b', refused),
+                              'c': StandIn('c')}, workers=2)
+        self.assertEqual(group.get_balances(btype='available'), {None: 'None available', 'c': 'c available'})
+        self.assertEqual(group.errors, {'a': down, 'b': refused})
+        # results of None are kept, and the errors are those of the last call only
+        group.clients['a'].error = None
+        self.assertEqual(group.cancel_all(), {None: None, 'a': None, 'c': None})
+        self.assertEqual(group.errors, {'b': refused})
+
+
+class TestMarketDataCache(unittest.TestCase):
+    def test_concurrent_misses_fetch_once(self):
+        cache = MarketDataCache(ttl=60)
+        calls = []
+        release = threading.Event()
+
+        def fetch():
+            calls.append(threading.current_thread().name)
+            release.wait(5)
+            return {'bids': [], 'asks': []}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get(fetch, 'bitstamp', 'book')))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)  # let every thread reach the cache while the first is still fetching
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 8)
+        self.assertTrue(all(result is results[0] for result in results))
+
+    def test_keys_and_expiry(self):
+        cache = MarketDataCache(ttl=0)
+        calls = []
+        fetch = lambda: calls.append(1) or len(calls)
+        self.assertEqual(cache.get(fetch, 'kraken', 'ticker'), 1)
+        self.assertEqual(cache.get(fetch, 'kraken', 'ticker'), 2)  # already expired
+        cache.ttl = 60
+        self.assertEqual(cache.get(fetch, 'kraken', 'ticker'), 3)
+        self.assertEqual(cache.get(fetch, 'kraken', 'ticker'), 3)
+        self.assertEqual(cache.get(fetch, 'kraken', 'book'), 4)
+        cache.clear()
+        self.assertEqual(cache.get(fetch, 'kraken', 'ticker'), 5)
+
+    def test_errors_are_not_cached(self):
+        cache = MarketDataCache(ttl=60)
+
+        def fail():
+            raise ExchangeError('kraken', 'down')
+
+        self.assertRaises(ExchangeError, cache.get, fail, 'kraken', 'ticker')
+        self.assertEqual(cache.get(lambda: 'up', 'kraken', 'ticker'), 'up')
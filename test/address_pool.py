@@ -0,0 +1,69 @@
+"""
+Prefetching and rotating deposit addresses against stand-in exchanges, without any network.
+
+run with
+    python -m unittest test.address_pool
+"""
+import time
+import unittest
+
+from bitcoin_exchanges.address_pool import AddressPool
+from bitcoin_exchanges.exchange_util import DepositAddress, ExchangeError
+
+
+class StandIn(object):
+    """An exchange client which makes up to most addresses, each expiring lifetime seconds after it is made."""
+
+    def __init__(self, name, most=5, lifetime=None, held=()):
+        self.name = name
+        self.most = most
+        self.lifetime = lifetime
+        self.held = list(held)
+        self.fail = False
+
+    def get_deposit_addresses(self, new=False, currency='BTC'):
+        if self.fail:
+            raise ExchangeError(self.name, 'down')
+        if new and len(self.held) < self.most:
+            expires = time.time() + self.lifetime if self.lifetime is not None else None
+            self.held.append(DepositAddress(self.name, '%s-%d' % (self.name, len(self.held)), expires))
+        return list(self.held)
+
+
+class TestAddressPool(unittest.TestCase):
+    def test_get_rotates(self):
+        pool = AddressPool({'kraken': StandIn('kraken')}, size=3)
+        pool.prefetch()
+        self.assertEqual([pool.get('kraken') for _ in range(4)], ['kraken-0', 'kraken-1', 'kraken-2', 'kraken-0'])
+        # a refresh keeps the rotation where it was
+        pool.refresh('kraken')
+        self.assertEqual(pool.get('kraken'), 'kraken-1')
+
+    def test_single_address(self):
+        pool = AddressPool({'bitstamp': StandIn('bitstamp', most=1)}, size=3)
+        self.assertEqual([pool.get('bitstamp') for _ in range(2)], ['bitstamp-0', 'bitstamp-0'])
+
+    def test_skips_addresses_about_to_expire(self):
+        now = time.time()
+        held = [DepositAddress('kraken', 'old', now + 60), DepositAddress('kraken', 'fresh', now + 7200)]
+        pool = AddressPool({'kraken': StandIn('kraken', most=3, lifetime=7200, held=held)}, size=2, margin=3600)
+        pool.prefetch()
+        self.assertEqual([a.address for a in pool.addresses['kraken']], ['old', 'fresh', 'kraken-2'])
+        self.assertEqual([pool.get('kraken') for _ in range(3)], ['fresh', 'kraken-2', 'fresh'])
+        self.assertEqual(pool.usable('kraken', now + 3700), [])
+        self.assertLessEqual(pool._next_wait(), 3600)
+
+    def test_errors(self):
+        client = StandIn('kraken')
+        pool = AddressPool({'kraken': client}, size=1)
+        self.assertIsNone(pool.get('kraken', block=False))
+        client.fail = True
+        self.assertRaises(ExchangeError, pool.get, 'kraken')
+        self.assertIn('kraken', pool.errors)
+        client.fail = False
+        self.assertEqual(pool.get('kraken'), 'kraken-0')
+        self.assertNotIn('kraken', pool.errors)
+        client.fail = True
+        self.assertFalse(pool.refresh('kraken'))
+        self.assertEqual(pool.get('kraken'), 'kraken-0')  # the held address is kept
+        self.assertRaises(ExchangeError, pool.get, 'kraken', currency='LTC')
@@ -0,0 +1,57 @@
+"""
+Time the request signing of each exchange client, without sending anything.
+
+run with
+    python -m test.bench_signing
+"""
+import timeit
+
+from bitcoin_exchanges import bitfinex, bitstamp, btce, huobi, kraken, lakebtc, okcoin
+from bitcoin_exchanges.old import btcchina, poloniex
+
+KEY = 'k' * 64
+SECRET = 'c2VjcmV0' * 8  # valid base64, for kraken
+NUMBER = 10000
+
+
+def order_params():
+    return {'pair': 'btc_usd', 'type': 'buy', 'price': '400.123', 'amount': '0.020'}
+
+
+def bench_poloniex(client):
+    # poloniex signs inline in api_query, so mirror its work
+    client.signer.hexdigest('command=buy&nonce=1417000000000&rate=400.123&amount=0.020&currencyPair=USDT_BTC')
+
+
+class FixedNonceBTCE(btce.BTCE):
+    def __init__(self, key, secret):
+        # skip the nonce database
+        self.key = key
+        self.secret = secret
+        self.signer = btce.HmacSigner(secret, btce.hashlib.sha512)
+
+    def next_nonce(self):
+        return 1
+
+
+CASES = [
+    ('bitfinex', bitfinex.Bitfinex(KEY, SECRET), lambda c: c.bitfinex_encode(order_params())),
+    ('bitstamp', bitstamp.Bitstamp(KEY, SECRET, '12345'), lambda c: c.bitstamp_encode(order_params())),
+    ('btce', FixedNonceBTCE(KEY, SECRET), lambda c: c.btce_encode(order_params())),
+    ('huobi', huobi.Huobi(KEY, SECRET), lambda c: c.huobi_encode(order_params())),
+    ('kraken', kraken.Kraken(KEY, SECRET), lambda c: c.kraken_encode('/0/private/AddOrder', order_params())),
+    ('lakebtc', lakebtc.Lakebtc(KEY, SECRET),
+     lambda c: c.lakebtc_encode({'tonce': 1417000000000000, 'method': 'buyOrder',
+                                 'params': ['400.12', '0.020', 'CNY']})),
+    ('okcoin', okcoin.OKCoin(KEY, SECRET), lambda c: c.okcoin_encode(order_params())),
+    ('btcchina', btcchina.BTCChina(KEY, SECRET),
+     lambda c: c._get_params_hash({'tonce': 1417000000000000, 'accesskey': KEY, 'requestmethod': 'post',
+                                   'id': 1, 'method': 'buyOrder', 'params': ['400.12', '0.020']})),
+    ('poloniex', poloniex.poloniex(KEY, SECRET), bench_poloniex),
+]
+
+
+if __name__ == "__main__":
+    for name, client, sign in CASES:
+        seconds = timeit.timeit(lambda: sign(client), number=NUMBER)
+        print "%-10s %8.2f us per signature" % (name, seconds / NUMBER * 1e6)
@@ -0,0 +1,75 @@
+"""
+Diff order book snapshots into level deltas, without any network.
+
+run with
+    python -m unittest test.book_diff
+"""
+from decimal import Decimal
+import unittest
+
+from bitcoin_exchanges.book_diff import BookDelta, BookDiffer, diff_side
+
+
+class TestDiffSide(unittest.TestCase):
+    def test_unchanged(self):
+        side = [['400', '1'], ['399', '2']]
+        self.assertEqual(diff_side(side, list(side), False), [])
+
+    def test_add_update_remove(self):
+        old = [['403', '1'], ['402', '1'], ['400', '2']]
+        new = [['403', '1'], ['401', '5'], ['400', '3']]
+        self.assertEqual(diff_side(old, new, False), [
+            ('remove', Decimal('402'), Decimal(0)),
+            ('add', Decimal('401'), Decimal('5')),
+            ('update', Decimal('400'), Decimal('3')),
+        ])
+
+    def test_ascending(self):
+        old = [['401', '1'], ['402', '1']]
+        new = [['400.5', '1'], ['402', '1'], ['403', '2']]
+        self.assertEqual(diff_side(old, new, True), [
+            ('add', Decimal('400.5'), Decimal('1')),
+            ('remove', Decimal('401'), Decimal(0)),
+            ('add', Decimal('403'), Decimal('2')),
+        ])
+
+    def test_raw_forms_compared_as_numbers(self):
+        old = [['400.0', '1.0'], [399, 2]]
+        new = [[Decimal('400'), Decimal('1')], ['399.00', '2.5']]
+        self.assertEqual(diff_side(old, new, False), [('update', Decimal('399.00'), Decimal('2.5'))])
+
+    def test_dict_levels(self):
+        old = [{'price': '400', 'amount': '1', 'timestamp': '1'}]
+        new = [{'price': '400', 'amount': '1', 'timestamp': '2'}, {'price': '399', 'amount': '1', 'timestamp': '2'}]
+        self.assertEqual(diff_side(old, new, False), [('add', Decimal('399'), Decimal('1'))])
+
+
+class TestBookDiffer(unittest.TestCase):
+    def test_first_snapshot_is_all_adds(self):
+        differ = BookDiffer()
+        deltas = differ.diff('bitstamp', 'BTC/USD', {'bids': [['400', '1']], 'asks': [['401', '2']]})
+        self.assertEqual(deltas, [BookDelta('bitstamp', 'BTC/USD', 'bid', 'add', Decimal('400'), Decimal('1')),
+                                  BookDelta('bitstamp', 'BTC/USD', 'ask', 'add', Decimal('401'), Decimal('2'))])
+
+    def test_only_changes_after_first(self):
+        differ = BookDiffer()
+        differ.diff('bitstamp', 'BTC/USD', {'bids': [['400', '1'], ['399', '1']], 'asks': [['401', '2']]})
+        deltas = differ.diff('bitstamp', 'BTC/USD', {'bids': [['400', '1']], 'asks': [['401', '1']]})
+        self.assertEqual(deltas, [BookDelta('bitstamp', 'BTC/USD', 'bid', 'remove', Decimal('399'), Decimal(0)),
+                                  BookDelta('bitstamp', 'BTC/USD', 'ask', 'update', Decimal('401'), Decimal('1'))])
+
+    def test_descending_asks(self):
+        # okcoin lists asks from the top of the book down
+        differ = BookDiffer()
+        differ.diff('okcoin', 'BTC/USD', {'bids': [], 'asks': [['403', '1'], ['402', '1']]})
+        deltas = differ.diff('okcoin', 'BTC/USD', {'bids': [], 'asks': [['403', '1'], ['401', '1']]})
+        self.assertEqual(sorted((d.action, d.price) for d in deltas),
+                         [('add', Decimal('401')), ('remove', Decimal('402'))])
+
+    def test_reset(self):
+        differ = BookDiffer()
+        book = {'bids': [['400', '1']], 'asks': []}
+        differ.diff('kraken', 'BTC/EUR', book)
+        self.assertEqual(differ.diff('kraken', 'BTC/EUR', book), [])
+        differ.reset('kraken', 'BTC/EUR')
+        self.assertEqual(len(differ.diff('kraken', 'BTC/EUR', book)), 1)
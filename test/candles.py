@@ -0,0 +1,82 @@
+"""
+Building candles and reading them back across spilled bars, without any network.
+
+run with
+    python -m unittest test.candles
+"""
+from decimal import Decimal
+import os
+import shutil
+import tempfile
+import unittest
+
+from bitcoin_exchanges.candles import Candle, CandleBuilder, CandleSeries
+from bitcoin_exchanges.parse_pool import to_fixed
+
+
+def flat(start, close):
+    close = Decimal(close)
+    return Candle(start, close, close, close, close, Decimal(0), 0)
+
+
+class TestCandleSeries(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'series.bars')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_bar(self):
+        series = CandleSeries(60)
+        for timestamp, price, amount in ((60, '400', '1'), (70, '405', '1'), (80, '398', '0.5'), (119.9, '401', 0)):
+            series.add(timestamp, to_fixed(price), to_fixed(amount))
+        self.assertEqual(series.candles(60, 120), [Candle(60, Decimal('400'), Decimal('405'), Decimal('398'),
+                                                          Decimal('401'), Decimal('2.5'), 3)])
+
+    def test_across_the_spill_boundary(self):
+        series = CandleSeries(60, self.path, max_bars=3)
+        for i in range(4):
+            series.add(i * 60, to_fixed(400 + i), to_fixed(1))
+        # the first three bars went to disk, leaving the newest in memory
+        self.assertEqual(series.spilled_until, 180)
+        self.assertEqual(list(series.columns[0]), [180])
+        self.assertEqual([c.close for c in series.candles(0, 240)], [400, 401, 402, 403])
+        self.assertEqual([c.start for c in series.candles(60, 180)], [60, 120])
+        self.assertEqual(series.candles(0, 300)[-1], flat(240, 403))
+        series.add(30, to_fixed(1), to_fixed(1))  # a late trade for a bar on disk is dropped
+        self.assertEqual(series.candles(0, 60)[0].low, Decimal(400))
+        self.assertEqual(CandleSeries(60, self.path).spilled_until, 180)
+
+    def test_leading_gap(self):
+        series = CandleSeries(60)
+        series.add(600, to_fixed('400'), to_fixed('1'))
+        # nothing before the first bar to fill from
+        self.assertEqual([c.start for c in series.candles(480, 720)], [600, 660])
+        self.assertEqual(series.candles(480, 720, fill=False), series.candles(600, 660))
+        series.add(900, to_fixed('410'), to_fixed('1'))
+        self.assertEqual(series.candles(700, 900), [flat(660, 400), flat(720, 400), flat(780, 400), flat(840, 400)])
+
+    def test_leading_gap_filled_from_disk(self):
+        series = CandleSeries(60, self.path, max_bars=3)
+        for timestamp in (0, 60, 120, 300):
+            series.add(timestamp, to_fixed(timestamp + 1), to_fixed(1))
+        self.assertEqual(list(series.columns[0]), [300])
+        candles = series.candles(180, 360)
+        self.assertEqual(candles[:2], [flat(180, 121), flat(240, 121)])
+        self.assertEqual(candles[2].close, Decimal(301))
+
+
+class TestCandleBuilder(unittest.TestCase):
+    def test_resolutions_line_up(self):
+        builder = CandleBuilder(resolutions=(60, 300))
+        builder.add('kraken', 'XXBTZEUR', 0, '300', '1')
+        builder.add('kraken', 'BTC/EUR', 250, '310', '2')
+        builder.add('bitstamp', None, 10, '400', '1')
+        self.assertEqual([c.close for c in builder.candles('kraken', 'BTC/EUR', 60, 0, 300)],
+                         [Decimal(300)] * 4 + [Decimal(310)])
+        [bar] = builder.candles('kraken', None, 300, 0, 300)
+        self.assertEqual((bar.open, bar.close, bar.volume, bar.count), (Decimal(300), Decimal(310), Decimal(3), 2))
+        across = builder.candles_across(60, 0, 120)
+        self.assertEqual(sorted(across), ['bitstamp', 'kraken'])
+        self.assertEqual([c.start for c in across['bitstamp']], [0, 60])
@@ -0,0 +1,144 @@
+"""
+The config providers, and reloading the settings in place, without any network.
+
+run with
+    python -m unittest test.config
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+
+from bitcoin_exchanges import config
+from bitcoin_exchanges.exchange_util import LazyClient, get_client
+
+SETTINGS = {'exchange_config': {'bitfinex': {'live': False, 'api_creds': {'key': 'k1', 'secret': 's1'}}},
+            'BLOCK_ORDERS': True}
+
+
+class TestProviders(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_file_provider(self):
+        path = os.path.join(self.directory, 'exchange_config.py')
+        with open(path, 'w') as f:
+            f.write('BLOCK_ORDERS = 1\nexchange_config = {"kraken": {"live": True}}\n')
+        provider = config.FileProvider(path)
+        settings = provider.load()
+        self.assertEqual(settings['exchange_config'], {'kraken': {'live': True}})
+        self.assertIs(settings['BLOCK_ORDERS'], True)
+        self.assertIsNone(settings['nonceDB'])
+        self.assertFalse(provider.changed())
+        os.utime(path, (0, 0))
+        self.assertTrue(provider.changed())
+
+    def test_json_file_provider(self):
+        path = os.path.join(self.directory, 'exchange_config.json')
+        with open(path, 'w') as f:
+            json.dump(SETTINGS, f)
+        self.assertEqual(config.FileProvider(path).load()['exchange_config'], SETTINGS['exchange_config'])
+
+    def test_default_provider(self):
+        environ = os.environ.get(config.CONFIG_DIR_VAR)
+        try:
+            os.environ[config.CONFIG_DIR_VAR] = self.directory
+            self.assertIsInstance(config.default_provider(), config.ModuleProvider)
+            open(os.path.join(self.directory, config.CONFIG_FILE), 'w').close()
+            self.assertIsInstance(config.default_provider(), config.FileProvider)
+        finally:
+            if environ is None:
+                del os.environ[config.CONFIG_DIR_VAR]
+            else:
+                os.environ[config.CONFIG_DIR_VAR] = environ
+
+    def test_module_provider(self):
+        module = types.ModuleType('test_exchange_config')
+        module.exchange_config = SETTINGS['exchange_config']
+        sys.modules[module.__name__] = module
+        try:
+            settings = config.ModuleProvider(module.__name__).load()
+        finally:
+            del sys.modules[module.__name__]
+        self.assertEqual(settings['exchange_config'], SETTINGS['exchange_config'])
+        self.assertIs(settings['BLOCK_ORDERS'], False)
+
+    def test_callable_provider(self):
+        self.assertEqual(config.CallableProvider(lambda: SETTINGS).load()['exchange_config'],
+                         SETTINGS['exchange_config'])
+
+    def test_env_provider(self):
+        environ = {config.CONFIG_VAR: json.dumps(SETTINGS['exchange_config']),
+                   'BITCOIN_EXCHANGE_BITFINEX_SECRET': 'from env',
+                   'BITCOIN_EXCHANGE_BLOCK_ORDERS': 'true'}
+        settings = config.EnvProvider(environ=environ).load()
+        self.assertEqual(settings['exchange_config']['bitfinex']['api_creds'], {'key': 'k1', 'secret': 'from env'})
+        self.assertIs(settings['BLOCK_ORDERS'], True)
+
+    def test_env_provider_over_base(self):
+        base = config.CallableProvider(lambda: SETTINGS)
+        settings = config.EnvProvider(base, environ={'BITCOIN_EXCHANGE_BITFINEX_KEY': 'k2'}).load()
+        self.assertEqual(settings['exchange_config']['bitfinex']['api_creds']['key'], 'k2')
+        self.assertEqual(SETTINGS['exchange_config']['bitfinex']['api_creds']['key'], 'k1')  # the base is copied
+
+
+class TestReload(unittest.TestCase):
+    def setUp(self):
+        self.previous = config.config._provider
+        self.settings = {'exchange_config': {'bitfinex': {'live': False,
+                                                          'api_creds': {'key': 'k1', 'secret': 's1'}}},
+                         'BLOCK_ORDERS': True}
+        config.set_provider(config.CallableProvider(lambda: self.settings))
+
+    def tearDown(self):
+        config.set_provider(self.previous)
+
+    def set_key(self, key):
+        self.settings = {'exchange_config': {'bitfinex': {'live': False,
+                                                          'api_creds': {'key': key, 'secret': 's1'}}},
+                         'BLOCK_ORDERS': False}
+
+    def test_proxies_follow_reload(self):
+        self.assertEqual(config.exchange_config['bitfinex']['api_creds']['key'], 'k1')
+        self.assertTrue(config.BLOCK_ORDERS)
+        version = config.config.version
+        self.set_key('k2')
+        self.assertEqual(config.exchange_config['bitfinex']['api_creds']['key'], 'k1')  # until reloaded
+        config.reload_config()
+        self.assertEqual(config.config.version, version + 1)
+        self.assertEqual(config.exchange_config['bitfinex']['api_creds']['key'], 'k2')
+        self.assertFalse(config.BLOCK_ORDERS)
+
+    def test_reload_if_changed(self):
+        config.exchange_config.get('bitfinex')
+        self.assertFalse(config.reload_if_changed())  # a CallableProvider can't tell
+
+    def test_lazy_client_rebuilt_on_reload(self):
+        built = []
+
+        def build():
+            built.append(config.exchange_config['bitfinex']['api_creds']['key'])
+            return types.ModuleType(built[-1])
+
+        client = LazyClient(build)
+        self.assertEqual(client.__name__, 'k1')
+        self.assertEqual(client.__name__, 'k1')
+        self.set_key('k2')
+        config.reload_config()
+        self.assertEqual(client.__name__, 'k2')
+        self.assertEqual(built, ['k1', 'k2'])
+
+    def test_default_client_follows_reload(self):
+        from bitcoin_exchanges import bitfinex
+        self.assertEqual(bitfinex.exchange.key, 'k1')
+        self.assertIs(get_client('bitfinex'), get_client('bitfinex', None))
+        self.set_key('k2')
+        config.reload_config()
+        self.assertEqual(bitfinex.exchange.key, 'k2')
+        self.assertIsNone(bitfinex.exchange.account)
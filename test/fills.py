@@ -0,0 +1,68 @@
+"""
+Parse canned private trade histories into Fills, for pairs other than BTC/USD, without any network.
+
+run with
+    python -m unittest test.fills
+"""
+from decimal import Decimal
+import json
+import unittest
+
+from moneyed import Money
+
+from bitcoin_exchanges.bitfinex import Bitfinex
+from bitcoin_exchanges.btce import BTCE
+from bitcoin_exchanges.ledger import Ledger
+from bitcoin_exchanges.okcoin import OKCoin
+from bitcoin_exchanges.poloniex import Poloniex
+
+
+class TestFills(unittest.TestCase):
+    def test_bitfinex(self):
+        client = Bitfinex('key', 'secret')
+        page = [{'tid': 5, 'order_id': 9, 'type': 'Sell', 'price': '0.021', 'amount': '3.5', 'fee_amount': '-0.0001',
+                 'fee_currency': 'btc', 'timestamp': '1440000000.0'}]
+        sent = []
+        client.bitfinex_request = lambda path, params: sent.append(params) or json.dumps(page)
+        [fill] = client.get_fills(pair='ETH/BTC')
+        self.assertEqual(sent[0]['symbol'], 'ETHBTC')
+        self.assertEqual(fill.price, Money('0.021', 'BTC'))
+        self.assertEqual(fill.amount, Money('3.5', 'ETH'))
+        self.assertEqual(fill.fee, Money('0.0001', 'BTC'))
+
+    def test_btce(self):
+        client = BTCE('key', 'secret')
+        page = {'7': {'order_id': 3, 'type': 'buy', 'rate': '0.01', 'amount': '2', 'timestamp': 1440000000}}
+        client.send_btce = lambda params: page
+        client._handle_response = lambda resp: resp
+        [fill] = client.get_fills(pair='LTC/BTC')
+        self.assertEqual((fill.side, fill.price, fill.amount, fill.fee),
+                         ('bid', Money('0.01', 'BTC'), Money('2', 'LTC'), Money(0, 'BTC')))
+
+    def test_poloniex(self):
+        client = Poloniex()
+        trades = [{'globalTradeID': 11, 'orderNumber': 4, 'type': 'sell', 'rate': '0.02', 'amount': '10',
+                   'total': '0.2', 'fee': '0.0025', 'date': '2015-08-19 12:00:00'}]
+        client.get_transactions = lambda start=None, pair=None: trades
+        [fill] = client.get_fills(pair='ETH/BTC')
+        self.assertEqual(fill.price, Money('0.02', 'BTC'))
+        self.assertEqual(fill.amount, Money('10', 'ETH'))
+        self.assertEqual(fill.fee, Money('0.0005', 'BTC'))
+
+    def test_okcoin(self):
+        client = OKCoin('partner', 'secret')
+        orders = {'total': 1, 'orders': [{'order_id': 8, 'type': 'sell', 'avg_price': '3.5', 'deal_amount': '4',
+                                          'create_date': 1440000000000}]}
+        client.get_transactions = lambda **kwargs: orders
+        [fill] = client.get_fills(symbol='LTC/USD')
+        self.assertEqual((fill.price, fill.amount), (Money('3.5', 'USD'), Money('4', 'LTC')))
+
+    def test_ledger_books_the_fill_pair(self):
+        client = BTCE('key', 'secret')
+        client.send_btce = lambda params: {'7': {'order_id': 3, 'type': 'buy', 'rate': '0.01', 'amount': '2',
+                                                 'timestamp': 1440000000}}
+        client._handle_response = lambda resp: resp
+        ledger = Ledger()
+        ledger.add_fills(client.get_fills(pair='LTC/BTC'))
+        self.assertEqual(list(ledger.positions), [('btce', 'LTC/BTC')])
+        self.assertEqual(ledger.position('btce', 'LTC/BTC').report('btce').amount, Decimal('2'))
@@ -0,0 +1,121 @@
+"""
+Positions and PnL built from fills, without any network.
+
+run with
+    python -m unittest test.ledger
+"""
+from decimal import Decimal
+import os
+import shutil
+import tempfile
+import unittest
+
+from moneyed import Money
+
+from bitcoin_exchanges.exchange_util import Fill
+from bitcoin_exchanges.ledger import Ledger, Position
+from bitcoin_exchanges.parse_pool import to_fixed
+
+MARKS = {('bitstamp', 'BTC/USD'): Decimal('50')}
+
+
+def fill(side, price, amount, fee='0', fee_currency='USD', exchange='bitstamp', fill_id='1'):
+    return Fill(exchange, fill_id, None, side, Money(price, 'USD'), Money(amount, 'BTC'), Money(fee, fee_currency),
+                1400000000.0)
+
+
+class TestPosition(unittest.TestCase):
+    def test_average_cost(self):
+        position = Position('BTC', 'USD')
+        position.add('bid', to_fixed('100'), to_fixed('2'))
+        position.add('bid', to_fixed('200'), to_fixed('2'))
+        report = position.report('bitstamp')
+        self.assertEqual(report.amount, Decimal('4'))
+        self.assertEqual(report.average_cost, Decimal('150'))
+        self.assertEqual(report.realized, 0)
+        self.assertIsNone(report.pnl)
+
+    def test_partial_close_keeps_average(self):
+        position = Position('BTC', 'USD')
+        position.add('bid', to_fixed('100'), to_fixed('4'))
+        position.add('ask', to_fixed('150'), to_fixed('1'))
+        report = position.report('bitstamp')
+        self.assertEqual(report.amount, Decimal('3'))
+        self.assertEqual(report.average_cost, Decimal('100'))
+        self.assertEqual(report.realized, Decimal('50'))
+
+    def test_long_flips_short(self):
+        position = Position('BTC', 'USD')
+        position.add('bid', to_fixed('100'), to_fixed('1'))
+        position.add('ask', to_fixed('120'), to_fixed('3'))
+        report = position.report('bitstamp', Decimal('110'))
+        self.assertEqual(report.amount, Decimal('-2'))
+        self.assertEqual(report.average_cost, Decimal('120'))  # the short was opened at the flip price
+        self.assertEqual(report.realized, Decimal('20'))
+        self.assertEqual(report.unrealized, Decimal('20'))
+
+    def test_short_flips_long(self):
+        position = Position('BTC', 'USD')
+        position.add('ask', to_fixed('100'), to_fixed('2'))
+        position.add('bid', to_fixed('90'), to_fixed('3'))
+        report = position.report('bitstamp', Decimal('95'))
+        self.assertEqual(report.amount, Decimal('1'))
+        self.assertEqual(report.average_cost, Decimal('90'))
+        self.assertEqual(report.realized, Decimal('20'))
+        self.assertEqual(report.unrealized, Decimal('5'))
+
+    def test_flat(self):
+        position = Position('BTC', 'USD')
+        position.add('bid', to_fixed('100'), to_fixed('1'))
+        position.add('ask', to_fixed('90'), to_fixed('1'))
+        report = position.report('bitstamp', Decimal('200'))
+        self.assertEqual(report.amount, 0)
+        self.assertIsNone(report.average_cost)
+        self.assertEqual(report.realized, Decimal('-10'))
+        self.assertEqual(report.pnl, Decimal('-10'))
+
+
+class TestLedger(unittest.TestCase):
+    def test_realized_and_pnl(self):
+        ledger = Ledger()
+        ledger.add_fills([fill('bid', '100', '2', '0.1'), fill('bid', '200', '2', '0.1'),
+                          fill('ask', '300', '3', '0.1'), fill('ask', '100', '3', '0.1')])
+        report = ledger.report(MARKS)[0]
+        # long 4 at 150, sell 3 at 300 (+450), then close 1 at 100 (-50) and open a short of 2 at 100
+        self.assertEqual(report.realized, Decimal('400'))
+        self.assertEqual(report.amount, Decimal('-2'))
+        self.assertEqual(report.average_cost, Decimal('100'))
+        self.assertEqual(report.unrealized, Decimal('100'))
+        self.assertEqual(report.fees, {'USD': Decimal('0.4')})
+        self.assertEqual(report.pnl, Decimal('499.6'))
+
+    def test_base_currency_fees_at_mark(self):
+        ledger = Ledger()
+        ledger.add(fill('bid', '100', '1', '0.01', 'BTC'))
+        report = ledger.report(MARKS)[0]
+        self.assertEqual(report.unrealized, Decimal('-50'))
+        self.assertEqual(report.pnl, Decimal('-50.5'))
+
+    def test_aggregate_nets_exchanges(self):
+        ledger = Ledger()
+        ledger.add(fill('bid', '100', '2'))
+        ledger.add(fill('ask', '110', '1', exchange='kraken'))
+        total = ledger.aggregate({('bitstamp', 'BTC/USD'): Decimal('100'),
+                                  ('kraken', 'BTC/USD'): Decimal('120')})['BTC/USD']
+        self.assertIsNone(total.exchange)
+        self.assertEqual(total.amount, Decimal('1'))
+        self.assertEqual(total.mark, Decimal('110'))
+
+    def test_save_and_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'ledger.json')
+            ledger = Ledger()
+            ledger.add_fills([fill('bid', '100', '2', '0.1', fill_id='1'), fill('ask', '120', '1', fill_id='2')])
+            ledger.save(path)
+            restored = Ledger.load(path)
+            self.assertEqual(restored.report(MARKS), ledger.report(MARKS))
+            self.assertEqual(restored.position('bitstamp', 'BTC/USD').last_fill_id, '2')
+            self.assertEqual(Ledger.load(os.path.join(directory, 'missing.json')).positions, {})
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,87 @@
+"""
+Rounding and checking orders against each exchange's limits, without any network.
+
+run with
+    python -m unittest test.order_rules
+"""
+from decimal import Decimal
+import time
+import unittest
+
+from moneyed import Money
+
+from bitcoin_exchanges import order_rules
+from bitcoin_exchanges.exchange_util import ExchangeError
+from bitcoin_exchanges.order_rules import OrderRules, format_order, get_order_rules, plain, to_decimal
+from bitcoin_exchanges.symbols import SYMBOLS, get_symbol
+
+
+class TestTables(unittest.TestCase):
+    def test_every_pair_has_rules(self):
+        for exchange, pairs in SYMBOLS.items():
+            for pair in pairs:
+                rules = get_order_rules(exchange, pair[0])
+                self.assertEqual(rules.price_step, Decimal(1).scaleb(-pair[3]))
+                self.assertEqual(rules.amount_step, Decimal(1).scaleb(-pair[4]))
+
+    def test_limits_follow_the_pair(self):
+        self.assertEqual(get_order_rules('bitfinex', 'ETH/BTC').min_amount, Decimal('0.1'))
+        self.assertEqual(get_order_rules('poloniex', 'ETH/BTC').min_total, Decimal('0.0001'))
+        self.assertEqual(get_order_rules('poloniex').min_total, Decimal('1'))
+        self.assertIsNone(get_order_rules('bitstamp').min_amount)
+        self.assertEqual(get_order_rules('huobi').price_band, Decimal('0.1'))
+        self.assertEqual(get_order_rules('btcchina').nudge, Decimal('-0.0001'))
+        self.assertIs(get_order_rules('kraken', 'XXBTZEUR'), get_order_rules('kraken', 'BTC/EUR'))
+
+
+class TestFormat(unittest.TestCase):
+    def test_rounds_away_from_the_market(self):
+        rules = OrderRules(get_symbol('okcoin'))
+        self.assertEqual(rules.format('1.23456', '400.129', 'bid'), ('1.234', '400.12'))
+        self.assertEqual(rules.format('1.23456', '400.121', 'ask'), ('1.234', '400.13'))
+        self.assertEqual(rules.format('1.5', '400', 'sell'), ('1.5', '400'))
+
+    def test_inputs(self):
+        rules = OrderRules(get_symbol('bitstamp'))
+        self.assertEqual(rules.format(0.1, Money('399.999', 'USD'), 'buy'), ('0.1', '399.99'))
+        self.assertEqual(rules.format(Decimal('1E-8'), 500000, 'bid'), ('0.00000001', '500000'))
+        self.assertEqual(to_decimal(0.1), Decimal('0.1'))
+        self.assertEqual(plain(Decimal('1.2300E+3')), '1230')
+
+    def test_invalid(self):
+        rules = OrderRules(get_symbol('okcoin'))
+        self.assertRaises(ExchangeError, rules.format, '0.0009', '400', 'bid')  # rounds down to 0
+        self.assertRaises(ExchangeError, rules.format, '1', '0', 'ask')
+        self.assertRaises(ExchangeError, rules.format, '-1', '400', 'ask')
+
+    def test_min_amount_and_total(self):
+        rules = OrderRules(get_symbol('okcoin'), min_amount='0.01')
+        self.assertEqual(rules.format('0.01', '400', 'bid'), ('0.01', '400'))
+        self.assertRaises(ExchangeError, rules.format, '0.0099', '400', 'bid')
+        rules = OrderRules(get_symbol('bitstamp'), min_total='5')
+        self.assertEqual(rules.format('0.0125', '400', 'bid'), ('0.0125', '400'))
+        self.assertRaises(ExchangeError, rules.format, '0.0124', '400', 'bid')
+
+    def test_round_number_nudge(self):
+        rules = OrderRules(get_symbol('huobi'), nudge='0.001')
+        self.assertEqual(rules.format('2', '400', 'bid'), ('2.001', '399.99'))
+        self.assertEqual(rules.format('2', '400', 'ask'), ('2.001', '400.01'))
+        self.assertEqual(rules.format('2.5', '400.5', 'ask'), ('2.5', '400.5'))
+
+    def test_price_band(self):
+        rules = OrderRules(get_symbol('huobi'), price_band='0.1')
+        self.assertTrue(rules.needs_reference())
+        self.assertRaises(ExchangeError, rules.format, '1', '2500', 'bid')  # no reference price yet
+        rules.reference_price, rules.reference_time = Decimal('2500'), time.time()
+        self.assertFalse(rules.needs_reference())
+        self.assertEqual(rules.format('1', '2750', 'ask'), ('1', '2750'))
+        self.assertRaises(ExchangeError, rules.format, '1', '2751', 'ask')
+        self.assertRaises(ExchangeError, rules.format, '1', '2249', 'bid')
+        rules.reference_time -= order_rules.REFERENCE_MAX_AGE + 1
+        self.assertTrue(rules.needs_reference())
+        self.assertRaises(ExchangeError, rules.format, '1', '2500', 'bid')
+
+    def test_set_reference_price(self):
+        order_rules.set_reference_price('huobi', 'BTC/CNY', Money('2500', 'CNY'))
+        self.assertEqual(format_order('huobi', '1.5', '2600.5', 'bid'), ('1.5', '2600.5'))
+        self.assertRaises(ExchangeError, format_order, 'huobi', '1.5', '3000', 'bid')
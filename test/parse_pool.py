@@ -0,0 +1,108 @@
+"""
+Fixed-point conversion, and parsing raw order books in the pool, without any network.
+
+run with
+    python -m unittest test.parse_pool
+"""
+from decimal import Decimal
+import json
+import unittest
+
+from bitcoin_exchanges.exchange_util import ExchangeError
+from bitcoin_exchanges.kraken import Kraken
+from bitcoin_exchanges.okcoin import OKCoin, MAX_BOOK_SIZE
+from bitcoin_exchanges.parse_pool import ParsePool, SCALE, _fixed_side, from_fixed, levels, to_fixed
+from bitcoin_exchanges.poloniex import Poloniex
+from bitcoin_exchanges.symbols import get_symbol
+
+
+class TestFixed(unittest.TestCase):
+    def test_plain(self):
+        self.assertEqual(to_fixed(3), 3 * SCALE)
+        self.assertEqual(to_fixed('3'), 3 * SCALE)
+        self.assertEqual(to_fixed('0.00000001'), 1)
+        self.assertEqual(to_fixed('.5'), SCALE / 2)
+        self.assertEqual(to_fixed('+2.25'), 225000000)
+        self.assertEqual(to_fixed(0.1), 10000000)
+
+    def test_truncates_past_scale(self):
+        self.assertEqual(to_fixed('1.123456789'), 112345678)
+        self.assertEqual(to_fixed('0.000000009'), 0)
+
+    def test_negative(self):
+        self.assertEqual(to_fixed('-0.5'), -SCALE / 2)
+        self.assertEqual(to_fixed('-1.123456789'), -112345678)  # truncated toward zero
+        self.assertEqual(to_fixed(-4), -4 * SCALE)
+
+    def test_exponent(self):
+        self.assertEqual(to_fixed('1e-3'), 100000)
+        self.assertEqual(to_fixed('1.5E2'), 150 * SCALE)
+        self.assertEqual(to_fixed('-2e-8'), -2)
+        self.assertEqual(to_fixed('1e-9'), 0)
+
+    def test_from_fixed(self):
+        self.assertEqual(from_fixed(112345678), Decimal('1.12345678'))
+        self.assertEqual(from_fixed(-1), Decimal('-0.00000001'))
+        for text in ('400.5', '0.00000001', '-12.3456789'):
+            self.assertEqual(from_fixed(to_fixed(text)), Decimal(text))
+
+
+class TestFixedSide(unittest.TestCase):
+    def test_best_first(self):
+        self.assertEqual(_fixed_side([['400', '1'], ['401', '2']], True),
+                         [(to_fixed('401'), to_fixed('2')), (to_fixed('400'), to_fixed('1'))])
+        self.assertEqual(_fixed_side([['402', '1'], ['401', '2']], False),
+                         [(to_fixed('401'), to_fixed('2')), (to_fixed('402'), to_fixed('1'))])
+
+    def test_dict_items_and_limit(self):
+        items = [{'price': '400', 'amount': '1'}, {'price': '399', 'amount': '1.5'}, {'price': '398', 'amount': '3'}]
+        self.assertEqual(_fixed_side(items, True, 2),
+                         [(to_fixed('400'), to_fixed('1')), (to_fixed('399'), to_fixed('1.5'))])
+
+    def test_one_level(self):
+        self.assertEqual(_fixed_side([['400', '1']], False), [(to_fixed('400'), SCALE)])
+        self.assertEqual(_fixed_side([], True), [])
+
+
+class TestBookRequest(unittest.TestCase):
+    def test_specs(self):
+        url, params, path = Kraken.book_request(get_symbol('kraken', 'BTC/EUR'), 5)
+        self.assertEqual((url, params, path), ('https://api.kraken.com/0/public/Depth',
+                                               {'pair': 'XXBTZEUR', 'count': 5}, ('result', 'XXBTZEUR')))
+        url, params, path = OKCoin.book_request(get_symbol('okcoin', 'BTC/USD'), 10 * MAX_BOOK_SIZE)
+        self.assertEqual(params['size'], MAX_BOOK_SIZE)
+        self.assertNotIn('size', OKCoin.book_request(get_symbol('okcoin', 'BTC/USD'))[1])
+        self.assertIsNone(Poloniex.book_request(get_symbol('poloniex', 'ETH/BTC'), 5))
+
+
+class TestParsePool(unittest.TestCase):
+    def setUp(self):
+        self.pool = ParsePool(processes=1, slots=1)
+        self.pool.start()
+
+    def tearDown(self):
+        self.pool.stop()
+
+    def test_parse(self):
+        raw = json.dumps({'bids': [['400.5', '1.123456789'], ['401', '2']], 'asks': [['402', '1e-3'], ['403', '-0']]})
+        book = self.pool.parse('bitstamp', raw)
+        self.assertEqual((book.exchange, book.pair), ('bitstamp', 'BTC/USD'))
+        self.assertEqual(levels(book, 'bids'), [(Decimal('401'), Decimal('2')),
+                                                (Decimal('400.5'), Decimal('1.12345678'))])
+        self.assertEqual(levels(book, 'asks'), [(Decimal('402'), Decimal('0.001')), (Decimal('403'), Decimal(0))])
+
+    def test_path_and_depth(self):
+        raw = json.dumps({'result': {'XXBTZEUR': {'bids': [['300', '1', 1], ['299', '1', 1]],
+                                                  'asks': [['301', '1', 1]]}}})
+        book = self.pool.parse('kraken', raw, 'BTC/EUR', ('result', 'XXBTZEUR'), depth=1)
+        self.assertEqual(levels(book, 'bids'), [(Decimal('300'), Decimal('1'))])
+        self.assertEqual(levels(book, 'asks'), [(Decimal('301'), Decimal('1'))])
+
+    def test_invalid_book(self):
+        self.assertRaises(ExchangeError, self.pool.parse, 'bitstamp', '{"error": "busy"}')
+        self.assertRaises(ExchangeError, self.pool.parse, 'bitstamp', 'not json')
+        # the slot was given back
+        self.assertEqual(levels(self.pool.parse('bitstamp', '{"bids": [], "asks": []}'), 'bids'), [])
+
+    def test_not_started(self):
+        self.assertRaises(ExchangeError, ParsePool().parse, 'bitstamp', '{}')
@@ -0,0 +1,152 @@
+"""
+Planning and running rebalancing transfers against stand-in exchanges, without any network.
+
+run with
+    python -m unittest test.rebalance
+"""
+from decimal import Decimal
+import itertools
+import random
+import unittest
+
+from bitcoin_exchanges import config
+from bitcoin_exchanges.exchange_util import ExchangeError
+from bitcoin_exchanges.rebalance import Rebalancer, min_cost_flow
+
+
+class StandIn(object):
+    """An exchange client which hands out made up deposit addresses, and records its withdrawals."""
+
+    def __init__(self, name, withdrawal_currencies=(), deposit_currencies=('BTC',)):
+        self.name = name
+        self.withdrawal_currencies = withdrawal_currencies
+        self.deposit_currencies = deposit_currencies
+        self.withdrawals = []
+
+    def get_deposit_address(self, currency='BTC'):
+        if currency not in self.deposit_currencies:
+            raise ExchangeError(self.name, 'deposits of %s are not supported' % currency)
+        return '%s-%s' % (currency, self.name)
+
+    def withdraw(self, amount, address):
+        self.withdrawals.append((amount, address))
+        return 'sent'
+
+
+def cheapest_max_flow(supplies, demands, costs):
+    """The least cost of sending the most possible, by trying every flow."""
+    edges = sorted(costs)
+    best = None
+    ranges = [range(min(supplies[s], demands[t]) + 1) for s, t in edges]
+    for amounts in itertools.product(*ranges):
+        sent = dict(zip(edges, amounts))
+        if any(sum(a for (s, t), a in sent.items() if s == source) > supply for source, supply in supplies.items()):
+            continue
+        if any(sum(a for (s, t), a in sent.items() if t == sink) > demand for sink, demand in demands.items()):
+            continue
+        key = (-sum(amounts), sum(a * costs[edge] for edge, a in sent.items()))
+        if best is None or key < best:
+            best = key
+    return -best[0], best[1]
+
+
+class TestMinCostFlow(unittest.TestCase):
+    def test_prefers_cheap_edges(self):
+        flows = min_cost_flow({'a': 5, 'b': 5}, {'x': 4, 'y': 4},
+                              {('a', 'x'): 1, ('a', 'y'): 5, ('b', 'x'): 5, ('b', 'y'): 1})
+        self.assertEqual(flows, {('a', 'x'): 4, ('b', 'y'): 4})
+
+    def test_reroutes_through_residual_edges(self):
+        # the cheapest first path a->x has to be partly undone for b, which can only reach x
+        flows = min_cost_flow({'a': 2, 'b': 2}, {'x': 2, 'y': 2},
+                              {('a', 'x'): 1, ('a', 'y'): 2, ('b', 'x'): 3})
+        self.assertEqual(flows, {('a', 'y'): 2, ('b', 'x'): 2})
+
+    def test_unreachable_demand_is_left(self):
+        self.assertEqual(min_cost_flow({'a': 3}, {'x': 2, 'y': 2}, {('a', 'x'): 1}), {('a', 'x'): 2})
+
+    def test_matches_exhaustive_search(self):
+        rand = random.Random(1)
+        for _ in range(50):
+            supplies = dict(('s%d' % i, rand.randint(0, 3)) for i in range(3))
+            demands = dict(('t%d' % i, rand.randint(0, 3)) for i in range(2))
+            costs = dict(((s, t), rand.randint(1, 9)) for s in supplies for t in demands if rand.random() < 0.8)
+            flows = min_cost_flow(supplies, demands, costs)
+            for source, supply in supplies.items():
+                self.assertLessEqual(sum(a for (s, t), a in flows.items() if s == source), supply)
+            for sink, demand in demands.items():
+                self.assertLessEqual(sum(a for (s, t), a in flows.items() if t == sink), demand)
+            self.assertEqual((sum(flows.values()), sum(a * costs[edge] for edge, a in flows.items())),
+                             cheapest_max_flow(supplies, demands, costs))
+
+
+class TestRebalancer(unittest.TestCase):
+    def setUp(self):
+        self.exchanges = {
+            'poloniex': StandIn('poloniex', ('BTC', 'LTC'), ('BTC', 'LTC')),
+            'btcchina': StandIn('btcchina', ('BTC', 'LTC'), ('BTC', 'LTC')),
+            'kraken': StandIn('kraken'),
+            'bitstamp': StandIn('bitstamp'),
+        }
+        self.rebalancer = Rebalancer(self.exchanges)
+
+    def test_plan(self):
+        plan = self.rebalancer.plan({'kraken': 1, 'bitstamp': 1, 'poloniex': 1, 'btcchina': 1},
+                                    available={'poloniex': Decimal(10), 'btcchina': Decimal(6),
+                                               'kraken': Decimal(0), 'bitstamp': Decimal(4)})
+        self.assertEqual(sum(t.amount for t in plan.transfers), Decimal(6))
+        self.assertEqual(set(t.source for t in plan.transfers), set(['poloniex', 'btcchina']))
+        self.assertEqual(sum(t.amount for t in plan.transfers if t.destination == 'kraken'), Decimal(5))
+        # each receiver is short by the fees of the transfers it gets
+        shortfall = {}
+        for t in plan.transfers:
+            shortfall[t.destination] = shortfall.get(t.destination, 0) - t.fee
+        self.assertEqual(plan.unmet, shortfall)
+        self.assertTrue(all(t.fee == Decimal('0.0005') for t in plan.transfers))
+
+    def test_only_withdrawing_exchanges_send(self):
+        plan = self.rebalancer.plan({'poloniex': 1}, available={'poloniex': Decimal(1), 'kraken': Decimal(3)})
+        self.assertEqual(plan.transfers, [])
+        self.assertEqual(plan.unmet, {'poloniex': Decimal(-3), 'kraken': Decimal(3)})
+
+    def test_small_imbalances_are_left(self):
+        plan = self.rebalancer.plan({'poloniex': 1, 'kraken': 1},
+                                    available={'poloniex': Decimal('1.001'), 'kraken': Decimal('0.999')})
+        self.assertEqual(plan.transfers, [])
+        self.assertEqual(plan.unmet, {})
+
+    def test_only_exchanges_taking_the_currency_receive(self):
+        plan = self.rebalancer.plan({'poloniex': 1, 'btcchina': 1, 'kraken': 1}, 'LTC',
+                                    available={'poloniex': Decimal(9), 'btcchina': Decimal(0), 'kraken': Decimal(0)})
+        self.assertEqual([(t.destination, t.amount) for t in plan.transfers], [('btcchina', Decimal(3))])
+        self.assertEqual(plan.unmet, {'poloniex': Decimal(3), 'kraken': Decimal(-3), 'btcchina': Decimal('-0.001')})
+
+    def test_cheaper_withdrawal_fees_are_preferred(self):
+        previous = config.config._provider
+        settings = {'exchange_config': {'poloniex': {'withdrawal_fees': {'BTC': '0.002'}},
+                                        'btcchina': {'withdrawal_fees': {'BTC': '0'}}}}
+        config.set_provider(config.CallableProvider(lambda: settings))
+        self.exchanges['bitstamp'].deposit_currencies = ()  # so there is more to send than kraken needs
+        try:
+            plan = self.rebalancer.plan({'poloniex': 1, 'btcchina': 1, 'kraken': 1, 'bitstamp': 1},
+                                        available={'poloniex': Decimal(3), 'btcchina': Decimal(3)})
+        finally:
+            config.set_provider(previous)
+        self.assertEqual([(t.source, t.amount, t.fee) for t in plan.transfers], [('btcchina', Decimal('1.5'), 0)])
+        self.assertEqual(plan.unmet, {'poloniex': Decimal('1.5'), 'bitstamp': Decimal('-1.5')})
+
+    def test_run_uses_the_currency_address(self):
+        plan = self.rebalancer.plan({'btcchina': 1}, 'LTC', available={'poloniex': Decimal(2)})
+        sent = plan.transfers[0]._replace(address='LTC-btcchina')
+        self.assertEqual(self.rebalancer.run(plan, dry_run=True), [(sent, 'dry run')])
+        self.assertEqual(self.exchanges['poloniex'].withdrawals, [])
+        [(transfer, response)] = self.rebalancer.run(plan, dry_run=False)
+        self.assertEqual(response, 'sent')
+        amount, address = self.exchanges['poloniex'].withdrawals[0]
+        self.assertEqual((str(amount.currency), amount.amount, address), ('LTC', Decimal(2), 'LTC-btcchina'))
+
+    def test_run_keeps_errors(self):
+        plan = self.rebalancer.plan({'kraken': 1}, available={'poloniex': Decimal(2)})
+        plan = plan._replace(currency='LTC', transfers=[t._replace(currency='LTC') for t in plan.transfers])
+        self.assertEqual(self.rebalancer.run(plan, dry_run=True), [])
+        self.assertIn(('poloniex', 'kraken'), self.rebalancer.errors)
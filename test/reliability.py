@@ -0,0 +1,193 @@
+"""
+The retry, retry budget, circuit breaker and timeout state machines, without any network.
+
+run with
+    python -m unittest test.reliability
+"""
+import time
+import unittest
+
+from requests.exceptions import ConnectionError, ConnectTimeout, ReadTimeout
+
+from bitcoin_exchanges.exchange_util import CircuitBreaker, DeadlineExceeded, RetryBudget, RetryPolicy, \
+    TimeoutPolicy, deadline, get_latency_tracker, get_retry_budget
+
+
+class Flaky(object):
+    """Raises the errors given, in turn, then returns 'ok'."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+class TestRetryBudget(unittest.TestCase):
+    def test_withdraw_until_empty(self):
+        budget = RetryBudget(ratio=0.5, max_tokens=2)
+        self.assertTrue(budget.withdraw())
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+
+    def test_successes_refill_up_to_max(self):
+        budget = RetryBudget(ratio=0.5, max_tokens=2)
+        budget.withdraw()
+        budget.withdraw()
+        budget.deposit()
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
+        for _ in range(10):
+            budget.deposit()
+        self.assertEqual(budget.tokens, 2)
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def setUp(self):
+        self.policy = RetryPolicy(max_attempts=3, base_delay=0, max_delay=0)
+
+    def test_idempotent_retries_connection_errors(self):
+        func = Flaky(ConnectionError(), ReadTimeout())
+        self.assertEqual(self.policy.run('test-retry-idempotent', func), 'ok')
+        self.assertEqual(func.calls, 3)
+
+    def test_gives_up_after_max_attempts(self):
+        func = Flaky(ConnectionError(), ConnectionError(), ConnectionError())
+        self.assertRaises(ConnectionError, self.policy.run, 'test-retry-attempts', func)
+        self.assertEqual(func.calls, 3)
+
+    def test_non_idempotent_only_retries_connect_timeouts(self):
+        func = Flaky(ConnectTimeout())
+        self.assertEqual(self.policy.run('test-retry-post', func, idempotent=False), 'ok')
+        func = Flaky(ReadTimeout())
+        self.assertRaises(ReadTimeout, self.policy.run, 'test-retry-post', func, idempotent=False)
+        self.assertEqual(func.calls, 1)
+
+    def test_other_errors_are_not_retried(self):
+        func = Flaky(ValueError())
+        self.assertRaises(ValueError, self.policy.run, 'test-retry-value', func)
+        self.assertEqual(func.calls, 1)
+
+    def test_retry_if_result(self):
+        results = ['stale nonce', 'ok']
+        self.assertEqual(self.policy.run('test-retry-if', lambda: results.pop(0),
+                                         retry_if=lambda result: result == 'stale nonce'), 'ok')
+
+    def test_only_accepted_results_refill_the_budget(self):
+        budget = get_retry_budget('test-retry-if-deposit')
+        self.assertEqual(self.policy.run('test-retry-if-deposit', lambda: 'stale nonce',
+                                         retry_if=lambda result: result == 'stale nonce'), 'stale nonce')
+        self.assertEqual(budget.tokens, budget.max_tokens - 2)  # two retries, and no deposit for the rejection
+        self.policy.run('test-retry-if-deposit', lambda: 'ok', retry_if=lambda result: result == 'stale nonce')
+        self.assertEqual(budget.tokens, budget.max_tokens - 2 + budget.ratio)
+
+    def test_empty_budget_stops_retries(self):
+        budget = get_retry_budget('test-retry-budget')
+        while budget.withdraw():
+            pass
+        func = Flaky(ConnectionError())
+        self.assertRaises(ConnectionError, self.policy.run, 'test-retry-budget', func)
+        self.assertEqual(func.calls, 1)
+
+    def test_deadline_is_not_retried(self):
+        func = Flaky(DeadlineExceeded())
+        self.assertRaises(DeadlineExceeded, self.policy.run, 'test-retry-deadline', func)
+        self.assertEqual(func.calls, 1)
+
+    def test_backoff_is_bounded(self):
+        policy = RetryPolicy(base_delay=0.05, max_delay=0.2)
+        for attempt in range(10):
+            self.assertTrue(0 <= policy.backoff(attempt) <= 0.2)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def trip(self, breaker):
+        for _ in range(breaker.min_requests):
+            self.assertTrue(breaker.allow())
+            breaker.record(False)
+
+    def test_opens_at_error_threshold(self):
+        breaker = CircuitBreaker(window=10, min_requests=4, error_threshold=0.5)
+        for success in (True, True, False):
+            breaker.allow()
+            breaker.record(success)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.allow()
+        breaker.record(False)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.health(), 0.0)
+
+    def test_half_open_probe_closes(self):
+        breaker = CircuitBreaker(min_requests=2, reset_timeout=30, probes=1)
+        self.trip(breaker)
+        breaker.opened_at = time.time() - 31
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(breaker.allow())  # only one probe at a time
+        breaker.record(True)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(breaker.error_rate(), 0.0)
+
+    def test_failed_probe_reopens(self):
+        breaker = CircuitBreaker(min_requests=2, reset_timeout=30)
+        self.trip(breaker)
+        breaker.opened_at = time.time() - 31
+        self.assertTrue(breaker.allow())
+        breaker.record(False)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+    def test_release_frees_probe(self):
+        breaker = CircuitBreaker(min_requests=2, reset_timeout=30)
+        self.trip(breaker)
+        breaker.opened_at = time.time() - 31
+        self.assertTrue(breaker.allow())
+        breaker.release()
+        self.assertTrue(breaker.allow())
+
+    def test_health_falls_with_latency(self):
+        fast, slow = CircuitBreaker(), CircuitBreaker()
+        fast.record(True, 0.1)
+        slow.record(True, 2.0)
+        self.assertGreater(fast.health(), slow.health())
+
+
+class TestTimeoutPolicy(unittest.TestCase):
+    def test_caller_timeout_until_enough_samples(self):
+        policy = TimeoutPolicy()
+        self.assertEqual(policy.timeout('test-timeout-new', 'public', 10), (10, 10))
+        self.assertEqual(policy.timeout('test-timeout-new', 'public', (3, 10)), (3, 10))
+        self.assertIsNone(policy.timeout('test-timeout-new', 'public', None))
+
+    def test_derived_from_latency(self):
+        tracker = get_latency_tracker('test-timeout-fast', 'public')
+        for _ in range(50):
+            tracker.record(0.3)
+        policy = TimeoutPolicy(percentile=0.99, multiplier=3.0, public_floor=0.5, connect_floor=1.0)
+        connect, read = policy.timeout('test-timeout-fast', 'public', 10)
+        self.assertAlmostEqual(read, 0.9)
+        self.assertEqual(connect, 1.0)
+        self.assertEqual(policy.timeout('test-timeout-fast', 'public', 0.6), (0.6, 0.6))
+
+    def test_floors(self):
+        for endpoint in ('public', 'private'):
+            tracker = get_latency_tracker('test-timeout-floor', endpoint)
+            for _ in range(50):
+                tracker.record(0.01)
+        policy = TimeoutPolicy(public_floor=0.5, private_floor=1.0, connect_floor=2.0)
+        self.assertEqual(policy.timeout('test-timeout-floor', 'public', 10), (2.0, 0.5))
+        self.assertEqual(policy.timeout('test-timeout-floor', 'private', 10), (2.0, 1.0))
+
+    def test_deadline(self):
+        policy = TimeoutPolicy()
+        with deadline(0.5):
+            connect, read = policy.timeout('test-timeout-deadline', 'public', 10)
+            self.assertTrue(0 < read <= 0.5 and 0 < connect <= 0.5)
+        with deadline(-1):
+            self.assertRaises(DeadlineExceeded, policy.timeout, 'test-timeout-deadline', 'public', 10)
@@ -0,0 +1,110 @@
+"""
+Splitting parent orders across venues with Router.plan, without any network.
+
+run with
+    python -m unittest test.router
+"""
+from decimal import Decimal
+import unittest
+
+from moneyed import Money
+from requests.exceptions import Timeout
+
+from bitcoin_exchanges.exchange_util import OrderbookItem
+from bitcoin_exchanges.router import UNTRACKED, ChildOrder, Router, Venue
+from bitcoin_exchanges.symbols import get_symbol
+
+
+def venue(exchange, levels, balance, fee='0', fx='1'):
+    return Venue(exchange, get_symbol(exchange), Decimal(fee), Decimal(fx),
+                 [OrderbookItem(Decimal(price), Decimal(amount)) for price, amount in levels], Decimal(balance))
+
+
+def child(exchange, side, amount, price):
+    return ChildOrder(exchange, side, Decimal(amount), Decimal(price), None, None)
+
+
+class TestPlan(unittest.TestCase):
+    def test_fee_and_fx_ordering(self):
+        # kraken's 360 EUR is 397.03 USD with its fee, cheaper than bitstamp's 400 USD at 401
+        venues = [venue('bitstamp', [('400', '5')], '10000', '0.0025'),
+                  venue('kraken', [('360', '1'), ('370', '5')], '10000', '0.0026', '1.1')]
+        self.assertEqual(Router.plan(venues, 'bid', '1.5', '1000'),
+                         [child('bitstamp', 'bid', '0.5', '400'), child('kraken', 'bid', '1', '360')])
+
+    def test_sells_take_the_highest_net_price(self):
+        venues = [venue('bitstamp', [('400', '1')], '10', '0.0025'),
+                  venue('okcoin', [('401', '1'), ('399', '1')], '10', '0.002')]
+        # okcoin's 401 nets 400.198, above bitstamp's 399, which is above okcoin's 399 at 398.202
+        self.assertEqual(Router.plan(venues, 'ask', '2', '0'),
+                         [child('bitstamp', 'ask', '1', '400'), child('okcoin', 'ask', '1', '401')])
+
+    def test_quote_balance_caps_buys(self):
+        venues = [venue('bitstamp', [('400', '5')], '200', '0.0025'), venue('okcoin', [('410', '5')], '10000')]
+        # 200 USD buys 200 / 401 BTC at bitstamp, rounded down to its 8 decimals
+        self.assertEqual(Router.plan(venues, 'bid', '1', '1000'),
+                         [child('bitstamp', 'bid', '0.49875311', '400'), child('okcoin', 'bid', '0.501', '410')])
+
+    def test_base_balance_caps_sells(self):
+        venues = [venue('bitstamp', [('400', '5')], '0.3'), venue('okcoin', [('390', '5')], '10')]
+        self.assertEqual(Router.plan(venues, 'ask', '1', '0'),
+                         [child('bitstamp', 'ask', '0.3', '400'), child('okcoin', 'ask', '0.7', '390')])
+
+    def test_limit_cut_off(self):
+        venues = [venue('bitstamp', [('400', '1'), ('405', '1'), ('410', '1')], '10000', '0.0025')]
+        # 405 is 406.0125 with the fee, over the limit, so only the first level is taken
+        self.assertEqual(Router.plan(venues, 'bid', '3', '406'), [child('bitstamp', 'bid', '1', '400')])
+        self.assertEqual(Router.plan(venues, 'ask', '3', '500'), [])
+
+    def test_child_dropped_by_format_order(self):
+        # 0.01 BTC at 400 is below bitstamp's 5 USD minimum, so it is left for the next round
+        venues = [venue('okcoin', [('399', '0.5')], '10000'), venue('bitstamp', [('400', '5')], '10000')]
+        self.assertEqual(Router.plan(venues, 'bid', '0.51', '1000'), [child('okcoin', 'bid', '0.5', '399')])
+
+    def test_worst_level_price(self):
+        venues = [venue('okcoin', [('399', '0.5'), ('400', '0.5'), ('401', '0.5')], '10000')]
+        self.assertEqual(Router.plan(venues, 'bid', '0.75', '1000'), [child('okcoin', 'bid', '0.75', '400')])
+
+
+class StandIn(object):
+    """An exchange module, with a client whose book and balance are made up, and whose orders can not be looked up."""
+
+    def __init__(self, name, fail=None):
+        self.name = name
+        self.fail = fail
+        self.eclass = self
+        self.exchange = self
+
+    def get_order_book(self, depth=None):
+        if self.fail is not None:
+            raise self.fail
+        return {'bids': [['400', '1']], 'asks': [['401', '1']]}
+
+    def format_book_item(self, item):
+        return OrderbookItem(Decimal(item[0]), Decimal(item[1]))
+
+    def get_balance(self, btype='available'):
+        return self
+
+    def getMoneys(self, currency):
+        return Money(1000, currency)
+
+    def get_open_orders(self):
+        raise Timeout('timed out')
+
+
+class TestRoute(unittest.TestCase):
+    def test_transport_errors_are_kept(self):
+        router = Router({'bitstamp': StandIn('bitstamp', Timeout('timed out')), 'okcoin': StandIn('okcoin')})
+        self.assertEqual([v.exchange for v in router.venues('bid')], ['okcoin'])
+        self.assertIsInstance(router.errors['bitstamp'], Timeout)
+        self.assertEqual(router.unfilled([child('okcoin', 'bid', '1', '401')._replace(order_id='1')]), 0)
+        self.assertIsInstance(router.errors['okcoin'], Timeout)
+
+    def test_untracked_exchanges_only_get_single_rounds(self):
+        exchanges = {'btcchina': StandIn('btcchina'), 'okcoin': StandIn('okcoin')}
+        router = Router(exchanges, fx={'CNY': '1'})
+        self.assertEqual(sorted(v.exchange for v in router.venues('bid')), ['btcchina', 'okcoin'])
+        self.assertEqual([v.exchange for v in router.venues('bid', UNTRACKED)], ['okcoin'])
+        orders, remaining = router.route('bid', '1', '1000', dry_run=True, rounds=2)
+        self.assertEqual([c.exchange for c in orders], ['okcoin'])
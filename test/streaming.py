@@ -0,0 +1,169 @@
+"""
+Run the streaming feeds against a local websocket stand-in, replaying scripted exchange messages.
+
+run with
+    python -m unittest test.streaming
+"""
+from base64 import b64encode
+from decimal import Decimal
+import hashlib
+import json
+import socket
+import struct
+import threading
+import time
+import unittest
+
+from moneyed import Money
+
+from bitcoin_exchanges.exchange_util import OrderbookItem, Ticker, Trade
+from bitcoin_exchanges import streaming
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+class StandIn(object):
+    """A single connection websocket server which sends a script of messages, and records what it receives."""
+
+    def __init__(self, script):
+        self.script = script
+        self.received = []
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(1)
+        self.url = 'ws://127.0.0.1:%d/' % self.sock.getsockname()[1]
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def serve(self):
+        conn, addr = self.sock.accept()
+        request = ''
+        while '\r\n\r\n' not in request:
+            request += conn.recv(4096)
+        key = [line.split(':', 1)[1].strip() for line in request.split('\r\n')
+               if line.lower().startswith('sec-websocket-key')][0]
+        conn.sendall('HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                     'Sec-WebSocket-Accept: %s\r\n\r\n' % b64encode(hashlib.sha1(key + WS_GUID).digest()))
+        conn.settimeout(0.2)
+        for message in self.script:
+            self.receive(conn)
+            conn.sendall(self.frame(json.dumps(message)))
+        time.sleep(0.5)
+        self.receive(conn)
+        conn.close()
+
+    @staticmethod
+    def frame(text):
+        if len(text) < 126:
+            header = struct.pack('!BB', 0x81, len(text))
+        elif len(text) < 65536:
+            header = struct.pack('!BBH', 0x81, 126, len(text))
+        else:
+            header = struct.pack('!BBQ', 0x81, 127, len(text))
+        return header + text
+
+    def receive(self, conn):
+        try:
+            data = conn.recv(65536)
+        except socket.timeout:
+            return
+        while len(data) >= 6:
+            length = ord(data[1]) & 0x7f
+            offset = 2
+            if length == 126:
+                length = struct.unpack('!H', data[2:4])[0]
+                offset = 4
+            mask = data[offset:offset + 4]
+            payload = data[offset + 4:offset + 4 + length]
+            self.received.append(''.join(chr(ord(c) ^ ord(mask[i % 4])) for i, c in enumerate(payload)))
+            data = data[offset + 4 + length:]
+
+
+class SnapshotBitstampFeed(streaming.BitstampFeed):
+    """The bitstamp feed, with the REST order book replaced by a fixed snapshot."""
+
+    def snapshot(self, pair):
+        return ([OrderbookItem(Decimal('400'), Decimal('1')), OrderbookItem(Decimal('399'), Decimal('2'))],
+                [OrderbookItem(Decimal('401'), Decimal('1'))], None, 1000.0)
+
+
+def run_stream(feed, script):
+    server = StandIn(script)
+    market = streaming.MarketStream(feed, url=server.url)
+    market.start()
+    server.thread.join(5)
+    market.stop()
+    return market, server
+
+
+@unittest.skipIf(streaming.websocket is None, 'websocket-client is not installed')
+class TestStreaming(unittest.TestCase):
+    def test_bitstamp_diffs_on_rest_snapshot(self):
+        diff = lambda timestamp, bids, asks: {'event': 'data', 'channel': 'diff_order_book',
+                                              'data': json.dumps({'timestamp': timestamp, 'bids': bids,
+                                                                  'asks': asks})}
+        market, server = run_stream(SnapshotBitstampFeed(), [
+            {'event': 'pusher:connection_established', 'data': '{}'},
+            diff('999', [['400', '5']], []),  # older than the snapshot
+            diff('1001', [['400', '0'], ['399.5', '3']], [['401', '2']]),
+            {'event': 'trade', 'channel': 'live_trades',
+             'data': json.dumps({'id': 7, 'price': 400.5, 'amount': 0.1, 'type': 0, 'timestamp': '1002'})},
+        ])
+        book = market.books['BTC/USD']
+        self.assertEqual(book.bids(), [OrderbookItem(Decimal('399.5'), Decimal('3')),
+                                       OrderbookItem(Decimal('399'), Decimal('2'))])
+        self.assertEqual(book.best_ask(), OrderbookItem(Decimal('401'), Decimal('2')))
+        self.assertIn('diff_order_book', server.received[0])
+
+    def test_bitfinex_book_and_ticker(self):
+        tickers, trades = [], []
+        feed = streaming.BitfinexFeed()
+        server = StandIn([
+            {'event': 'subscribed', 'channel': 'book', 'chanId': 1, 'pair': 'BTCUSD'},
+            {'event': 'subscribed', 'channel': 'ticker', 'chanId': 2, 'pair': 'BTCUSD'},
+            {'event': 'subscribed', 'channel': 'trades', 'chanId': 3, 'pair': 'BTCUSD'},
+            [1, [[400, 1, 2.5], [399, 2, 1], [401, 1, -1.5]]],
+            [1, 400, 0, 1],  # remove the 400 bid
+            [1, 402, 1, -0.5],
+            [1, 'hb'],
+            [2, 399, 1, 401, 1.5, 1, 0.01, 400, 1234.5, 410, 390],
+            [3, 'te', '5-BTCUSD', 1417000000, 400.5, -0.25],
+        ])
+        market = streaming.MarketStream(feed, url=server.url, on_ticker=lambda pair, t: tickers.append(t),
+                                        on_trade=lambda pair, t: trades.append(t))
+        market.start()
+        server.thread.join(5)
+        market.stop()
+        book = market.books['BTC/USD']
+        self.assertEqual(book.bids(), [OrderbookItem(Decimal('399'), Decimal('1'))])
+        self.assertEqual(book.asks(), [OrderbookItem(Decimal('401'), Decimal('1.5')),
+                                       OrderbookItem(Decimal('402'), Decimal('0.5'))])
+        self.assertIsInstance(tickers[0], Ticker)
+        self.assertEqual(tickers[0].last, Money('400', 'USD'))
+        self.assertEqual(trades, [Trade('bitfinex', '5-BTCUSD', 'ask', Money('400.5', 'USD'), Money('0.25', 'BTC'),
+                                        1417000000.0)])
+
+    def test_sequence_gap_resyncs(self):
+        calls = []
+
+        class Feed(SnapshotBitstampFeed):
+            def snapshot(self, pair):
+                calls.append(pair)
+                return [OrderbookItem(Decimal('400'), Decimal('1'))], [], 10, None
+
+        market = streaming.MarketStream(Feed())
+        market.resync('BTC/USD')
+        market.book_update('BTC/USD', [('bid', Decimal('400'), Decimal('2'))], sequence=11)
+        market.book_update('BTC/USD', [('bid', Decimal('398'), Decimal('1'))], sequence=13)  # 12 is missing
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(market.books['BTC/USD'].sequence, 13)
+        self.assertEqual(market.books['BTC/USD'].bids(), [OrderbookItem(Decimal('400'), Decimal('1')),
+                                                         OrderbookItem(Decimal('398'), Decimal('1'))])
+
+    def test_feeds_must_handle(self):
+        class Feed(streaming.Feed):
+            name = 'bitstamp'
+
+        self.assertRaises(TypeError, Feed, ['BTC/USD'])
@@ -0,0 +1,73 @@
+"""
+Rolling windows over trade tapes, without any network.
+
+run with
+    python -m unittest test.trade_tape
+"""
+from decimal import Decimal
+import unittest
+
+from moneyed import Money
+
+from bitcoin_exchanges import trade_tape
+from bitcoin_exchanges.exchange_util import Trade
+from bitcoin_exchanges.parse_pool import to_fixed
+from bitcoin_exchanges.trade_tape import RollingWindow, TradeTape
+
+
+def trade(trade_id, price, amount, timestamp):
+    return Trade('bitstamp', trade_id, 'bid', Money(price, 'USD'), Money(amount, 'BTC'), timestamp)
+
+
+class TestRollingWindow(unittest.TestCase):
+    def test_buckets_leave_one_at_a_time(self):
+        window = RollingWindow(60, buckets=6)
+        window.add(1000, to_fixed('400'), to_fixed('1'))
+        window.add(1015, to_fixed('402'), to_fixed('1'))
+        self.assertEqual(window.stats(1015).volume, Decimal('2'))
+        self.assertEqual(window.stats(1015).vwap, Decimal('401'))
+        # buckets are 10 seconds, so the trade at 1000 is in bucket 100, which leaves when bucket 106 starts
+        self.assertEqual(window.stats(1059).count, 2)
+        self.assertEqual(window.stats(1060).count, 1)
+        self.assertEqual(window.stats(1060).vwap, Decimal('402'))
+
+    def test_gap_longer_than_the_window(self):
+        window = RollingWindow(60, buckets=6)
+        for t in (1000, 1010, 1020, 1030):
+            window.add(t, to_fixed('400'), to_fixed('1'))
+        # nothing for ten minutes, so every bucket has expired, however many it skipped
+        window.add(1630, to_fixed('410'), to_fixed('2'))
+        stats = window.stats(1630)
+        self.assertEqual((stats.count, stats.volume, stats.vwap), (1, Decimal('2'), Decimal('410')))
+        self.assertEqual(window.totals, [to_fixed('2'), to_fixed('410') * to_fixed('2'), 1, 0.0, 0])
+        self.assertEqual(window.stats(2000), trade_tape.WindowStats(None, Decimal(0), 0, None))
+
+    def test_late_trades(self):
+        window = RollingWindow(60, buckets=6)
+        window.add(1100, to_fixed('400'), to_fixed('1'))
+        window.add(1050, to_fixed('400'), to_fixed('1'))  # still in the window
+        window.add(1030, to_fixed('400'), to_fixed('1'))  # already out of it
+        self.assertEqual(window.stats(1100).count, 2)
+
+
+class TestTradeTape(unittest.TestCase):
+    def test_add_dedupes(self):
+        tape = TradeTape('bitstamp', windows=(60,))
+        first = [trade('1', '400', '1', 1000.0), trade('2', '410', '1', 1001.0)]
+        self.assertEqual(tape.add(first), first)
+        self.assertEqual(tape.add(first + [trade('3', '405', '2', 1002.0)]), [trade('3', '405', '2', 1002.0)])
+        self.assertEqual(tape.last.trade_id, '3')
+        stats = tape.stats(60, 1002)
+        self.assertEqual((stats.count, stats.volume, stats.vwap), (3, Decimal('4'), Decimal('405')))
+        self.assertIsNotNone(stats.volatility)
+
+    def test_seen_trades_limit(self):
+        tape = TradeTape('bitstamp', windows=(60,))
+        trades = [trade(str(i), '400', '0.01', 1000.0) for i in range(trade_tape.SEEN_TRADES + 1)]
+        self.assertEqual(len(tape.add(trades)), len(trades))
+        self.assertEqual(len(tape._seen), trade_tape.SEEN_TRADES)
+        # the oldest id was forgotten to make room, so it is taken again, but the recent ones are not
+        self.assertEqual(tape.add(trades[:1]), trades[:1])
+        self.assertEqual(tape.add(trades[-10:]), [])
+        self.assertEqual(len(tape._seen), trade_tape.SEEN_TRADES)
+        self.assertEqual(tape.stats(60, 1000).count, trade_tape.SEEN_TRADES + 2)